@@ -0,0 +1,98 @@
+import time
+import logging
+
+from django.conf import settings
+
+from utils.cache import TTLCache, model_row_values, model_from_row_values
+
+
+logger = logging.getLogger('django')
+
+BUCKET_CACHE_TIMEOUT = getattr(settings, 'BUCKET_CACHE_TIMEOUT', 10)                  # 秒
+BUCKET_CACHE_MAX_SIZE = getattr(settings, 'BUCKET_CACHE_MAX_SIZE', 5000)
+BUCKET_CACHE_STATS_LOG_INTERVAL = getattr(settings, 'BUCKET_CACHE_STATS_LOG_INTERVAL', 600)   # 秒, <=0不输出
+
+
+class BucketCache:
+    """
+    存储桶元数据缓存，桶名 -> (桶的数据库行值, 所属用户的数据库行值)
+
+    缓存的是行数据不是模型实例，每次获取都重建新的实例，避免多线程共享同一个实例；
+    桶的修改(权限、锁、备注、删除等)通过Bucket.save()/delete()失效本进程缓存，
+    其他进程或其他服务的修改依赖较短的过期时间失效。
+    不缓存不存在的桶，避免新创建的桶在其他进程中短时间内不可见。
+    """
+    def __init__(self, timeout=BUCKET_CACHE_TIMEOUT, max_size=BUCKET_CACHE_MAX_SIZE,
+                 stats_log_interval=BUCKET_CACHE_STATS_LOG_INTERVAL):
+        self._cache = TTLCache(timeout=timeout, max_size=max_size)
+        self.stats_log_interval = stats_log_interval
+        self._last_log_time = time.monotonic()
+
+    def get(self, bucket_name: str, loader):
+        """
+        获取桶实例，缓存未命中时通过loader从数据库加载
+
+        :param bucket_name: 桶名
+        :param loader: callable(bucket_name) -> Bucket() or None
+        :return:
+            Bucket()
+            None        # 不存在
+        """
+        self.maybe_log_stats()
+        item = self._cache.get(bucket_name)
+        if item is not None:
+            return self._build_bucket(item)
+
+        bucket = loader(bucket_name)
+        if bucket is not None:
+            self.set(bucket)
+
+        return bucket
+
+    def set(self, bucket):
+        user = bucket.user if bucket.user_id else None
+        user_values = model_row_values(user) if user is not None else None
+        item = (type(bucket), bucket._state.db, model_row_values(bucket),
+                type(user) if user is not None else None, user_values)
+        self._cache.set(bucket.name, item)
+
+    @staticmethod
+    def _build_bucket(item):
+        bucket_model, using, bucket_values, user_model, user_values = item
+        bucket = model_from_row_values(bucket_model, bucket_values, using=using)
+        if user_model is not None:
+            user = model_from_row_values(user_model, user_values, using=using)
+            bucket_model.user.field.set_cached_value(bucket, user)
+
+        return bucket
+
+    def invalidate(self, bucket_name: str):
+        self._cache.invalidate(bucket_name)
+
+    def clear(self):
+        self._cache.clear()
+
+    def get_stats(self):
+        """
+        缓存统计，每次命中即少一次查询bucket表(select_related user)的数据库往返
+
+        :return: dict
+        """
+        stats = self._cache.get_stats()
+        stats['db_queries_saved'] = stats['hits']
+        return stats
+
+    def maybe_log_stats(self):
+        interval = self.stats_log_interval
+        if interval <= 0:
+            return
+
+        now = time.monotonic()
+        if now - self._last_log_time < interval:
+            return
+
+        self._last_log_time = now
+        logger.info(f'bucket cache stats: {self.get_stats()}')
+
+
+bucket_cache = BucketCache()
@@ -0,0 +1,321 @@
+import os
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+
+logger = logging.getLogger('django.request')
+stats_logger = logging.getLogger('counters')
+
+
+class BufferedCounters:
+    """
+    对象下载次数、存储桶流量和存储桶对象数量、总大小的进程内缓冲计数
+
+    下载次数不再每次下载都UPDATE对象元数据行(热点对象行锁竞争)，在内存中按对象累加；
+    流量按(桶, 用户, 日期)累加上传(入)和下载(出)字节数；
+    对象上传、覆盖、删除、多部分上传完成时按桶累加对象数量和总大小的增量，写入存储桶的objs_count、size；
+    后台线程每flush_interval秒批量写入数据库，进程退出(包括uwsgi平滑重启)时也会写入一次，写入失败的计数放回下次再写入；
+    后台线程每stats_log_interval秒把get_stats()输出到counters日志
+    """
+    def __init__(self, flush_interval: float = 5, lag_warning: float = 60, stats_log_interval: float = 60):
+        """
+        :param flush_interval: 写入数据库的时间间隔，秒
+        :param lag_warning: 未写入的计数等待超过此时间(秒)输出警告日志
+        :param stats_log_interval: 输出统计日志的时间间隔，秒；0不输出
+        """
+        self.flush_interval = flush_interval
+        self.lag_warning = lag_warning
+        self.stats_log_interval = stats_log_interval
+        self._downloads = {}    # (model, obj_id): count
+        self._traffic = {}      # (bucket_id, user_id, date): [bytes_in, bytes_out]
+        self._bucket_stats = {}     # bucket_id: [count, size]
+        self._oldest_time = None    # 最早的未写入计数的时间
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flusher_pid = None
+        self._last_flush_time = None
+        self._last_flush_duration = 0
+        self._flush_failures = 0
+
+    def incr_download(self, model, obj_id: int, count: int = 1):
+        """
+        对象下载次数增加
+
+        :param model: 对象所在桶的对象模型类
+        :param obj_id: 对象id
+        """
+        with self._lock:
+            key = (model, obj_id)
+            self._downloads[key] = self._downloads.get(key, 0) + count
+            self._mark_pending()
+
+        self._ensure_flusher()
+
+    def move_downloads(self, model, old_id: int, new_id: int):
+        """
+        对象id变更(覆盖上传重建元数据)时，未写入的下载次数转到新的对象id
+
+        :param model: 对象所在桶的对象模型类
+        """
+        with self._lock:
+            count = self._downloads.pop((model, old_id), 0)
+            if count:
+                key = (model, new_id)
+                self._downloads[key] = self._downloads.get(key, 0) + count
+
+    def add_traffic(self, bucket_id: int, user_id: int, bytes_in: int = 0, bytes_out: int = 0):
+        """
+        记录存储桶的流量
+
+        :param bucket_id: 桶id
+        :param user_id: 请求的用户id，匿名用户为0
+        :param bytes_in: 上传字节数
+        :param bytes_out: 下载字节数
+        """
+        if not bytes_in and not bytes_out:
+            return
+
+        with self._lock:
+            key = (bucket_id, user_id or 0, timezone.localdate())
+            item = self._traffic.setdefault(key, [0, 0])
+            item[0] += bytes_in
+            item[1] += bytes_out
+            self._mark_pending()
+
+        self._ensure_flusher()
+
+    def add_bucket_stats(self, bucket_id: int, count: int = 0, size: int = 0):
+        """
+        记录一个桶的对象数量和总大小增量
+
+        :param bucket_id: 桶id
+        :param count: 对象数量增量
+        :param size: 对象总大小增量
+        """
+        if not count and not size:
+            return
+
+        with self._lock:
+            delta = self._bucket_stats.setdefault(bucket_id, [0, 0])
+            delta[0] += count
+            delta[1] += size
+            self._mark_pending()
+
+        self._ensure_flusher()
+
+    def pending_bucket_stats(self):
+        """
+        还未写入数据库的桶统计增量
+
+        :return: {bucket_id: (count, size)}
+        """
+        with self._lock:
+            return {k: tuple(v) for k, v in self._bucket_stats.items()}
+
+    def _mark_pending(self):
+        if self._oldest_time is None:
+            self._oldest_time = time.time()
+
+    def _ensure_flusher(self):
+        """
+        启动本进程的后台写入线程，fork后的子进程需要重新启动
+        """
+        pid = os.getpid()
+        if self._flusher_pid == pid or self.flush_interval <= 0:
+            return
+
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+
+            self._flusher_pid = pid
+
+        t = threading.Thread(target=self._flush_loop, name='counters-flusher', daemon=True)
+        t.start()
+
+    def _flush_loop(self):
+        last_log_time = time.time()
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f'Failed to flush counters, {str(e)}')
+
+            if 0 < self.stats_log_interval <= (time.time() - last_log_time):
+                last_log_time = time.time()
+                self.log_stats()
+
+    def log_stats(self):
+        """
+        统计输出到counters日志，日志格式含进程id
+        """
+        stats_logger.info(f'Counters stats: {self.get_stats()}')
+
+    def flush(self, blocking: bool = False):
+        """
+        把缓冲的计数写入数据库
+
+        :param blocking: True(等待正在进行的写入完成后再写入); False(有正在进行的写入时直接返回)
+        :return: 写入的记录数
+        """
+        if not self._flush_lock.acquire(blocking=blocking, timeout=10 if blocking else -1):
+            return 0
+
+        try:
+            start = time.time()
+            with self._lock:
+                downloads, self._downloads = self._downloads, {}
+                traffic, self._traffic = self._traffic, {}
+                bucket_stats, self._bucket_stats = self._bucket_stats, {}
+                oldest_time, self._oldest_time = self._oldest_time, None
+
+            flushed = self._flush_downloads(downloads) + self._flush_traffic(traffic) + \
+                self._flush_bucket_stats(bucket_stats)
+            with self._lock:
+                if self._downloads or self._traffic or self._bucket_stats:    # 写入失败放回的计数
+                    self._oldest_time = min(oldest_time or start, self._oldest_time or start)
+
+            self._last_flush_time = time.time()
+            self._last_flush_duration = self._last_flush_time - start
+            lag = self.get_flush_lag()
+            if lag > self.lag_warning:
+                logger.warning(f'Counters flush lag is {lag:.1f}s, {self.get_stats()}')
+
+            return flushed
+        finally:
+            self._flush_lock.release()
+
+    def _flush_downloads(self, downloads: dict):
+        """
+        同一个表中增量相同的对象合并为一次UPDATE
+        """
+        groups = {}     # (model, count): [obj_id, ]
+        for (model, obj_id), count in downloads.items():
+            groups.setdefault((model, count), []).append(obj_id)
+
+        flushed = 0
+        for (model, count), obj_ids in groups.items():
+            try:
+                model.objects.filter(id__in=obj_ids).update(dlc=F('dlc') + count)
+            except Exception as e:
+                logger.error(f'Failed to flush download count of table {model._meta.db_table}, {str(e)}')
+                self._flush_failures += 1
+                with self._lock:
+                    for obj_id in obj_ids:
+                        key = (model, obj_id)
+                        self._downloads[key] = self._downloads.get(key, 0) + count
+                continue
+
+            flushed += len(obj_ids)
+
+        return flushed
+
+    def _flush_traffic(self, traffic: dict):
+        from .models import BucketTraffic
+
+        flushed = 0
+        for (bucket_id, user_id, date), (bytes_in, bytes_out) in traffic.items():
+            try:
+                self._save_traffic(BucketTraffic, bucket_id, user_id, date, bytes_in, bytes_out)
+            except Exception as e:
+                logger.error(f'Failed to flush traffic of bucket(id={bucket_id}), {str(e)}')
+                self._flush_failures += 1
+                with self._lock:
+                    item = self._traffic.setdefault((bucket_id, user_id, date), [0, 0])
+                    item[0] += bytes_in
+                    item[1] += bytes_out
+                continue
+
+            flushed += 1
+
+        return flushed
+
+    def _flush_bucket_stats(self, bucket_stats: dict):
+        from .models import Bucket
+
+        flushed = 0
+        now_time = timezone.now()
+        for bucket_id, (count, size) in bucket_stats.items():
+            if not count and not size:
+                continue
+
+            try:
+                Bucket.objects.filter(id=bucket_id).update(
+                    objs_count=F('objs_count') + count, size=F('size') + size, stats_time=now_time)
+            except Exception as e:
+                logger.error(f'Failed to flush stats of bucket(id={bucket_id}), {str(e)}')
+                self._flush_failures += 1
+                with self._lock:
+                    delta = self._bucket_stats.setdefault(bucket_id, [0, 0])
+                    delta[0] += count
+                    delta[1] += size
+                continue
+
+            flushed += 1
+
+        return flushed
+
+    @staticmethod
+    def _save_traffic(model, bucket_id, user_id, date, bytes_in, bytes_out):
+        lookups = {'bucket_id': bucket_id, 'user_id': user_id, 'date': date}
+        r = model.objects.filter(**lookups).update(bytes_in=F('bytes_in') + bytes_in,
+                                                   bytes_out=F('bytes_out') + bytes_out)
+        if r > 0:
+            return
+
+        try:
+            model(bytes_in=bytes_in, bytes_out=bytes_out, **lookups).save(force_insert=True)
+        except IntegrityError:
+            # 其他进程已创建
+            model.objects.filter(**lookups).update(bytes_in=F('bytes_in') + bytes_in,
+                                                   bytes_out=F('bytes_out') + bytes_out)
+
+    def get_flush_lag(self):
+        """
+        最早的未写入计数已等待的时间，秒；没有未写入的计数时为0
+        """
+        oldest_time = self._oldest_time
+        if oldest_time is None:
+            return 0
+
+        return max(time.time() - oldest_time, 0)
+
+    def get_stats(self):
+        """
+        :return: dict
+        """
+        with self._lock:
+            pending_downloads = len(self._downloads)
+            pending_traffic = len(self._traffic)
+            pending_bucket_stats = len(self._bucket_stats)
+
+        return {
+            'pending_downloads': pending_downloads,
+            'pending_traffic': pending_traffic,
+            'pending_bucket_stats': pending_bucket_stats,
+            'flush_lag': round(self.get_flush_lag(), 3),
+            'last_flush_time': self._last_flush_time,
+            'last_flush_duration': round(self._last_flush_duration, 3),
+            'flush_failures': self._flush_failures
+        }
+
+
+buffered_counters = BufferedCounters(flush_interval=getattr(settings, 'COUNTERS_FLUSH_INTERVAL', 5),
+                                     lag_warning=getattr(settings, 'COUNTERS_FLUSH_LAG_WARNING', 60),
+                                     stats_log_interval=getattr(settings, 'COUNTERS_STATS_LOG_INTERVAL', 60))
+
+
+@atexit.register
+def _flush_counters_at_exit():
+    try:
+        buffered_counters.flush(blocking=True)
+    except Exception:
+        pass
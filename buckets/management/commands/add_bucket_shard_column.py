@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from buckets.models import Bucket, Archive
+
+
+class Command(BaseCommand):
+    """
+    为存储桶表和存储桶归档表添加元数据分片列shard，部署元数据分片功能前需要先执行
+    """
+
+    help = """** manage.py add_bucket_shard_column **"""
+
+    def handle(self, *args, **options):
+        for model in [Bucket, Archive]:
+            table_name = model._meta.db_table
+            connection = connections[router.db_for_write(model)]
+            try:
+                with connection.cursor() as cursor:
+                    columns = [c.name for c in connection.introspection.get_table_description(cursor, table_name)]
+                    if 'shard' in columns:
+                        self.stdout.write(f'Table {table_name} already has column shard, skip.')
+                        continue
+
+                    cursor.execute(f"ALTER TABLE `{table_name}` ADD COLUMN `shard` VARCHAR(32) NOT NULL DEFAULT '';")
+            except Exception as e:
+                raise CommandError(f'Failed to add column shard to table {table_name}, {str(e)}')
+
+            self.stdout.write(self.style.SUCCESS(f'Added column shard to table {table_name}.'))
@@ -0,0 +1,156 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from buckets.models import Bucket, Archive, BucketTablePool
+from buckets.shards import is_valid_shard, table_shard_cache
+from s3api.models import BucketTableMigration
+from s3api.managers import get_parts_model_class
+from s3api.utils import (get_obj_model_class, create_table_for_model_class, delete_table_for_model_class,
+                         ensure_table_for_model_class, set_table_migration_completed)
+
+
+class Command(BaseCommand):
+    """
+    维护存储桶表池：为每个分片保持一定数量预先创建的空对象元数据表和part元数据表，创建存储桶时直接领取，不需要在请求中建表
+
+    每一轮先回收：创建中断(创建中超时)的表删除；已领取且桶已记录表名的池记录删除；
+    已领取超时但没有桶记录表名(桶创建中断)的空表恢复为可领取；然后补充各分片可领取的表到预留数量
+    """
+
+    help = """** manage.py bucket_table_pool **
+           ** manage.py bucket_table_pool --size 20 --shard shard1 --shard shard2 --once **
+        """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', default=getattr(settings, 'BUCKET_TABLE_POOL_SIZE', 20), dest='size', type=int,
+            help='The number of free table pairs reserved for each shard.',
+        )
+        parser.add_argument(
+            '--shard', default=None, dest='shards', action='append',
+            help='The shard to reserve tables for, default is the shards for new buckets.',
+        )
+        parser.add_argument(
+            '--interval', default=10, dest='interval', type=float,
+            help='Seconds to sleep between rounds.',
+        )
+        parser.add_argument(
+            '--abandoned-timeout', default=600, dest='abandoned_timeout', type=int,
+            help='Seconds after which tables being created or claimed without bucket are recycled.',
+        )
+        parser.add_argument(
+            '--once', default=False, nargs='?', dest='once', type=bool, const=True,
+            help='Run one round and exit.',
+        )
+
+    def handle(self, *args, **options):
+        size = options['size']
+        shards = options['shards']
+        if shards is None:
+            shards = getattr(settings, 'METADATA_SHARDS_FOR_NEW_BUCKET', [''])
+
+        if size < 0:
+            raise CommandError("Invalid value of size.")
+
+        invalid = [s for s in shards if not is_valid_shard(s)]
+        if invalid:
+            raise CommandError(f'Invalid shards {invalid}.')
+
+        for model in [BucketTablePool, BucketTableMigration]:
+            if not ensure_table_for_model_class(model):
+                raise CommandError(f'Failed to create the table of {model.__name__}.')
+
+        timeout = timedelta(seconds=options['abandoned_timeout'])
+        while True:
+            self.recycle(timeout=timeout)
+            for shard in shards:
+                self.fill(shard=shard, size=size)
+
+            if options['once']:
+                break
+
+            time.sleep(options['interval'])
+
+    def fill(self, shard: str, size: int):
+        """
+        补充分片可领取的表到预留数量
+        """
+        free = BucketTablePool.objects.filter(shard=shard, status=BucketTablePool.STATUS_FREE).count()
+        created = 0
+        start_time = time.time()
+        for _ in range(size - free):
+            if not self.create_pool_tables(shard=shard):
+                break
+
+            created += 1
+
+        if created:
+            self.stdout.write(f'Shard "{shard}": created {created} table pairs, free {free + created}, '
+                              f'in {time.time() - start_time:.1f}s.')
+
+    def create_pool_tables(self, shard: str):
+        """
+        创建一对表，标记数据迁移完成后才能被领取
+
+        :return: True(success); False(failed)
+        """
+        pool = BucketTablePool.objects.create(shard=shard, status=BucketTablePool.STATUS_CREATING)
+        obj_model, parts_model = self.get_pool_models(pool)
+        if not create_table_for_model_class(obj_model) or not create_table_for_model_class(parts_model):
+            self.stdout.write(self.style.ERROR(f'Failed to create tables of pool(id={pool.id}).'))
+            self.delete_pool_tables(pool)
+            return False
+
+        table_name = pool.get_bucket_table_name()
+        for name in [BucketTableMigration.NAME_NA_MD5, BucketTableMigration.NAME_SKEY,
+                     BucketTableMigration.NAME_MP_ETAG]:
+            set_table_migration_completed(table_name=table_name, name=name)
+
+        pool.status = BucketTablePool.STATUS_FREE
+        pool.save(update_fields=['status'])
+        return True
+
+    @staticmethod
+    def get_pool_models(pool):
+        """
+        :return: (obj_model, parts_model)
+        """
+        table_name = pool.get_bucket_table_name()
+        parts_table_name = pool.get_parts_table_name()
+        table_shard_cache.set(table_name, pool.shard)   # 在池记录的分片建表
+        table_shard_cache.set(parts_table_name, pool.shard)
+        return get_obj_model_class(table_name), get_parts_model_class(parts_table_name)
+
+    def delete_pool_tables(self, pool):
+        obj_model, parts_model = self.get_pool_models(pool)
+        if delete_table_for_model_class(obj_model) and delete_table_for_model_class(parts_model):
+            BucketTableMigration.objects.filter(table_name=pool.get_bucket_table_name()).delete()
+            pool.delete()
+
+    def recycle(self, timeout):
+        deadline = timezone.now() - timeout
+        for pool in BucketTablePool.objects.filter(status=BucketTablePool.STATUS_CREATING, create_time__lt=deadline):
+            self.delete_pool_tables(pool)
+            self.stdout.write(f'Deleted tables of interrupted pool(id={pool.id}).')
+
+        for pool in BucketTablePool.objects.filter(status=BucketTablePool.STATUS_CLAIMED, claimed_time__lt=deadline):
+            table_name = pool.get_bucket_table_name()
+            if Bucket.objects.filter(collection_name=table_name).exists() or \
+                    Archive.objects.filter(table_name=table_name).exists():
+                pool.delete()       # 表已属于桶
+                continue
+
+            obj_model, parts_model = self.get_pool_models(pool)
+            if obj_model.objects.exists() or parts_model.objects.exists():
+                self.stdout.write(self.style.WARNING(
+                    f'Tables of abandoned pool(id={pool.id}, bucket_id={pool.bucket_id}) are not empty, skip.'))
+                continue
+
+            r = BucketTablePool.objects.filter(id=pool.id, status=BucketTablePool.STATUS_CLAIMED).update(
+                status=BucketTablePool.STATUS_FREE, bucket_id=0, claimed_time=None)
+            if r > 0:
+                self.stdout.write(f'Recycled abandoned tables of pool(id={pool.id}).')
@@ -1,21 +1,19 @@
-import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 
 from django.utils import timezone
 from django.core.management.base import BaseCommand, CommandError
-from django.db.utils import ProgrammingError
 
-from s3api.utils import BucketFileManagement, delete_table_for_model_class
 from buckets.models import Archive
-from utils.oss import HarborObject
-from s3api.managers import get_parts_model_class
+from buckets.purge import BucketPurger
 
 
 class Command(BaseCommand):
     """
     清理bucket命令，清理满足彻底删除条件的对象和目录
+
+    每个桶由BucketPurger清理，可断点续传；多个桶由线程池并行清理
     """
-    pool_sem = threading.Semaphore(100)  # 定义最多同时启用多少个线程
 
     help = 'Really delete objects and directories that have been deleted from a bucket'
 
@@ -33,6 +31,30 @@ class Command(BaseCommand):
             '--all-deleted', default=None, nargs='?', dest='all_deleted', const=True, # 当命令行有此参数时取值const, 否则取值default
             help='All buckets that have been deleted will be clearing.',
         )
+        parser.add_argument(
+            '--bucket-workers', default=4, dest='bucket_workers', type=int,
+            help='The number of buckets cleared at the same time.',
+        )
+        parser.add_argument(
+            '--batch-size', default=1000, dest='batch_size', type=int,
+            help='The number of objects read and deleted in one batch.',
+        )
+        parser.add_argument(
+            '--workers', default=8, dest='workers', type=int,
+            help='The number of threads removing rados data of one bucket.',
+        )
+        parser.add_argument(
+            '--aio-batch', default=64, dest='aio_batch', type=int,
+            help='The number of rados objects removed concurrently by aio in one thread.',
+        )
+        parser.add_argument(
+            '--rate', default=0, dest='rate', type=float,
+            help='Max objects deleted per second of one bucket, 0 is unlimited.',
+        )
+        parser.add_argument(
+            '--progress-interval', default=10, dest='progress_interval', type=float,
+            help='Seconds between two progress reports.',
+        )
 
     def handle(self, *args, **options):
         daysago = options.get('daysago', 30)
@@ -44,13 +66,19 @@ class Command(BaseCommand):
             raise CommandError("Clearing buckets cancelled.")
 
         self._clear_datetime = timezone.now() - timedelta(days=daysago)
+        self.purger_options = {
+            'batch_size': options['batch_size'], 'workers': options['workers'], 'aio_batch': options['aio_batch'],
+            'rate': options['rate'], 'progress_interval': options['progress_interval']
+        }
+        if min(options['bucket_workers'], options['batch_size'], options['workers'], options['aio_batch']) <= 0:
+            raise CommandError("Invalid value of workers or batch size.")
 
         buckets = self.get_buckets(**options)
 
         if input('Are you sure you want to do this?\n\n' + "Type 'yes' to continue, or 'no' to cancel: ") != 'yes':
             raise CommandError("Clearing buckets cancelled.")
 
-        self.clear_buckets(buckets)
+        self.clear_buckets(buckets, workers=options['bucket_workers'])
 
     def get_buckets(self, **options):
         """
@@ -78,23 +106,6 @@ class Command(BaseCommand):
         self.stdout.write(self.style.NOTICE('Will clear all buckets named {0}'.format(bucketname)))
         return Archive.objects.filter(name=bucketname, type=Archive.TYPE_S3).all()
 
-    def get_objs_and_dirs(self, modelclass, num=1000):
-        """
-        获取对象,默认最多返回1000条
-
-        :param modelclass: 对象和目录的模型类
-        :param num: 获取数量
-        :param by_filters: 是否按条件过滤，当整个bucket是删除的状态就不需要过滤
-        :return:
-        """
-        try:
-            objs = modelclass.objects.filter(fod=True).all()[:num]
-        except Exception as e:
-            self.stdout.write(self.style.ERROR('Error when clearing bucket table named {0},'.format(
-                modelclass.Meta.db_table) + str(e)))
-            return None
-        return objs
-
     def is_meet_delete_time(self, bucket):
         """
         归档的桶是否满足删除时间要求，即是否可以清理
@@ -124,82 +135,39 @@ class Command(BaseCommand):
 
         :param bucket: Archive()
         :return:
+            True    # 清理完成
+            False
         """
-        self.stdout.write('Now clearing bucket named {0}'.format(bucket.name))
-        table_name = bucket.get_bucket_table_name()
-        modelclass = BucketFileManagement(collection_name=table_name).get_obj_model_class()
-
         # 已删除归档的桶不满足删除时间条件，直接返回不清理
         if not self.is_meet_delete_time(bucket):
-            return
+            return False
 
-        pool_name = bucket.get_pool_name()
-        ho = HarborObject(pool_name=pool_name, obj_id='')
+        self.stdout.write('Now clearing bucket named {0}'.format(bucket.name))
+        purger = BucketPurger(bucket=bucket, log=self.stdout.write, **self.purger_options)
         try:
-            while True:
-                objs = self.get_objs_and_dirs(modelclass=modelclass)
-                if objs is None or len(objs) <= 0:
-                    break
-
-                for obj in objs:
-                    if obj.is_file():
-                        obj_key = obj.get_obj_key(bucket.id)
-                        ho.reset_obj_id_and_size(obj_id=obj_key, obj_size=obj.si)
-                        ok, err = ho.delete(obj_size=obj.si)
-                        if ok:
-                            obj.delete()
-                        else:
-                            self.stdout.write(self.style.WARNING(
-                                f"Failed to deleted a object from ceph:" + err))
-                    else:
-                        obj.delete()
-
-                self.stdout.write(self.style.SUCCESS(f"Success deleted {objs.count()} objects from bucket {bucket.name}."))
-
-            # 如果bucket对应表没有对象了，删除bucket和表
-            if modelclass.objects.filter(fod=True).count() == 0:
-                ok = delete_table_for_model_class(modelclass)       # delete bucket table
-                if ok and self.delete_bucket_and_part_table(bucket):
-                    self.stdout.write(self.style.WARNING(f"deleted bucket and it's table, part table:{bucket.name}"))
-                    self.stdout.write(self.style.SUCCESS('Clearing bucket named {0} is completed'.format(bucket.name)))
-                else:
-                    self.stdout.write(self.style.ERROR(f'deleted bucket table error:{bucket.name}'))
-        except (ProgrammingError, Exception) as e:
-            self.stdout.write(self.style.ERROR(f'err=({e}) e.args: {e.args}'))
-            if e.args[0] == 1146:  # table not exists
-                if self.delete_bucket_and_part_table(bucket):
-                    self.stdout.write(self.style.WARNING(f"deleted bucket and it's table, part table:{bucket.name}"))
-                    self.stdout.write(self.style.SUCCESS('Clearing bucket named {0} is completed'.format(bucket.name)))
-            else:
-                self.stdout.write(self.style.ERROR(f'deleted bucket({bucket.name}) error: {e}'))
-
-        self.pool_sem.release()     # 可用线程数+1
-
-    def delete_bucket_and_part_table(self, bucket):
-        parts_table_name = bucket.get_parts_table_name()
-        parts_model_class = get_parts_model_class(parts_table_name)
-        ok = delete_table_for_model_class(parts_model_class)  # delete parts table
+            ok = purger.purge()
+        except Exception as e:
+            self.stdout.write(self.style.ERROR(f'deleted bucket({bucket.name}) error: {e}'))
+            return False
+
         if ok:
-            bucket.delete()
-            return True
+            self.stdout.write(self.style.WARNING(f"deleted bucket and it's table, part table:{bucket.name}"))
+            self.stdout.write(self.style.SUCCESS('Clearing bucket named {0} is completed'.format(bucket.name)))
+        else:
+            self.stdout.write(self.style.ERROR(
+                f'Clearing bucket named {bucket.name} is not completed, {purger.failed_count} objects failed, '
+                f'run again to retry.'))
 
-        return False
+        return ok
 
-    def clear_buckets(self, buckets):
+    def clear_buckets(self, buckets, workers: int = 4):
         """
         多线程清理bucket
         :param buckets:
+        :param workers: 同时清理的桶数
         :return: None
         """
-        for bucket in buckets:
-            if self.pool_sem.acquire():     # 可用线程数-1，控制线程数量，当前正在运行线程数量达到上限会阻塞等待
-                worker = threading.Thread(target=self.clear_one_bucket, kwargs={'bucket': bucket})
-                worker.start()
-
-        # 等待所有线程结束
-        while True:
-            c = threading.active_count()
-            if c <= 1:
-                break
-
-        self.stdout.write(self.style.SUCCESS('Successfully clear {0} buckets'.format(buckets.count())))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(self.clear_one_bucket, buckets))
+
+        self.stdout.write(self.style.SUCCESS('Successfully clear {0} buckets'.format(results.count(True))))
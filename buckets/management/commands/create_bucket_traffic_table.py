@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from buckets.models import BucketTraffic
+from s3api.utils import create_table_for_model_class, is_model_table_exists
+
+
+class Command(BaseCommand):
+    """
+    创建存储桶流量统计数据库表
+    """
+
+    help = """** manage.py create_bucket_traffic_table **"""
+
+    def handle(self, *args, **options):
+        BucketTraffic._meta.managed = True
+        if is_model_table_exists(BucketTraffic):
+            self.stdout.write(self.style.SUCCESS('The table already exists'))
+            return
+
+        if input('Are you sure to create the table?\n\n' + "Type 'yes' to continue, or 'no' to cancel: ") != 'yes':
+            raise CommandError("cancelled.")
+
+        if create_table_for_model_class(BucketTraffic):
+            self.stdout.write(self.style.SUCCESS('Create the table Successfully.'))
+        else:
+            self.stdout.write(self.style.ERROR('Failed to create the table'))
@@ -0,0 +1,71 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from buckets.models import Bucket
+
+
+class Command(BaseCommand):
+    """
+    全表统计存储桶的对象数量和总大小，校正增量统计的偏差；
+    大表全表统计耗时长，应在业务低峰期执行，统计期间有对象上传删除时仍可能有少量偏差
+    """
+
+    help = """** manage.py reconcile_bucket_stats **
+           ** manage.py reconcile_bucket_stats --bucket-name xxx --sleep 5 --dry-run **
+        """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default='', dest='bucket_name', type=str,
+            help='Only reconcile the stats of this bucket.',
+        )
+        parser.add_argument(
+            '--sleep', default=1.0, dest='sleep', type=float,
+            help='Seconds to sleep after each bucket, to limit the load on the database.',
+        )
+        parser.add_argument(
+            '--dry-run', default=False, nargs='?', dest='dry_run', type=bool, const=True,
+            help='Only report the drift, do not update the stats.',
+        )
+
+    def handle(self, *args, **options):
+        bucket_name = options['bucket_name']
+        sleep = options['sleep']
+        dry_run = options['dry_run']
+
+        qs = Bucket.objects.all()
+        if bucket_name:
+            qs = qs.filter(name=bucket_name)
+
+        bucket_ids = list(qs.order_by('id').values_list('id', flat=True))
+        if bucket_name and not bucket_ids:
+            raise CommandError("Bucket not found.")
+
+        self.stdout.write(self.style.NOTICE(f'Will reconcile stats of {len(bucket_ids)} buckets.'))
+        drift_count = 0
+        for bucket_id in bucket_ids:
+            bucket = Bucket.objects.filter(id=bucket_id).first()
+            if bucket is None:
+                continue
+
+            start_time = time.time()
+            old_count, old_size = bucket.objs_count, bucket.size
+            try:
+                data = bucket.recompute_stats(save=not dry_run)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Failed to reconcile stats of bucket {bucket.name}, {str(e)}'))
+                continue
+
+            count_drift = data['count'] - old_count
+            size_drift = data['space'] - old_size
+            msg = f'Bucket {bucket.name}: count={data["count"]}, size={data["space"]}'
+            if count_drift or size_drift:
+                drift_count += 1
+                msg += f', drift count={count_drift}, size={size_drift}'
+
+            self.stdout.write(msg + f', in {time.time() - start_time:.1f}s.')
+            if sleep > 0:
+                time.sleep(sleep)
+
+        self.stdout.write(self.style.SUCCESS(f'Reconciling stats completed, {drift_count} buckets have drift.'))
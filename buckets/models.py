@@ -11,6 +11,9 @@ from django.db.models import F
 
 from utils.storagers import PathParser
 from utils.md5 import EMPTY_HEX_MD5, get_str_hexMD5
+from .cache import bucket_cache
+from .counters import buffered_counters
+from .table_pool import get_pool_parts_table_name
 
 
 def rand_hex_string(length=10):
@@ -52,6 +55,8 @@ class BucketBase(models.Model):
     ftp_ro_password = models.CharField(verbose_name='FTP只读访问密码', max_length=20, blank=True)
     pool_name = models.CharField(verbose_name='PoolName', max_length=32, default='obs')
     type = models.SmallIntegerField(choices=TYPE_CHOICES, default=TYPE_COMMON, verbose_name='桶类型')
+    shard = models.CharField(verbose_name='元数据分片', max_length=32, default='', blank=True,
+                             help_text='桶的对象元数据表和part元数据表所在的分片，空表示默认数据库')
 
     class Meta:
         abstract = True
@@ -99,12 +104,20 @@ class Bucket(BucketBase):
         return cls.objects.filter(user=user).count()
 
     @classmethod
-    def get_bucket_by_name(cls, bucket_name):
+    def get_bucket_by_name(cls, bucket_name, use_cache=True):
         """
         获取存储通对象
         :param bucket_name: 存储通名称
+        :param use_cache: True(先从缓存获取); False(直接查询数据库)
         :return: Bucket对象; None(不存在)
         """
+        if use_cache:
+            return bucket_cache.get(bucket_name, loader=cls._get_bucket_by_name_from_db)
+
+        return cls._get_bucket_by_name_from_db(bucket_name)
+
+    @staticmethod
+    def _get_bucket_by_name_from_db(bucket_name):
         return Bucket.objects.select_related('user').filter(name=bucket_name).first()
 
     def save(self, *args, **kwargs):
@@ -113,6 +126,12 @@ class Bucket(BucketBase):
         if not self.ftp_ro_password or len(self.ftp_ro_password) < 6:
             self.ftp_ro_password = rand_hex_string()
         super().save(**kwargs)
+        bucket_cache.invalidate(self.name)
+
+    def delete(self, *args, **kwargs):
+        ret = super().delete(*args, **kwargs)
+        bucket_cache.invalidate(self.name)
+        return ret
 
     def delete_and_archive(self):
         """
@@ -139,6 +158,7 @@ class Bucket(BucketBase):
             a.ftp_ro_password = self.ftp_ro_password
             a.pool_name = self.pool_name
             a.type = self.type
+            a.shard = self.shard
             a.save()
         except Exception as e:
             return False
@@ -173,6 +193,10 @@ class Bucket(BucketBase):
         """
         bucket对应的对象分段元数据数据库表名
         """
+        name = get_pool_parts_table_name(self.collection_name)
+        if name:
+            return name
+
         return f'parts_{self.id}'
 
     def set_permission(self, public: int = 2):
@@ -248,7 +272,15 @@ class Bucket(BucketBase):
 
         return True
 
-    def __update_stats(self):
+    def recompute_stats(self, save=True):
+        """
+        全表统计存储桶的对象数量和总大小；大表统计耗时长，只用于校正增量统计的偏差
+
+        :param save: True(统计结果更新到数据库)
+        :return: dict
+            {'count': xxx, 'space': xxx}
+        :raises: Exception
+        """
         from s3api.utils import get_bfmanager
 
         table_name = self.get_bucket_table_name()
@@ -259,20 +291,23 @@ class Bucket(BucketBase):
         if space is None:
             space = 0
 
-        now_time = timezone.now()
-        self.objs_count = count
-        self.size = space
-        self.stats_time = now_time
-        try:
-            self.save(update_fields=['objs_count', 'size', 'stats_time'])
-        except Exception as e:
-            pass
+        if save:
+            now_time = timezone.now()
+            self.objs_count = count
+            self.size = space
+            self.stats_time = now_time
+            Bucket.objects.filter(id=self.id).update(objs_count=count, size=space, stats_time=now_time)
+
+        return {'count': count, 'space': space}
 
     def get_stats(self, now=False):
         """
         获取存储桶统计数据
 
-        :param now:  重新统计
+        对象数量和总大小在对象上传、删除时增量更新，这里不再全表统计；
+        校正统计偏差使用命令reconcile_bucket_stats
+
+        :param now: True(先把本进程累计的增量写入数据库，再读取最新统计数据)
         :return: dict
             {
                 'stats': {
@@ -281,16 +316,12 @@ class Bucket(BucketBase):
                 'stats_time': xxxx-xx-xx xx:xx:xx
             }
         """
-        # 强制重新统计，或者旧的统计结果时间超过了50分钟， 满足其一条件重新统计
-        now_t = timezone.now() - timedelta(minutes=50)
-        ts_now = now_t.timestamp()
-        stats_t = self.stats_time
-        if stats_t:
-            ts_stats = stats_t.timestamp()
-        else:
-            ts_stats = 0
-        if now or (ts_now > ts_stats):
-            self.__update_stats()
+        if now:
+            buffered_counters.flush(blocking=True)
+            try:
+                self.refresh_from_db(fields=['objs_count', 'size', 'stats_time'])
+            except Exception as e:
+                pass
 
         stats = {'space': self.size, 'count': self.objs_count}
         time_str = self.stats_time.astimezone(timezone.get_current_timezone()).isoformat()
@@ -404,6 +435,10 @@ class Archive(BucketBase):
         """
         bucket对应的对象分段元数据数据库表名
         """
+        name = get_pool_parts_table_name(self.table_name)
+        if name:
+            return name
+
         return f'parts_{self.original_id}'
 
     def get_pool_name(self):
@@ -434,6 +469,67 @@ class BucketLimitConfig(models.Model):
         return obj.limit
 
 
+class BucketTraffic(models.Model):
+    """
+    存储桶每日流量统计，按桶和请求用户累计上传(入)和下载(出)字节数
+    """
+    id = models.BigAutoField(primary_key=True)
+    bucket_id = models.BigIntegerField(verbose_name='bucket id')
+    user_id = models.BigIntegerField(verbose_name='用户id', default=0, help_text='匿名用户为0')
+    date = models.DateField(verbose_name='日期')
+    bytes_in = models.BigIntegerField(verbose_name='上传字节数', default=0)
+    bytes_out = models.BigIntegerField(verbose_name='下载字节数', default=0)
+
+    class Meta:
+        managed = False
+        db_table = 'bucket_traffic'
+        unique_together = ('bucket_id', 'user_id', 'date')
+        verbose_name = '存储桶流量'
+        verbose_name_plural = verbose_name
+
+    def __repr__(self):
+        return f'BucketTraffic(bucket_id={self.bucket_id}, user_id={self.user_id}, date={self.date})'
+
+
+class BucketTablePool(models.Model):
+    """
+    预先创建的存储桶对象元数据表和part元数据表(bucket_pN、parts_pN)，创建存储桶时领取一对，不需要在请求中建表
+
+    领取时记录桶id，桶的collection_name记录领取的对象表名；桶记录表名后池记录由表池命令删除
+    """
+    STATUS_CREATING = 0
+    STATUS_FREE = 1
+    STATUS_CLAIMED = 2
+    STATUS_CHOICES = (
+        (STATUS_CREATING, '创建中'),
+        (STATUS_FREE, '可领取'),
+        (STATUS_CLAIMED, '已领取')
+    )
+
+    id = models.BigAutoField(primary_key=True)
+    shard = models.CharField(verbose_name='元数据分片', max_length=32, default='', blank=True)
+    status = models.SmallIntegerField(verbose_name='状态', choices=STATUS_CHOICES, default=STATUS_CREATING)
+    bucket_id = models.BigIntegerField(verbose_name='bucket id', default=0, help_text='领取表的存储桶')
+    create_time = models.DateTimeField(verbose_name='创建时间', auto_now_add=True)
+    claimed_time = models.DateTimeField(verbose_name='领取时间', null=True, default=None)
+
+    class Meta:
+        managed = False
+        db_table = 'bucket_table_pool'
+        indexes = [models.Index(fields=('shard', 'status'), name='shard_status_idx')]
+        verbose_name = '存储桶表池'
+        verbose_name_plural = verbose_name
+
+    def __repr__(self):
+        return f'BucketTablePool(id={self.id}, shard={self.shard}, status={self.status})'
+
+    def get_bucket_table_name(self):
+        return f'bucket_p{self.id}'
+
+    def get_parts_table_name(self):
+        return f'parts_p{self.id}'
+
+
 SHARE_ACCESS_NO = 0
 SHARE_ACCESS_READONLY = 1
 SHARE_ACCESS_READWRITE = 2
@@ -499,6 +595,8 @@ class BucketFileBase(models.Model):
     md5 = models.CharField(default='', max_length=32, verbose_name='md5')  # 该文件的md5码，32位十六进制字符串
     share = models.SmallIntegerField(verbose_name='分享访问权限', choices=SHARE_ACCESS_CHOICES, default=SHARE_ACCESS_NO)
 
+    SHARDED_BY_BUCKET = True    # 按桶分片，db路由由表名查询桶所在的分片数据库
+
     class Meta:
         abstract = True
         app_label = 'metadata'  # 用于db路由指定此模型对应的数据库
@@ -689,15 +787,11 @@ class BucketFileBase(models.Model):
 
     def download_cound_increase(self):
         """
-        下载次数加1
+        下载次数加1，计数先在进程内缓冲，定时批量写入数据库
 
         :return: True(success); False(error)
         """
-        self.dlc = F('dlc') + 1 # (self.dlc or 0) + 1  # 下载次数+1
-        try:
-            self.save(update_fields=['dlc'])
-        except:
-            return False
+        buffered_counters.incr_download(type(self), self.id)
         return True
 
     def is_file(self):
@@ -0,0 +1,169 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from s3api.models import BucketTableMigration
+from s3api.managers import get_parts_model_class
+from s3api.utils import (BucketFileManagement, delete_table_for_model_class, is_model_table_exists,
+                         ensure_table_for_model_class)
+from utils.oss import HarborObject
+from utils.oss.pyrados import HarborObjectStructure
+
+
+class BucketPurger:
+    """
+    已删除归档桶的清理引擎
+
+    按对象id顺序分批(keyset)读取对象，多线程aio批量删除rados数据(同时进行的删除数有上限)，
+    rados数据删除成功的对象一次批量删除元数据；每批次记录已扫描的最大对象id，中断后再次执行从断点继续；
+    一遍扫描完成后有删除失败的对象时，断点重置，下次执行重试；没有对象后删除对象表、part表和归档记录
+    """
+    def __init__(self, bucket, batch_size: int = 1000, workers: int = 8, aio_batch: int = 64,
+                 rate: float = 0, progress_interval: float = 10, log=None):
+        """
+        :param bucket: Archive()
+        :param batch_size: 每批次读取的对象数
+        :param workers: 删除rados数据的线程数
+        :param aio_batch: 每个线程aio同时删除的rados对象数
+        :param rate: 每秒最多删除的对象数，0不限制
+        :param progress_interval: 输出进度的间隔，秒
+        :param log: 输出进度的函数，log(msg: str)
+        """
+        self.bucket = bucket
+        self.batch_size = batch_size
+        self.workers = workers
+        self.aio_batch = aio_batch
+        self.rate = rate
+        self.progress_interval = progress_interval
+        self.log = log if log else (lambda msg: None)
+        self.rados_api = None
+        self.deleted_count = 0
+        self.failed_count = 0
+
+    def get_rados_api(self):
+        if self.rados_api is None:
+            self.rados_api = HarborObject(pool_name=self.bucket.get_pool_name(), obj_id='').get_rados_api()
+
+        return self.rados_api
+
+    def purge(self):
+        """
+        清理桶
+
+        :return:
+            True    # 清理完成，桶已删除
+            False   # 有删除失败的对象，需要再次执行
+        :raises: Exception
+        """
+        bucket = self.bucket
+        table_name = bucket.get_bucket_table_name()
+        model = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+        if is_model_table_exists(model):
+            if not self.purge_objects(model=model, table_name=table_name):
+                return False
+
+            if not delete_table_for_model_class(model):
+                raise Exception(f'Failed to delete table {table_name}')
+
+        parts_model = get_parts_model_class(bucket.get_parts_table_name())
+        if not delete_table_for_model_class(parts_model):
+            raise Exception(f'Failed to delete table {bucket.get_parts_table_name()}')
+
+        BucketTableMigration.objects.filter(table_name=table_name, name=BucketTableMigration.NAME_PURGE).delete()
+        bucket.delete()
+        return True
+
+    def purge_objects(self, model, table_name: str):
+        """
+        删除表中的所有对象，目录随表一起删除
+
+        :return:
+            True    # 所有对象已删除
+            False   # 有删除失败的对象
+        """
+        if not ensure_table_for_model_class(BucketTableMigration):
+            raise Exception('Failed to create the table of BucketTableMigration.')
+
+        checkpoint, created = BucketTableMigration.objects.get_or_create(
+            table_name=table_name, name=BucketTableMigration.NAME_PURGE)
+        last_id = checkpoint.last_id
+        total = model.objects.filter(fod=True, id__gt=last_id).count()
+        self.log(f'Bucket {self.bucket.name}: {total} objects to delete, start from id {last_id}.')
+
+        start_time = last_report = time.time()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while True:
+                rows = list(model.objects.filter(fod=True, id__gt=last_id).order_by('id').values_list(
+                    'id', 'si')[0:self.batch_size])
+                if not rows:
+                    break
+
+                batch_start = time.time()
+                self.purge_batch(executor=executor, model=model, rows=rows)
+                last_id = rows[-1][0]
+                checkpoint.last_id = last_id
+                checkpoint.save(update_fields=['last_id', 'modified_time'])
+                self.throttle(start_time=batch_start, count=len(rows))
+
+                now = time.time()
+                if now - last_report >= self.progress_interval:
+                    last_report = now
+                    self.report(total=total, start_time=start_time)
+
+        self.report(total=total, start_time=start_time)
+        if self.failed_count > 0 or model.objects.filter(fod=True).exists():
+            checkpoint.last_id = 0      # 下次执行重新扫描，重试删除失败的对象
+            checkpoint.save(update_fields=['last_id', 'modified_time'])
+            return False
+
+        return True
+
+    def purge_batch(self, executor, model, rows: list):
+        """
+        删除一批对象的rados数据，成功的批量删除元数据
+
+        :param rows: [(id, size), ]
+        """
+        rados_ids = {}      # rados对象id: 对象id
+        bucket_id = self.bucket.original_id
+        for obj_id, size in rows:
+            for rados_id in HarborObjectStructure(obj_id=f'{bucket_id}_{obj_id}', obj_size=size).parts_id:
+                rados_ids[rados_id] = obj_id
+
+        ids = list(rados_ids.keys())
+        chunks = [ids[i:i + self.aio_batch] for i in range(0, len(ids), self.aio_batch)]
+        failed_obj_ids = set()
+        for errors in executor.map(self._remove_chunk, chunks):
+            failed_obj_ids.update(rados_ids[i] for i in errors)
+
+        ok_ids = [obj_id for obj_id, _ in rows if obj_id not in failed_obj_ids]
+        if ok_ids:
+            model.objects.filter(id__in=ok_ids).delete()
+
+        self.deleted_count += len(ok_ids)
+        self.failed_count += len(failed_obj_ids)
+
+    def _remove_chunk(self, rados_ids: list):
+        """
+        :return: {rados_id: str}     # 删除失败的
+        """
+        try:
+            return self.get_rados_api().remove_objects(obj_ids=rados_ids, batch_size=self.aio_batch)
+        except Exception as e:
+            self.rados_api = None
+            return {i: str(e) for i in rados_ids}
+
+    def throttle(self, start_time, count: int):
+        if self.rate <= 0:
+            return
+
+        wait = count / self.rate - (time.time() - start_time)
+        if wait > 0:
+            time.sleep(wait)
+
+    def report(self, total: int, start_time):
+        elapsed = max(time.time() - start_time, 0.001)
+        done = self.deleted_count + self.failed_count
+        speed = done / elapsed
+        eta = (total - done) / speed if speed > 0 else 0
+        self.log(f'Bucket {self.bucket.name}: deleted {self.deleted_count}/{total}, failed {self.failed_count}, '
+                 f'{speed:.1f} objects/s, elapsed {elapsed:.0f}s, eta {max(eta, 0):.0f}s.')
@@ -0,0 +1,150 @@
+"""
+存储桶元数据表(bucket_N、parts_N，表池中的bucket_pN、parts_pN)分片
+
+分片配置settings.METADATA_SHARDS:
+    {
+        'shard1': {'metadata': 'metadata_shard1', 'part_metadata': 'part_metadata_shard1'},
+        ...
+    }
+存储桶所在分片名称记录在Bucket.shard(归档的桶记录在Archive.shard)，空字符串表示默认的metadata、part_metadata数据库
+"""
+import random
+import re
+
+from django.conf import settings
+
+from utils.cache import TTLCache
+from .table_pool import get_pool_id
+
+
+DEFAULT_SHARD = ''
+METADATA = 'metadata'
+PART_METADATA = 'part_metadata'
+
+_re_bucket_table = re.compile(r'^(?:bucket|parts)_(\d+)$')
+
+# 表名对应的分片名称缓存，分片迁移命令修改桶分片后，其他进程最长需要等待缓存超时时间才会使用新分片
+table_shard_cache = TTLCache(timeout=getattr(settings, 'BUCKET_SHARD_CACHE_TIMEOUT', 60),
+                             max_size=getattr(settings, 'BUCKET_SHARD_CACHE_MAX_SIZE', 100000))
+
+
+def get_shards():
+    return getattr(settings, 'METADATA_SHARDS', {})
+
+
+def is_valid_shard(shard: str):
+    return shard == DEFAULT_SHARD or shard in get_shards()
+
+
+def get_shard_db_alias(shard: str, db_type: str):
+    """
+    分片对应的数据库别名
+
+    :param shard: 分片名称
+    :param db_type: METADATA or PART_METADATA
+    :return: str
+    """
+    if not shard:
+        return db_type
+
+    aliases = get_shards().get(shard)
+    if not aliases:
+        return db_type
+
+    return aliases.get(db_type, db_type)
+
+
+def choose_shard_for_new_bucket():
+    """
+    为新建的存储桶随机选择一个分片，可选分片settings.METADATA_SHARDS_FOR_NEW_BUCKET，默认只有默认分片
+    """
+    shards = getattr(settings, 'METADATA_SHARDS_FOR_NEW_BUCKET', [DEFAULT_SHARD])
+    shards = [s for s in shards if is_valid_shard(s)]
+    if not shards:
+        return DEFAULT_SHARD
+
+    return random.choice(shards)
+
+
+def _load_pool_table_shard(pool_id: int):
+    """
+    表池中的表(bucket_pN、parts_pN)所在的分片，由领取表的桶、归档的桶或者池记录得到
+    """
+    from .models import Bucket, Archive, BucketTablePool
+
+    table_name = BucketTablePool(id=pool_id).get_bucket_table_name()
+    shard = Bucket.objects.filter(collection_name=table_name).values_list('shard', flat=True).first()
+    if shard is not None:
+        return shard
+
+    shard = Archive.objects.filter(table_name=table_name).values_list('shard', flat=True).first()
+    if shard is not None:
+        return shard
+
+    shard = BucketTablePool.objects.filter(id=pool_id).values_list('shard', flat=True).first()
+    if shard is not None:
+        return shard
+
+    return DEFAULT_SHARD
+
+
+def _load_table_shard(table_name: str):
+    from .models import Bucket, Archive
+
+    pool_id = get_pool_id(table_name)
+    if pool_id is not None:
+        return _load_pool_table_shard(pool_id)
+
+    shard = Bucket.objects.filter(collection_name=table_name).values_list('shard', flat=True).first()
+    if shard is not None:
+        return shard
+
+    m = _re_bucket_table.match(table_name)
+    if m:
+        bucket_id = int(m.group(1))
+        shard = Bucket.objects.filter(id=bucket_id).values_list('shard', flat=True).first()
+        if shard is not None:
+            return shard
+
+        shard = Archive.objects.filter(original_id=bucket_id).values_list('shard', flat=True).first()
+        if shard is not None:
+            return shard
+
+    shard = Archive.objects.filter(table_name=table_name).values_list('shard', flat=True).first()
+    if shard is not None:
+        return shard
+
+    return DEFAULT_SHARD
+
+
+def get_table_shard(table_name: str):
+    """
+    存储桶的对象元数据表或part元数据表所在的分片名称，没有配置分片时不查询数据库
+    """
+    if not get_shards():
+        return DEFAULT_SHARD
+
+    shard = table_shard_cache.get(table_name)
+    if shard is None:
+        shard = _load_table_shard(table_name)
+        table_shard_cache.set(table_name, shard)
+
+    return shard
+
+
+def get_table_db_alias(table_name: str, db_type: str):
+    """
+    存储桶的对象元数据表或part元数据表所在的数据库别名
+
+    :param table_name: bucket_N or parts_N
+    :param db_type: METADATA or PART_METADATA
+    """
+    return get_shard_db_alias(shard=get_table_shard(table_name), db_type=db_type)
+
+
+def set_table_shard_cache(bucket, shard: str):
+    """
+    存储桶分片变更后，更新本进程的缓存
+    """
+    table_shard_cache.set(bucket.get_bucket_table_name(), shard)
+    table_shard_cache.set(bucket.get_parts_table_name(), shard)
@@ -0,0 +1,115 @@
+"""
+存储桶元数据表池
+
+表池命令(manage.py bucket_table_pool)在后台为每个分片预先创建空的对象元数据表和part元数据表(bucket_pN、parts_pN)，
+创建存储桶时按桶所在分片原子地领取一对，领取的对象表名记录在桶的collection_name，part表名由对象表名得到；
+领取后桶创建失败的表归还到池中，领取后长时间没有桶记录的表由表池命令回收
+"""
+import re
+import random
+import logging
+
+from django.conf import settings
+from django.utils import timezone
+
+
+logger = logging.getLogger('django.request')
+
+BUCKET_TABLE_POOL_ENABLED = getattr(settings, 'BUCKET_TABLE_POOL_ENABLED', False)
+
+_re_pool_table = re.compile(r'^(?:bucket|parts)_p(\d+)$')
+
+
+def get_pool_id(table_name: str):
+    """
+    表池中的表名对应的池记录id
+
+    :return: int or None     # 不是表池中的表
+    """
+    m = _re_pool_table.match(table_name) if table_name else None
+    if m:
+        return int(m.group(1))
+
+    return None
+
+
+def get_pool_parts_table_name(table_name: str):
+    """
+    表池中的对象表(bucket_pN)对应的part表名
+
+    :return: str or None     # 不是表池中的对象表
+    """
+    if table_name and table_name.startswith('bucket_p'):
+        pool_id = get_pool_id(table_name)
+        if pool_id is not None:
+            return f'parts_p{pool_id}'
+
+    return None
+
+
+def claim_bucket_tables(bucket, tries: int = 3):
+    """
+    为新建的存储桶从表池领取桶所在分片的一对空表，成功后桶的collection_name为领取的对象表名
+
+    同时创建的桶从可领取的表中随机选择，通过条件更新保证一对表只被一个桶领取
+
+    :param bucket: 已保存的Bucket()
+    :param tries: 领取冲突时的尝试次数
+    :return:
+        True    # 领取成功
+        False   # 未开启表池，或者池中没有可领取的表，需要同步建表
+    """
+    from .models import BucketTablePool
+
+    if not BUCKET_TABLE_POOL_ENABLED:
+        return False
+
+    try:
+        for _ in range(tries):
+            ids = list(BucketTablePool.objects.filter(
+                shard=bucket.shard, status=BucketTablePool.STATUS_FREE).values_list('id', flat=True)[0:10])
+            if not ids:
+                return False
+
+            pool_id = random.choice(ids)
+            r = BucketTablePool.objects.filter(id=pool_id, status=BucketTablePool.STATUS_FREE).update(
+                status=BucketTablePool.STATUS_CLAIMED, bucket_id=bucket.id, claimed_time=timezone.now())
+            if r > 0:
+                break
+        else:
+            return False
+    except Exception as e:
+        logger.error(f'claim tables from pool for bucket({bucket.name}) error, {str(e)}')
+        return False
+
+    bucket.collection_name = BucketTablePool(id=pool_id).get_bucket_table_name()
+    try:
+        bucket.save(update_fields=['collection_name'])
+    except Exception as e:
+        logger.error(f'record pool tables for bucket({bucket.name}) error, {str(e)}')
+        bucket.collection_name = ''
+        release_pool_tables(pool_id=pool_id, bucket_id=bucket.id)
+        return False
+
+    return True
+
+
+def release_pool_tables(pool_id: int, bucket_id: int):
+    """
+    领取表后桶创建失败，归还表到池中
+
+    :return:
+        True    # 已归还
+        False   # 不是这个桶领取的，或者数据库错误
+    """
+    from .models import BucketTablePool
+
+    try:
+        r = BucketTablePool.objects.filter(
+            id=pool_id, bucket_id=bucket_id, status=BucketTablePool.STATUS_CLAIMED).update(
+            status=BucketTablePool.STATUS_FREE, bucket_id=0, claimed_time=None)
+    except Exception as e:
+        logger.error(f'release pool tables(id={pool_id}) error, {str(e)}')
+        return False
+
+    return r > 0
@@ -4,8 +4,11 @@ from hashlib import sha256
 from urllib.parse import quote
 from datetime import datetime
 
+from django.conf import settings
 from django.utils.translation import gettext as _
 from rest_framework.authentication import BaseAuthentication, get_authorization_header
+
+from utils.cache import TTLCache
 from . import exceptions
 
 
@@ -17,6 +20,11 @@ ISO8601 = '%Y-%m-%dT%H:%M:%SZ'
 SIGV4_TIMESTAMP = '%Y%m%dT%H%M%SZ'
 GMT_FORMAT = '%a, %d %b %Y %H:%M:%S GMT'
 
+# 派生的签名密钥缓存，(access_key, secret_key, date, region, service) -> k_signing；
+# 签名密钥只在scope的日期内有效，缓存一天
+signing_key_cache = TTLCache(timeout=24 * 3600,
+                             max_size=getattr(settings, 'S3_SIGNING_KEY_CACHE_MAX_SIZE', 10000))
+
 
 class S3V4Authentication(BaseAuthentication):
     """
@@ -143,10 +151,9 @@ class S3V4Authentication(BaseAuthentication):
             raise exceptions.S3InvalidSecurity(extend_msg='invalid format "Credential"')
 
         access_key, date, self._region_name, self._service_name, *arg = l_credential
-        model = self.get_model()
-        try:
-            auth_key = model.objects.select_related('user').get(id=access_key)
-        except model.DoesNotExist:
+        self._access_key = access_key
+        auth_key = self.get_auth_key(access_key)
+        if auth_key is None:
             raise exceptions.S3InvalidAccessKeyId()
 
         if not auth_key.user.is_active:
@@ -163,6 +170,25 @@ class S3V4Authentication(BaseAuthentication):
 
         return auth_key.user, auth_key  # request.user, request.auth
 
+    def get_auth_key(self, access_key: str):
+        """
+        获取访问密钥，优先从缓存获取
+
+        :return:
+            AuthKey()
+            None        # 不存在
+        """
+        from users.cache import auth_key_cache
+
+        return auth_key_cache.get(access_key, loader=self._load_auth_key)
+
+    def _load_auth_key(self, access_key: str):
+        model = self.get_model()
+        try:
+            return model.objects.select_related('user').get(id=access_key)
+        except model.DoesNotExist:
+            return None
+
     @staticmethod
     def parse_auth_key_string(auth_key):
         auth = auth_key.split(',')
@@ -287,12 +313,25 @@ class S3V4Authentication(BaseAuthentication):
         return t
 
     def signature(self, string_to_sign, secret_key):
-        key = secret_key
-        k_date = self._sign(('AWS4' + key).encode('utf-8'), self.s3_timestamp[0:8])
+        k_signing = self.signing_key(secret_key)
+        return self._sign(k_signing, string_to_sign, hex=True)
+
+    def signing_key(self, secret_key):
+        """
+        派生签名密钥，同一个密钥在同一天、区域、服务下的签名密钥相同，缓存起来避免每次请求4次HMAC计算
+        """
+        date = self.s3_timestamp[0:8]
+        cache_key = (getattr(self, '_access_key', ''), secret_key, date, self._region_name, self._service_name)
+        k_signing = signing_key_cache.get(cache_key)
+        if k_signing is not None:
+            return k_signing
+
+        k_date = self._sign(('AWS4' + secret_key).encode('utf-8'), date)
         k_region = self._sign(k_date, self._region_name)
         k_service = self._sign(k_region, self._service_name)
         k_signing = self._sign(k_service, 'aws4_request')
-        return self._sign(k_signing, string_to_sign, hex=True)
+        signing_key_cache.set(cache_key, k_signing)
+        return k_signing
 
     def _sign(self, key, msg, hex=False):
         if hex:
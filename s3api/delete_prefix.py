@@ -0,0 +1,243 @@
+import time
+
+from django.utils import timezone
+
+from buckets.models import Bucket
+from buckets.shards import set_table_shard_cache
+from .models import DeletePrefixJob
+from .utils import BucketFileManagement
+from .harbor import HarborManager
+
+
+class PrefixDeleter:
+    """
+    删除前缀任务的执行引擎
+
+    由前缀得到起始目录，按目录树(did)逐层分批(keyset)查找前缀下的所有子目录；
+    每个目录下的对象按名称keyset分批删除(元数据批量删除，rados数据加入删除队列或批量删除)，最后由深到浅批量删除目录；
+    每批次后更新任务进度并按任务的删除速率限速，每批次的数量不超过每秒速率，限速等待时间不超过1秒，
+    进度时间不会因限速长时间不更新而被其他进程接管；
+    每批次删除前检查桶的读写锁(如move_bucket_shard迁移分片时锁定写)，锁定时暂停并定时更新进度时间；
+    删除是幂等的，中断后再次执行会跳过已删除的对象
+    """
+    LOCK_CHECK_INTERVAL = 5     # 桶锁定时暂停的检查间隔(秒)
+
+    def __init__(self, job, batch_size: int = 1000, log=None):
+        """
+        :param job: DeletePrefixJob()
+        :param batch_size: 每批次的对象或目录数
+        :param log: 输出进度的函数，log(msg: str)
+        """
+        self.job = job
+        self.batch_size = min(batch_size, job.rate) if job.rate > 0 else batch_size
+        self.log = log if log else (lambda msg: None)
+        self.bucket = None
+        self.bfm = None
+        self.model = None
+
+    def run(self):
+        """
+        执行任务，结束时任务状态为完成或失败
+        """
+        job = self.job
+        job.failed = 0      # 只记录本次执行删除失败的数量，中断后重新执行时会重试
+        job.last_error = ''
+        try:
+            self.delete_prefix()
+        except Exception as e:
+            job.status = DeletePrefixJob.STATUS_FAILED
+            job.last_error = str(e)[0:255]
+        else:
+            if job.failed > 0:
+                job.status = DeletePrefixJob.STATUS_FAILED
+                job.last_error = f'Failed to delete {job.failed} objects or directories, create the job again to retry.'
+            else:
+                job.status = DeletePrefixJob.STATUS_COMPLETED
+
+        job.end_time = timezone.now()
+        job.save(update_fields=['status', 'failed', 'last_error', 'end_time', 'modified_time'])
+        self.log(f'Job {job.id} {job.get_status_display()}: deleted {job.deleted_objects} objects, '
+                 f'{job.deleted_dirs} dirs, failed {job.failed}.')
+
+    def delete_prefix(self):
+        """
+        :raises: Exception
+        """
+        job = self.job
+        bucket = Bucket.objects.filter(id=job.bucket_id, name=job.bucket_name).first()
+        if bucket is None:
+            raise Exception('The bucket has been deleted.')
+
+        self.bucket = bucket
+        self.bfm = BucketFileManagement(collection_name=bucket.get_bucket_table_name())
+        self.model = self.bfm.get_obj_model_class()
+
+        parent_id, name_prefix, root_dir = self.get_start_dir(job.prefix)
+        if parent_id is None:
+            return      # 前缀对应的目录不存在，没有要删除的
+
+        levels = self.collect_dirs(parent_id=parent_id, name_prefix=name_prefix)
+        self.delete_dir_files(dir_id=parent_id, name_prefix=name_prefix)
+        for level in levels:
+            for dir_id, _ in level:
+                self.delete_dir_files(dir_id=dir_id)
+
+        if root_dir is not None:
+            levels.insert(0, [(root_dir.id, root_dir.na)])
+
+        for level in reversed(levels):      # 由深到浅
+            for i in range(0, len(level), self.batch_size):
+                self.delete_dirs(level[i:i + self.batch_size])
+
+    def get_start_dir(self, prefix: str):
+        """
+        前缀所在的目录
+
+        :return: (parent_id, name_prefix, root_dir)
+            parent_id: 前缀所在目录的id，None表示目录不存在
+            name_prefix: 目录下对象和子目录名称的前缀
+            root_dir: 前缀以"/"结尾时为前缀对应的目录，需要最后删除；否则为None
+        """
+        if prefix.endswith('/'):
+            obj = self.bfm.get_obj(path=prefix.rstrip('/'))
+            if obj is None or not obj.is_dir():
+                return None, '', None
+
+            return obj.id, '', obj
+
+        parent_path, _, name_prefix = prefix.rpartition('/')
+        if not parent_path:
+            return self.bfm.ROOT_DIR_ID, name_prefix, None
+
+        obj = self.bfm.get_obj(path=parent_path)
+        if obj is None or not obj.is_dir():
+            return None, '', None
+
+        return obj.id, name_prefix, None
+
+    def collect_dirs(self, parent_id: int, name_prefix: str):
+        """
+        按层查找前缀下的所有子目录
+
+        :return: [[(id, na), ], ]     # 每层的目录
+        """
+        levels = []
+        level = list(self.iter_children(did=parent_id, fod=False, name_prefix=name_prefix, fields=('id', 'na')))
+        while level:
+            levels.append(level)
+            self.job.save(update_fields=['modified_time'])     # 目录很多时查找时间较长，更新进度时间避免被其他进程接管
+            next_level = []
+            for dir_id, _ in level:
+                next_level += list(self.iter_children(did=dir_id, fod=False, fields=('id', 'na')))
+
+            level = next_level
+
+        return levels
+
+    def iter_children(self, did: int, fod: bool, name_prefix: str = '', fields=('id', 'na')):
+        """
+        按名称keyset分批遍历目录下的对象或子目录，索引(did, name)范围查询
+
+        :return: yield values tuple
+        """
+        qs = self.model.objects.filter(did=did, fod=fod)
+        if name_prefix:
+            qs = qs.filter(name__startswith=name_prefix)
+
+        last_name = None
+        while True:
+            page_qs = qs if last_name is None else qs.filter(name__gt=last_name)
+            rows = list(page_qs.order_by('name').values_list('name', *fields)[0:self.batch_size])
+            for row in rows:
+                yield row[1:]
+
+            if len(rows) < self.batch_size:
+                break
+
+            last_name = rows[-1][0]
+
+    def delete_dir_files(self, dir_id: int, name_prefix: str = ''):
+        """
+        分批删除目录下的对象
+        """
+        qs = self.model.objects.filter(did=dir_id, fod=True)
+        if name_prefix:
+            qs = qs.filter(name__startswith=name_prefix)
+
+        last_name = None
+        while True:
+            self.wait_bucket_unlocked()
+            start_time = time.time()
+            page_qs = qs if last_name is None else qs.filter(name__gt=last_name)
+            objs = list(page_qs.order_by('name')[0:self.batch_size])
+            if not objs:
+                break
+
+            files = {obj.na: obj for obj in objs}
+            errors = HarborManager._delete_files(bucket=self.bucket, bfm=self.bfm, objs=files)
+            deleted = [obj for path, obj in files.items() if path not in errors]
+            self.job.deleted_objects += len(deleted)
+            self.job.deleted_size += sum(obj.si or 0 for obj in deleted)
+            self.save_progress(failed=len(errors), start_time=start_time, count=len(objs))
+            if len(objs) < self.batch_size:
+                break
+
+            last_name = objs[-1].name
+
+    def delete_dirs(self, dirs: list):
+        """
+        批量删除目录，目录下有删除失败的对象时目录不能删除
+
+        :param dirs: [(id, na), ]
+        """
+        self.wait_bucket_unlocked()
+        start_time = time.time()
+        objs = {na: self.model(id=dir_id, na=na, fod=False) for dir_id, na in dirs}
+        errors = HarborManager._delete_empty_dirs(bucket=self.bucket, bfm=self.bfm, dirs=objs)
+        self.job.deleted_dirs += len(objs) - len(errors)
+        self.save_progress(failed=len(errors), start_time=start_time, count=len(objs))
+
+    def wait_bucket_unlocked(self):
+        """
+        桶锁定写时暂停，直到解锁；从数据库查询锁状态，不使用其他进程无法失效的桶缓存；
+        暂停后桶可能已迁移到其他分片，解锁后更新本进程的表分片缓存
+
+        :raises: Exception     # 桶已删除
+        """
+        paused = False
+        while True:
+            row = Bucket.objects.filter(id=self.bucket.id).values_list('lock', 'shard').first()
+            if row is None:
+                raise Exception('The bucket has been deleted.')
+
+            lock, shard = row
+            if lock == Bucket.LOCK_READWRITE:
+                break
+
+            if not paused:
+                paused = True
+                self.log(f'Job {self.job.id} paused, bucket {self.bucket.name} is locked.')
+
+            self.job.save(update_fields=['modified_time'])     # 暂停期间更新进度时间，避免被其他进程接管
+            time.sleep(self.LOCK_CHECK_INTERVAL)
+
+        if paused:
+            self.bucket.lock = lock
+            self.bucket.shard = shard
+            set_table_shard_cache(self.bucket, shard=shard)
+            self.log(f'Job {self.job.id} resumed.')
+
+    def save_progress(self, failed: int, start_time, count: int):
+        job = self.job
+        job.failed += failed
+        job.save(update_fields=['deleted_objects', 'deleted_dirs', 'deleted_size', 'failed', 'modified_time'])
+        self.throttle(start_time=start_time, count=count)
+
+    def throttle(self, start_time, count: int):
+        rate = self.job.rate
+        if rate <= 0:
+            return
+
+        wait = count / rate - (time.time() - start_time)
+        if wait > 0:
+            time.sleep(wait)
@@ -64,6 +64,11 @@ class S3NoSuchUpload(S3NotFound):
     default_code = 'NoSuchUpload'
 
 
+class S3NoSuchJob(S3NotFound):
+    default_message = 'The specified job does not exist.'
+    default_code = 'NoSuchJob'
+
+
 class S3MethodNotAllowed(S3Error):
     default_message = 'The specified method is not allowed against this resource.'
     default_code = 'MethodNotAllowed'
@@ -297,3 +302,15 @@ class S3NotImplemented(S3Error):
     default_message = "Not implemented."
     default_code = 'NotImplemented'
     default_status_code = 501
+
+
+class S3BucketLockWrite(S3Error):
+    default_message = 'The bucket is locked for writing.'
+    default_code = 'BucketLockWrite'
+    default_status_code = 409
+
+
+class S3BucketLockReadWrite(S3Error):
+    default_message = 'The bucket is locked for reading and writing.'
+    default_code = 'BucketLockReadWrite'
+    default_status_code = 409
@@ -5,12 +5,14 @@ from django.utils.translation import gettext
 from django.conf import settings
 from rest_framework.response import Response
 
+from buckets.counters import buffered_counters
 from utils.md5 import FileMD5Handler, S3ObjectMultipartETagHandler
 from utils.oss.pyrados import HarborObject, ObjectPart
 from .managers import ObjectPartManager
-from .responses import IterResponse
+from .responses import IterResponse, XMLStreamResponse
 from . import exceptions
 from .harbor import HarborManager
+from .utils import BucketFileManagement, as_list_rows_queryset
 from . import renders
 from . import paginations
 from . import serializers
@@ -104,6 +106,8 @@ class MultipartUploadHandler:
 
         hm = HarborManager()
         obj, created = hm.get_or_create_obj(table_name=bucket.get_bucket_table_name(), obj_path_name=key)
+        if created:
+            buffered_counters.add_bucket_stats(bucket.id, count=1)
 
         obj_raods_key = obj.get_obj_key(bucket.id)
         obj_rados = HarborObject(pool_name=bucket.pool_name, obj_id=obj_raods_key, obj_size=obj.si)
@@ -136,15 +140,17 @@ class MultipartUploadHandler:
         if isinstance(parts, dict):
             parts = parts.values()
 
+        parts = list(parts)
         start_time = time.time()
         remove_failed_parts = []  # 删除元数据失败的part
+        if is_rm_metadata and parts:
+            # 一次删除所有part元数据
+            if not ObjectPartManager.remove_parts(parts):
+                if not ObjectPartManager.remove_parts(parts):  # 重试一次
+                    remove_failed_parts = parts
+
         part_rados = ObjectPart(part_key='', part_size=0)
         for p in parts:
-            if is_rm_metadata:
-                if not p.safe_delete():
-                    if not p.safe_delete():  # 重试一次
-                        remove_failed_parts.append(p)
-
             part_rados.reset_part_key_and_size(part_key=p.get_part_rados_key(), part_size=p.size)
             ok, _ = part_rados.delete()
             if not ok:
@@ -202,11 +208,21 @@ class MultipartUploadHandler:
                 else:
                     yield white_space_bytes
 
+            # 一次批量更新所有part在对象中的偏移量和对象ETag
+            if not ObjectPartManager.save_parts_obj_info(parts=used_upload_parts.values()):
+                raise exceptions.S3InternalError(extend_msg='update parts metadata error.')
+
             # 更新对象元数据
             if not self.update_obj_metedata(obj=obj, size=offset, hex_md5=md5_handler.hex_md5,
                                             share_code=upload.obj_perms_code):
                 raise exceptions.S3InternalError(extend_msg='update object metadata error.')
 
+            # GET、HEAD从对象行获取多部分ETag，不再查询part表
+            if not BucketFileManagement(collection_name=bucket.get_bucket_table_name()).set_multipart_etag(
+                    obj_id=obj.id, etag=obj_etag, parts_count=parts_count):
+                raise exceptions.S3InternalError(extend_msg='update object multipart etag error.')
+            buffered_counters.add_bucket_stats(bucket.id, size=offset)
+
             # 多部分上传已完成，清理数据
             # 删除无用的part元数据和rados数据
             for r in self.clear_parts_cache_iter(unused_upload_parts, is_rm_metadata=True):
@@ -314,11 +330,7 @@ class MultipartUploadHandler:
 
             yield None
 
-        try:
-            part.save(update_fields=['obj_offset', 'obj_etag', 'obj_id', 'parts_count'])
-        except Exception as e:
-            yield exceptions.S3InternalError()
-
+        # part元数据在所有part组合完成后批量更新
         yield True
 
     @staticmethod
@@ -341,31 +353,36 @@ class MultipartUploadHandler:
         opm = ObjectPartManager(bucket=bucket)
         upload_parts_qs = opm.get_parts_queryset_by_upload_id(upload_id=upload.id)
 
-        obj_etag_handler = S3ObjectMultipartETagHandler()
+        complete_numbers_set = set(complete_numbers)
         used_upload_parts = {}
         unused_upload_parts = []
-        last_part_number = complete_numbers[-1]
         for part in upload_parts_qs:
-            num = part.part_num
-            if part.part_num in complete_numbers:
-                c_part = complete_parts[num]
-                if part.size < MULTIPART_UPLOAD_MIN_SIZE and num != last_part_number:  # part最小限制，最后一个part除外
-                    raise exceptions.S3EntityTooSmall()
-
-                if 'ETag' not in c_part:
-                    raise exceptions.S3InvalidPart(extend_msg=f'PartNumber={num}')
-                if c_part["ETag"].strip('"') != part.part_md5:
-                    raise exceptions.S3InvalidPart(extend_msg=f'PartNumber={num}')
-
-                obj_etag_handler.update(part.part_md5)
-                used_upload_parts[num] = part
+            if part.part_num in complete_numbers_set:
+                used_upload_parts[part.part_num] = part
             else:
                 unused_upload_parts.append(part)
 
-        obj_parts_count = len(used_upload_parts)
-        if obj_parts_count != len(complete_parts):
+        if len(used_upload_parts) != len(complete_parts):
             raise exceptions.S3InvalidPart()
 
+        # 按编号升序验证part和计算对象ETag
+        obj_etag_handler = S3ObjectMultipartETagHandler()
+        last_part_number = complete_numbers[-1]
+        for num in complete_numbers:
+            part = used_upload_parts[num]
+            c_part = complete_parts[num]
+            if part.size < MULTIPART_UPLOAD_MIN_SIZE and num != last_part_number:  # part最小限制，最后一个part除外
+                raise exceptions.S3EntityTooSmall()
+
+            if 'ETag' not in c_part:
+                raise exceptions.S3InvalidPart(extend_msg=f'PartNumber={num}')
+            if c_part["ETag"].strip('"') != part.part_md5:
+                raise exceptions.S3InvalidPart(extend_msg=f'PartNumber={num}')
+
+            obj_etag_handler.update(part.part_md5)
+
+        obj_parts_count = len(used_upload_parts)
+
         obj_etag = f'"{obj_etag_handler.hex_md5}-{obj_parts_count}"'
         return used_upload_parts, unused_upload_parts, obj_etag
 
@@ -397,7 +414,8 @@ class ListObjectsHandler:
             return self.list_objects_v1_no_match(view=view, request=request, prefix=prefix, delimiter=delimiter,
                                                  bucket_name=bucket_name)
 
-        paginator = paginations.ListObjectsV1CursorPagination()
+        paginator = paginations.ListObjectsV1KeyPagination(
+            context={'bucket': bucket, 'prefix': prefix}, ordering=paginations.ListObjectsV1KeyPagination.ORDER_BY_NAME)
         max_keys = paginator.get_page_size(request=request)
         ret_data = {
             'IsTruncated': 'false',  # can not use bool
@@ -413,16 +431,15 @@ class ListObjectsHandler:
                 return self.list_objects_v1_no_match(view=view, request=request, prefix=prefix, delimiter=delimiter,
                                                      bucket_name=bucket_name)
 
-            objs_qs = hm.list_dir_queryset(bucket=bucket, dir_obj=obj)
+            objs_qs = as_list_rows_queryset(hm.list_dir_queryset(bucket=bucket, dir_obj=obj))
             paginator.paginate_queryset(objs_qs, request=request)
             objs, _ = paginator.get_objects_and_dirs()
 
-            serializer = serializers.ObjectListWithOwnerSerializer(objs, many=True, context={'user': request.user})
+            serializer = serializers.ObjectListRowsSerializer(objs, user=request.user, with_owner=True)
             data = paginator.get_paginated_data(common_prefixes=True, delimiter=delimiter)
             ret_data.update(data)
             ret_data['Contents'] = serializer.data
-            view.set_renderer(request, renders.ListObjectsV1XMLRenderer())
-            return Response(data=ret_data, status=200)
+            return XMLStreamResponse(data=ret_data, root_tag_name='ListBucketResult', request=request)
 
         # list object metadata
         if not obj.is_file():
@@ -448,22 +465,25 @@ class ListObjectsHandler:
         except exceptions.S3Error as e:
             return view.exception_response(request, e)
 
-        paginator = paginations.ListObjectsV1CursorPagination()
-        objs_dirs = paginator.paginate_queryset(objs_qs, request=request)
-        serializer = serializers.ObjectListWithOwnerSerializer(objs_dirs, many=True, context={'user': request.user})
+        if BucketFileManagement(collection_name=bucket.get_bucket_table_name()).has_sortable_key():
+            paginator = paginations.ListObjectsV1KeyPagination(context={'bucket': bucket})
+            objs_dirs = paginator.paginate_queryset(as_list_rows_queryset(objs_qs), request=request)
+            serializer = serializers.ObjectListRowsSerializer(objs_dirs, user=request.user, with_owner=True)
+        else:
+            paginator = paginations.ListObjectsV1CursorPagination()
+            objs_dirs = paginator.paginate_queryset(objs_qs, request=request)
+            serializer = serializers.ObjectListWithOwnerSerializer(objs_dirs, many=True, context={'user': request.user})
 
         data = paginator.get_paginated_data(delimiter='')
         data['Contents'] = serializer.data
         data['Name'] = bucket_name
         data['Prefix'] = prefix
         data['EncodingType'] = 'url'
-
-        view.set_renderer(request, renders.ListObjectsV1XMLRenderer())
-        return Response(data=data, status=200)
+        return XMLStreamResponse(data=data, root_tag_name='ListBucketResult', request=request)
 
     @staticmethod
     def list_objects_v1_no_match(view, request, prefix, delimiter, bucket_name):
-        paginator = paginations.ListObjectsV1CursorPagination()
+        paginator = paginations.ListObjectsV1KeyPagination(context={'bucket_name': bucket_name})
         max_keys = paginator.get_page_size(request=request)
         ret_data = {
             'IsTruncated': 'false',     # can not use bool True, need use string
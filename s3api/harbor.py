@@ -1,12 +1,26 @@
+import time
+import random
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
 from django.utils import timezone
-from django.db.models import Case, Value, When, F
+from django.db import transaction, router, IntegrityError
+from django.db.models import Case, Value, When, F, Q
 
 from buckets.models import Bucket
-from .utils import BucketFileManagement
+from buckets.counters import buffered_counters
+from utils.md5 import get_str_hexMD5
+from .utils import BucketFileManagement, dir_id_cache
 from utils.storagers import PathParser
 from utils.oss import HarborObject, get_size
+from utils.oss.pyrados import MAXSIZE_PER_RADOS_OBJ
 from . import exceptions
-from .managers import ObjectPartManager
+from .managers import ObjectPartManager, RadosGarbageManager
+
+
+logger = logging.getLogger('django.request')
 
 
 class HarborManager:
@@ -300,6 +314,8 @@ class HarborManager:
         """
         创建整个目录路径
 
+        路径上所有的目录一次查询，不存在的目录批量创建，查询次数和路径深度无关
+
         :param table_name: 桶的数据库表明称
         :param path: 要创建的目录路径字符串
         :return:
@@ -310,47 +326,143 @@ class HarborManager:
         bfm = BucketFileManagement(collection_name=table_name)
         paths = PathParser(path).get_path_breadcrumb()
         if len(paths) == 0:
-            return bfm.root_dir()       # 根目录对象
+            return [bfm.root_dir()]       # 根目录对象
+
+        try:
+            return self._create_path(bfm=bfm, paths=paths)
+        except IntegrityError as e:
+            pass
 
-        index_paths = list(enumerate(paths))
-        index = 0
+        # 其他请求并发创建了路径上相同的目录，重新查询已存在的目录后再创建
+        try:
+            return self._create_path(bfm=bfm, paths=paths)
+        except IntegrityError as e:
+            raise exceptions.S3InternalError('创建目录元数据错误')
+
+    def _create_path(self, bfm, paths: list):
+        """
+        :param bfm: BucketFileManagement()
+        :param paths: 路径面包屑，[[dir_name, dir_path_name],]
+        :return:
+            [dir,]
+
+        :raises: S3Error, IntegrityError
+        """
+        table_name = bfm.get_collection_name()
+        try:
+            exist_dirs = bfm.get_objs_by_paths(paths=[p for _, p in paths])
+        except Exception as e:
+            raise exceptions.S3InternalError(str(e))
+
+        index = -1
         last_exist_dir = None       # 路径中已存在的最后的目录
-        for index, item in reversed(index_paths):
-            dir_name, dir_path_name = item
-            try:
-                obj = bfm.get_obj(path=dir_path_name)
-            except Exception as e:
-                raise exceptions.S3InternalError(str(e))
-            if not obj:
+        for i in range(len(paths) - 1, -1, -1):
+            obj = exist_dirs.get(paths[i][1], None)
+            if obj is None:
                 continue
 
             if obj.is_file():
                 raise exceptions.S3InvalidSuchKey("The path of the object's key conflicts with the existing object's key")
 
             last_exist_dir = obj
+            index = i
             break
 
-        if index == (len(index_paths) - 1) and last_exist_dir:       # 整个路径已存在
-            return [last_exist_dir]
-
-        # 从整个路径上已存在的目录处开始向后创建路径
         if last_exist_dir:
-            now_last_dir = last_exist_dir           # 记录现在已创建的路径上的最后的目录
-            create_paths = index_paths[index + 1:]  # index目录存在不需创建
+            dir_id_cache.set((table_name, last_exist_dir.na), last_exist_dir.id)
+            if index == (len(paths) - 1):       # 整个路径已存在
+                return [last_exist_dir]
+
+            parent_id = last_exist_dir.id
         else:
-            now_last_dir = bfm.root_dir()           # 根目录对象
-            create_paths = index_paths[index:]      # index目录不存在需创建
+            parent_id = bfm.ROOT_DIR_ID
+
+        # 从整个路径上已存在的目录处开始向后创建路径
+        dirs = self._bulk_create_dirs(bfm=bfm, parent_id=parent_id, paths=paths[index + 1:])
+        for d in dirs:
+            dir_id_cache.set((table_name, d.na), d.id)
+
+        return dirs
+
+    @staticmethod
+    def _bulk_create_dirs(bfm, parent_id: int, paths: list):
+        """
+        批量创建一条路径上连续的多个目录元数据
 
+        第一个目录的父目录已存在；后面目录的父目录是新创建的，插入时id还未知，先用唯一的负数占位，
+        插入后查询出新目录的id，再一次更新父目录id，在一个事务中完成，事务提交前其他请求看不到新目录
+
+        :param bfm: BucketFileManagement()
+        :param parent_id: 第一个目录的父目录id
+        :param paths: 路径面包屑，[[dir_name, dir_path_name],]，按路径深度排序
+        :return:
+            [dir,]
+
+        :raises: S3Error, IntegrityError
+        """
+        for dir_name, _ in paths:
+            if len(dir_name) > 255:
+                raise exceptions.S3InvalidSuchKey('目录名称长度最大为255字符')
+
+        object_class = bfm.get_obj_model_class()
         dirs = []
-        for i, p in create_paths:
-            p_id = now_last_dir.id
-            dir_name, dir_path_name = p
-            dir1 = self.mkdir_metadata(table_name=table_name, p_id=p_id, dir_path_name=dir_path_name)
-            dirs.append(dir1)
-            now_last_dir = dir1
+        for i, (dir_name, dir_path_name) in enumerate(paths):
+            did = parent_id if i == 0 else -(random.getrandbits(62) + 1)
+            dirs.append(object_class(na=dir_path_name,   # 全路经目录名
+                                     na_md5=get_str_hexMD5(dir_path_name),
+                                     name=dir_name,      # 目录名
+                                     fod=False,          # 目录
+                                     did=did))           # 父目录id
+        try:
+            with transaction.atomic(using=router.db_for_write(object_class)):
+                if len(dirs) == 1:
+                    dirs[0].save(force_insert=True)     # 仅尝试创建文档，不修改已存在文档
+                    return dirs
+
+                object_class.objects.bulk_create(dirs)
+                first = dirs[0]
+                ids = dict(object_class.objects.filter(
+                    Q(did=first.did, name=first.name) | Q(did__in=[d.did for d in dirs[1:]])).values_list('na', 'id'))
+                for i, d in enumerate(dirs):
+                    d.id = ids[d.na]
+                    if i > 0:
+                        d.did = dirs[i - 1].id
+
+                object_class.objects.bulk_update(dirs[1:], fields=['did'])
+        except IntegrityError as e:
+            raise e
+        except Exception as e:
+            raise exceptions.S3InternalError('创建目录元数据错误')
 
         return dirs
 
+    def get_or_create_path_dir_id(self, table_name, path: str):
+        """
+        获取目录路径的目录id，路径不存在则创建整个路径；
+        优先从目录id缓存获取，缓存的目录可能已被其他进程删除，需要按主键确认目录仍存在，否则对象会指向不存在的目录
+
+        :param table_name: 桶的数据库表明称
+        :param path: 目录路径字符串
+        :return:
+            dir id
+
+        :raises: S3Error
+        """
+        path = path.strip('/')
+        if not path:
+            return BucketFileManagement.ROOT_DIR_ID
+
+        did = dir_id_cache.get((table_name, path))
+        if did is not None:
+            model_class = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+            if model_class.objects.filter(id=did, fod=False, na=path).exists():
+                return did
+
+            dir_id_cache.invalidate((table_name, path))
+
+        dirs = self.create_path(table_name=table_name, path=path)
+        return dirs[-1].id
+
     def rmdir(self, bucket_name: str, dirpath: str, user=None):
         """
         删除一个空目录
@@ -385,6 +497,7 @@ class HarborManager:
         if not dir1.do_delete():
             raise exceptions.S3InternalError('删除目录元数据失败')
 
+        dir_id_cache.invalidate((table_name, dir1.na))
         return True
 
     def _list_dir_queryset(self, bucket_name: str, path: str, user=None):
@@ -538,6 +651,9 @@ class HarborManager:
 
         collection_name = bucket.get_bucket_table_name()
         obj, created = self.get_or_create_obj(collection_name, obj_path)
+        if created:
+            buffered_counters.add_bucket_stats(bucket.id, count=1)
+
         return bucket, obj, created
 
     def get_or_create_obj(self, table_name: str, obj_path_name: str):
@@ -597,9 +713,7 @@ class HarborManager:
         did = None
         # 有路径，创建整个路径
         if path:
-            dirs = self.create_path(table_name=table_name, path=path)
-            base_dir = dirs[-1]
-            did = base_dir.id
+            did = self.get_or_create_path_dir_id(table_name=table_name, path=path)
 
         bfm = BucketFileManagement(path=path, collection_name=table_name)
         try:
@@ -665,6 +779,9 @@ class HarborManager:
                 正常：True
                 错误：raise S3Error
         """
+        if RadosGarbageManager.is_enabled():
+            return self._pre_reset_upload_gc(bucket=bucket, obj=obj, rados=rados)
+
         # 先更新元数据，后删除rados数据（如果删除失败，恢复元数据）
         # 更新文件上传时间
         old_ult = obj.ult
@@ -675,6 +792,14 @@ class HarborManager:
         if not obj.do_save(update_fields=['ult', 'si']):
             raise exceptions.S3InternalError('修改对象元数据失败')
 
+        # 清除多部分对象的ETag
+        if not BucketFileManagement(collection_name=bucket.get_bucket_table_name()).set_multipart_etag(obj_id=obj.id):
+            # 恢复元数据
+            obj.ult = old_ult
+            obj.si = old_size
+            obj.do_save(update_fields=['ult', 'si'])
+            raise exceptions.S3InternalError('清除对象多部分ETag失败')
+
         if bucket.is_s3_bucket():
             parts_table_name = bucket.get_parts_table_name()
             # 可能是多部分上传对象，删除part元数据
@@ -695,27 +820,93 @@ class HarborManager:
             obj.do_save(update_fields=['ult', 'si'])
             raise exceptions.S3InternalError('rados文件对象删除失败')
 
+        buffered_counters.add_bucket_stats(bucket.id, size=-(old_size or 0))
         return True
 
-    def _save_one_chunk(self, obj, rados, offset: int, chunk: bytes):
+    @staticmethod
+    def _pre_reset_upload_gc(bucket, obj, rados):
         """
-        保存一个上传的分片
+        覆盖上传前重建对象元数据，对象使用新的id和rados key，元数据提交后旧rados数据加入删除队列异步删除；
+        新的对象行mp_etag等未定义在模型中的列为默认值
+
+        在事务中锁定(did, name)当前的对象行再重建，同一对象的并发覆盖上传排队执行，最后写入的覆盖；
+        入队在元数据提交之后，中间出错只会遗留旧rados数据，不会删除仍被元数据引用的数据；
+        入队失败时同步删除旧rados数据，删除失败只记录日志
 
-        :param obj: 对象元数据
-        :param rados: rados接口
-        :param offset: 分片偏移量
-        :param chunk: 分片数据
+        :param bucket: 桶实例
+        :param obj: 文件对象元数据，id会被修改
+        :param rados: rados接口类对象，rados key会被修改
         :return:
-            成功：True
-            失败：raise S3Error
+                正常：True
+                错误：raise S3Error
         """
-        # 先更新元数据，后写rados数据
-        # 更新文件修改时间和对象大小
-        new_size = offset + len(chunk)  # 分片数据写入后 对象偏移量大小
-        if not self._update_obj_metadata(obj, size=new_size):
+        model = obj.__class__
+        fields = [f.attname for f in model._meta.concrete_fields]
+        using = router.db_for_write(model)
+        old_obj = None      # 重建前的对象行
+        try:
+            with transaction.atomic(using=using):
+                old_obj = model.objects.select_for_update().filter(did=obj.did, name=obj.name).first()
+                if old_obj is not None:     # 对象可能已被并发删除
+                    model.objects.filter(id=old_obj.id).delete()
+                    for f in fields:
+                        setattr(obj, f, getattr(old_obj, f))
+
+                obj.id = None
+                obj.ult = timezone.now()
+                obj.si = 0
+                obj.save(force_insert=True)
+        except Exception as e:
+            if old_obj is not None:
+                for f in fields:
+                    setattr(obj, f, getattr(old_obj, f))
             raise exceptions.S3InternalError('修改对象元数据失败')
 
-        # 存储文件块
+        if old_obj is None:
+            rados.reset_obj_id_and_size(obj_id=obj.get_obj_key(bucket.id), obj_size=0)
+            return True
+
+        if bucket.is_s3_bucket():
+            # 可能是多部分上传对象，删除旧对象的part元数据
+            try:
+                ObjectPartManager(parts_table_name=bucket.get_parts_table_name()).remove_object_parts(
+                    obj_id=old_obj.id)
+            except Exception as e:
+                # 恢复元数据
+                try:
+                    with transaction.atomic(using=using):
+                        model.objects.filter(id=obj.id).delete()
+                        old_obj.save(force_insert=True)
+                except Exception as exc:
+                    logger.error(f'Failed to restore metadata of object {old_obj.na} in bucket {bucket.name}, '
+                                 f'{str(exc)}')
+                for f in fields:
+                    setattr(obj, f, getattr(old_obj, f))
+                raise exceptions.S3InternalError('删除对象part元数据失败')
+
+        # 本进程未写入的下载次数转到新的对象id
+        buffered_counters.move_downloads(model=model, old_id=old_obj.id, new_id=obj.id)
+        pool_name = bucket.get_pool_name()
+        old_key = old_obj.get_obj_key(bucket.id)
+        old_size = old_obj.si
+        if RadosGarbageManager.enqueue([(pool_name, old_key, old_size)]) is None:
+            ok, _ = HarborObject(pool_name=pool_name, obj_id=old_key, obj_size=old_size).delete()
+            if not ok:
+                logger.error(f'Leaked rados data {pool_name}/{old_key} of overwritten object, size {old_size}')
+
+        rados.reset_obj_id_and_size(obj_id=obj.get_obj_key(bucket.id), obj_size=0)
+        buffered_counters.add_bucket_stats(bucket.id, size=-(old_size or 0))
+        return True
+
+    @staticmethod
+    def _write_one_chunk(rados, offset: int, chunk: bytes):
+        """
+        只写rados数据，不更新元数据
+
+        :return:
+            成功：True
+            失败：raise S3Error
+        """
         try:
             ok, msg = rados.write(offset=offset, data_block=chunk)
         except Exception as e:
@@ -723,18 +914,17 @@ class HarborManager:
             msg = str(e)
 
         if not ok:
-            # 手动回滚对象元数据
-            self._update_obj_metadata(obj, obj.si, obj.upt)
             raise exceptions.S3InternalError('文件块rados写入失败:' + msg)
 
         return True
 
-    def _update_obj_metadata(self, obj, size, upt=None):
+    def _update_obj_metadata(self, obj, size, upt=None, md5=None):
         """
         更新对象元数据
         :param obj: 对象, obj实例不会被修改
         :param size: 对象大小
         :param upt: 修改时间
+        :param md5: 对象MD5，默认None不更新
         :return:
             success: True
             failed: False
@@ -742,6 +932,10 @@ class HarborManager:
         if not upt:
             upt = timezone.now()
 
+        fields = {'upt': upt}
+        if md5 is not None:
+            fields['md5'] = md5
+
         model = obj._meta.model
 
         # 更新文件修改时间和对象大小
@@ -750,7 +944,7 @@ class HarborManager:
         try:
             # r = model.objects.filter(id=obj.id, si=obj.si).update(si=new_size, upt=timezone.now())  # 乐观锁方式
             r = model.objects.filter(id=obj.id).update(si=Case(When(si__lt=new_size, then=Value(new_size)),
-                                                               default=F('si')), upt=upt)
+                                                               default=F('si')), **fields)
         except Exception as e:
             return False
         if r > 0:  # 更新行数
@@ -913,20 +1107,91 @@ class HarborManager:
         obj_key = obj.get_obj_key(bucket.id)
         pool_name = bucket.get_pool_name()
 
+        if created:
+            buffered_counters.add_bucket_stats(bucket.id, count=1)
+
         return self.__write_generator(bucket=bucket, pool_name=pool_name, obj_rados_key=obj_key, obj=obj, created=created)
 
     def __write_generator(self, bucket, pool_name, obj_rados_key, obj, created):
+        """
+        对象大小、修改时间在内存中记录，生成器关闭时一次写入元数据，不再每个分片都更新元数据；
+        分片按顺序连续写入时计算对象MD5，关闭时一起写入；
+        settings.WRITE_GENERATOR_CHECKPOINT_INTERVAL(秒)大于0时，写入期间按此间隔提交已写入的大小，
+        进程被终止(如uwsgi reload-on-rss、max-requests)导致上传中断时，已写入的数据仍可通过对象大小访问和续传；
+        写入会产生新的rados分片对象时，先提交写入后的大小，保证元数据大小总能覆盖所有已写入的rados分片，
+        中断后删除对象或回收rados数据时不会遗漏尾部分片；
+        send(None)可立即提交一次
+        """
         ok = True
         rados = HarborObject(pool_name=pool_name, obj_id=obj_rados_key, obj_size=obj.si)
         if created is False:  # 对象已存在，不是新建的,重置对象大小
             self._pre_reset_upload(bucket=bucket, obj=obj, rados=rados)
 
-        while True:
-            offset, data = yield ok
-            try:
-                ok = self._save_one_chunk(obj=obj, rados=rados, offset=offset, chunk=data)
-            except exceptions.S3Error:
-                ok = False
+        checkpoint_interval = getattr(settings, 'WRITE_GENERATOR_CHECKPOINT_INTERVAL', 5)
+        obj_size = 0
+        committed_size = 0
+        upt = None
+        md5 = hashlib.md5()
+        md5_offset = 0          # 已计算MD5的数据长度，None表示非顺序写入，不计算MD5
+        last_commit_time = time.time()
+        try:
+            while True:
+                item = yield ok
+                if item is None:    # 立即提交
+                    ok = self._update_obj_metadata(obj, size=obj_size, upt=upt)
+                    if ok:
+                        committed_size = obj_size
+                        last_commit_time = time.time()
+                    continue
+
+                offset, data = item
+                end = offset + len(data)
+                if self._rados_parts_count(end) > self._rados_parts_count(committed_size):
+                    # 将产生新的rados分片，先提交大小，元数据提交失败不写入；
+                    # 之后即使此分片写入失败，对象大小也不回退，仍覆盖可能已部分写入的分片
+                    upt = timezone.now()
+                    ok = self._update_obj_metadata(obj, size=max(obj_size, end), upt=upt)
+                    if not ok:
+                        continue
+                    obj_size = committed_size = max(obj_size, end)
+
+                try:
+                    ok = self._write_one_chunk(rados=rados, offset=offset, chunk=data)
+                except exceptions.S3Error:
+                    ok = False
+
+                if not ok:
+                    continue
+
+                obj_size = max(obj_size, offset + len(data))
+                upt = timezone.now()
+                if md5_offset is not None:
+                    if offset == md5_offset:
+                        md5.update(data)
+                        md5_offset += len(data)
+                    else:
+                        md5_offset = None
+
+                if 0 < checkpoint_interval <= (time.time() - last_commit_time) and obj_size > committed_size:
+                    if self._update_obj_metadata(obj, size=obj_size, upt=upt):
+                        committed_size = obj_size
+                    last_commit_time = time.time()
+        finally:
+            md5_hex = md5.hexdigest() if md5_offset == obj_size else ''
+            if upt is not None and not self._update_obj_metadata(obj, size=obj_size, upt=upt, md5=md5_hex):
+                logger.error(f'Failed to commit metadata of object {obj.na} in bucket {bucket.name}, '
+                             f'size={obj_size}')
+            buffered_counters.add_bucket_stats(bucket.id, size=obj_size)
+
+    @staticmethod
+    def _rados_parts_count(size: int):
+        """
+        指定大小的对象数据由几个rados分片对象组成
+
+        :param size: 对象大小
+        :return: int
+        """
+        return max((size + MAXSIZE_PER_RADOS_OBJ - 1) // MAXSIZE_PER_RADOS_OBJ, 1)
 
     @staticmethod
     def check_public_or_user_bucket(bucket, user, all_public):
@@ -1081,7 +1346,10 @@ class HarborManager:
         self.check_public_or_user_bucket(bucket=bucket, user=user, all_public=False)
 
         table_name = bucket.get_bucket_table_name()
-        if not prefix:
+        bfm = BucketFileManagement(collection_name=table_name)
+        if bfm.has_sortable_key():      # 按对象key排序
+            objs = bfm.get_key_ordered_queryset(prefix=prefix)
+        elif not prefix:
             objs = self.get_objects_dirs_queryset(table_name=table_name)
         else:
             objs = self.get_prefix_objects_dirs_queryset(table_name=table_name, prefix=prefix)
@@ -1161,46 +1429,146 @@ class HarborManager:
         """
         bucket = self.get_public_or_user_bucket(name=bucket_name, user=user)
         table_name = bucket.get_bucket_table_name()
+        bfm = BucketFileManagement(collection_name=table_name)
 
-        deleted_objects = []
-        not_delete_objects = []
+        items = []      # [(key, path, key_is_dir), ]
         for item in obj_keys:
-            obj_key = key = item.get('Key', '')
+            key = item.get('Key', '')
             if key.endswith('/'):       # 目录
-                key_is_dir = True
-                obj_key = key.rstrip('/')
+                items.append((key, key.rstrip('/'), True))
             else:
-                key_is_dir = False
+                items.append((key, key, False))
 
-            try:
-                try:
-                    obj = self.get_metadata_obj(table_name=table_name, path=obj_key)    # 不检查父路径
-                except Exception as e:
-                    if not isinstance(e, exceptions.S3Error):
-                        raise exceptions.S3InternalError(f'查询对象元数据错误，{str(e)}')
-                    raise e
-
-                if not obj:
-                    raise exceptions.S3NoSuchKey()
-
-                if (key_is_dir and obj.is_dir()) or (not key_is_dir and obj.is_file()):
-                    try:
-                        self.do_delete_obj_or_dir(bucket=bucket, obj=obj)
-                    except exceptions.S3Error as e:
-                        raise e
-
-                    deleted_objects.append({"Key": key})
-                else:
-                    raise exceptions.S3NoSuchKey()
-            except exceptions.S3NoSuchKey as e:
+        errors = {}     # path: S3Error
+        try:
+            objs = bfm.get_objs_by_paths(list({path for _, path, _ in items}))     # 不检查父路径
+        except Exception as e:
+            objs = {}
+            err = exceptions.S3InternalError(f'查询对象元数据错误，{str(e)}')
+            errors = {path: err for _, path, _ in items}
+
+        files = {}
+        dirs = {}
+        for key, path, key_is_dir in items:
+            obj = objs.get(path)
+            if obj is None:
+                continue
+
+            if key_is_dir and obj.is_dir():
+                dirs[path] = obj
+            elif not key_is_dir and obj.is_file():
+                files[path] = obj
+
+        # 先删除对象，再删除空目录，同一请求中目录下的对象被删除后目录可以删除
+        errors.update(self._delete_files(bucket=bucket, bfm=bfm, objs=files))
+        errors.update(self._delete_empty_dirs(bucket=bucket, bfm=bfm, dirs=dirs))
+
+        deleted_objects = []
+        not_delete_objects = []
+        for key, path, key_is_dir in items:
+            e = errors.get(path)
+            if e is None:       # 已删除或不存在
                 deleted_objects.append({"Key": key})
-            except exceptions.S3Error as e:
+            else:
                 err = e.err_data()
                 err['Key'] = key
                 not_delete_objects.append(err)
 
         return deleted_objects, not_delete_objects
 
+    @staticmethod
+    def _delete_files(bucket, bfm, objs: dict):
+        """
+        批量删除多个对象，先一次删除元数据和part元数据，再并发删除rados数据，rados数据删除失败的恢复元数据
+
+        :param objs: {path: obj}
+        :return:
+            {path: S3Error}     # 删除失败的对象
+        """
+        if not objs:
+            return {}
+
+        model = bfm.get_obj_model_class()
+        obj_ids = [obj.id for obj in objs.values()]
+        pool_name = bucket.get_pool_name()
+        try:
+            with transaction.atomic(using=router.db_for_write(model)):
+                model.objects.filter(id__in=obj_ids).delete()
+        except Exception as e:
+            err = exceptions.S3InternalError('删除对象原数据时错误')
+            return {path: err for path in objs}
+
+        if bucket.is_s3_bucket():
+            ObjectPartManager(parts_table_name=bucket.get_parts_table_name()).remove_objects_parts(obj_ids=obj_ids)
+
+        # 元数据提交后rados数据才加入删除队列，入队失败时同步删除
+        if RadosGarbageManager.is_enabled() and RadosGarbageManager.enqueue(
+                [(pool_name, obj.get_obj_key(bucket.id), obj.si) for obj in objs.values()]) is not None:
+            buffered_counters.add_bucket_stats(bucket.id, count=-len(objs), size=-sum(obj.si or 0 for obj in objs.values()))
+            return {}
+
+        def delete_rados(obj):
+            ho = HarborObject(pool_name=pool_name, obj_id=obj.get_obj_key(bucket.id), obj_size=obj.si)
+            ok, _ = ho.delete()
+            return ok
+
+        max_workers = min(len(objs), getattr(settings, 'DELETE_OBJECTS_RADOS_WORKERS', 16))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = dict(zip(objs.keys(), executor.map(delete_rados, objs.values())))
+
+        failed = [objs[path] for path, ok in results.items() if not ok]
+        if failed:
+            # 恢复元数据
+            try:
+                model.objects.bulk_create(failed)
+            except Exception as e:
+                for obj in failed:
+                    obj.do_save(force_insert=True)  # 仅尝试创建文档，不修改已存在文档
+
+        deleted = [objs[path] for path, ok in results.items() if ok]
+        buffered_counters.add_bucket_stats(bucket.id, count=-len(deleted), size=-sum(obj.si or 0 for obj in deleted))
+        err = exceptions.S3InternalError('删除对象rados数据时错误')
+        return {path: err for path, ok in results.items() if not ok}
+
+    @staticmethod
+    def _delete_empty_dirs(bucket, bfm, dirs: dict):
+        """
+        批量删除多个空目录，多级目录都要删除时由深到浅逐级删除
+
+        :param dirs: {path: dir_obj}
+        :return:
+            {path: S3Error}     # 删除失败的目录
+        """
+        if not dirs:
+            return {}
+
+        model = bfm.get_obj_model_class()
+        pending = {obj.id: path for path, obj in dirs.items()}
+        errors = {}
+        while pending:
+            not_empty = set(model.objects.filter(did__in=list(pending.keys())).values_list('did', flat=True).distinct())
+            empty_ids = [i for i in pending if i not in not_empty]
+            if not empty_ids:
+                break
+
+            try:
+                with transaction.atomic(using=router.db_for_write(model)):
+                    model.objects.filter(id__in=empty_ids).delete()
+            except Exception as e:
+                err = exceptions.S3InternalError('删除对象原数据时错误')
+                errors.update({pending[i]: err for i in empty_ids})
+                break
+            finally:
+                for i in empty_ids:
+                    path = pending.pop(i)
+                    dir_id_cache.invalidate((bfm.get_collection_name(), path))
+
+        err = exceptions.S3InvalidRequest('无法删除非空目录')
+        for path in pending.values():
+            errors[path] = err
+
+        return errors
+
     @staticmethod
     def do_delete_obj_or_dir(bucket, obj):
         """
@@ -1214,6 +1582,7 @@ class HarborManager:
         """
         obj_key = obj.get_obj_key(bucket.id)
         old_id = obj.id
+        pool_name = bucket.get_pool_name()
 
         if obj.is_dir():
             if not BucketFileManagement(collection_name=bucket.get_bucket_table_name()).dir_is_empty(obj):
@@ -1224,12 +1593,17 @@ class HarborManager:
             raise exceptions.S3InternalError('删除对象原数据时错误')
 
         if obj.is_dir():
+            dir_id_cache.invalidate((bucket.get_bucket_table_name(), obj.na))
             return True
 
         if bucket.is_s3_bucket():
             ObjectPartManager(parts_table_name=bucket.get_parts_table_name()).remove_object_parts(obj_id=old_id)
 
-        pool_name = bucket.get_pool_name()
+        # 元数据提交后rados数据才加入删除队列，入队失败时同步删除
+        if RadosGarbageManager.is_enabled() and RadosGarbageManager.enqueue([(pool_name, obj_key, obj.si)]) is not None:
+            buffered_counters.add_bucket_stats(bucket.id, count=-1, size=-(obj.si or 0))
+            return True
+
         ho = HarborObject(pool_name=pool_name, obj_id=obj_key, obj_size=obj.si)
         ok, _ = ho.delete()
         if not ok:
@@ -1238,5 +1612,6 @@ class HarborManager:
             obj.do_save(force_insert=True)  # 仅尝试创建文档，不修改已存在文档
             raise exceptions.S3InternalError('删除对象rados数据时错误')
 
+        buffered_counters.add_bucket_stats(bucket.id, count=-1, size=-(obj.si or 0))
         return True
 
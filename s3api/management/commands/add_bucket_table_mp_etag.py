@@ -0,0 +1,128 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from buckets.models import Bucket
+from s3api.models import BucketTableMigration
+from s3api.managers import get_parts_model_class
+from s3api.utils import (BucketFileManagement, ensure_table_for_model_class, is_model_table_exists,
+                         set_table_migration_completed, build_add_mp_etag_sql)
+
+
+class Command(BaseCommand):
+    """
+    为已存在的存储桶对象元数据表(bucket_N)添加多部分对象ETag列mp_etag、part总数列mp_parts_count，
+    并从part表(parts_N)回填已有的多部分对象；按对象id分批回填，记录进度，中断后再次执行从断点继续；
+    完成后，该桶对象的GET、HEAD不再查询part表
+    """
+
+    help = """** manage.py add_bucket_table_mp_etag **
+           ** manage.py add_bucket_table_mp_etag --bucket-name xxx --batch-size 2000 --sleep 0.1 **
+        """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default='', dest='bucket_name', type=str,
+            help='Only migrate the table of this bucket.',
+        )
+        parser.add_argument(
+            '--batch-size', default=2000, dest='batch_size', type=int,
+            help='The number of part rows read in one batch.',
+        )
+        parser.add_argument(
+            '--sleep', default=0.1, dest='sleep', type=float,
+            help='Seconds to sleep after each batch, to limit the load on the database.',
+        )
+
+    def handle(self, *args, **options):
+        bucket_name = options['bucket_name']
+        self.batch_size = options['batch_size']
+        self.sleep = options['sleep']
+
+        if self.batch_size <= 0:
+            raise CommandError("Invalid value of batch size.")
+
+        if not ensure_table_for_model_class(BucketTableMigration):
+            raise CommandError("Failed to create the table of BucketTableMigration.")
+
+        qs = Bucket.objects.all()
+        if bucket_name:
+            qs = qs.filter(name=bucket_name)
+
+        buckets = list(qs.order_by('id'))
+        if bucket_name and not buckets:
+            raise CommandError("Bucket not found.")
+
+        self.stdout.write(self.style.NOTICE(f'Will add column mp_etag for {len(buckets)} buckets.'))
+        for bucket in buckets:
+            table_name = bucket.get_bucket_table_name()
+            try:
+                self.migrate_table(bucket=bucket, table_name=table_name)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(
+                    f'Failed to add column mp_etag to table {table_name} of bucket {bucket.name}, {str(e)}'))
+                continue
+
+    def migrate_table(self, bucket, table_name: str):
+        migration, created = BucketTableMigration.objects.get_or_create(
+            table_name=table_name, name=BucketTableMigration.NAME_MP_ETAG)
+        if migration.completed:
+            self.stdout.write(f'Table {table_name} has been completed, skip.')
+            return
+
+        model_class = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+        if not is_model_table_exists(model_class):
+            self.stdout.write(self.style.WARNING(f'Table {table_name} is not exists, skip.'))
+            return
+
+        start_time = time.time()
+        connection = connections[router.db_for_write(model_class)]
+        with connection.cursor() as cursor:
+            columns = [c.name for c in connection.introspection.get_table_description(cursor, table_name)]
+            if 'mp_etag' not in columns:
+                cursor.execute(build_add_mp_etag_sql(table_name))
+
+        parts_class = get_parts_model_class(bucket.get_parts_table_name())
+        count = 0
+        if is_model_table_exists(parts_class):
+            count = self.backfill(migration=migration, model_class=model_class, parts_class=parts_class)
+
+        set_table_migration_completed(table_name=table_name, name=BucketTableMigration.NAME_MP_ETAG)
+        self.stdout.write(self.style.SUCCESS(
+            f'Table {table_name} completed, backfilled {count} objects, in {time.time() - start_time:.1f}s.'))
+
+    def backfill(self, migration, model_class, parts_class):
+        """
+        从part表回填多部分对象的ETag和part总数；同一对象的所有part记录的obj_etag、parts_count相同
+
+        :return: 回填的对象数
+        """
+        connection = connections[router.db_for_write(model_class)]
+        sql = f'UPDATE `{model_class._meta.db_table}` SET `mp_etag` = %s, `mp_parts_count` = %s ' \
+              f'WHERE `id` = %s AND `mp_etag` = \'\''
+        count = 0
+        last_id = migration.last_id
+        while True:
+            rows = list(parts_class.objects.filter(obj_id__gt=last_id).order_by('obj_id').values_list(
+                'obj_id', 'obj_etag', 'parts_count')[0:self.batch_size])
+            if not rows:
+                break
+
+            objs = {}
+            for obj_id, obj_etag, parts_count in rows:
+                if obj_etag:
+                    objs[obj_id] = (obj_etag, parts_count)
+
+            if objs:
+                with connection.cursor() as cursor:
+                    cursor.executemany(sql, [[etag, parts_count, obj_id] for obj_id, (etag, parts_count) in objs.items()])
+
+            count += len(objs)
+            last_id = rows[-1][0]
+            migration.last_id = last_id
+            migration.save(update_fields=['last_id', 'modified_time'])
+            if self.sleep > 0:
+                time.sleep(self.sleep)
+
+        return count
@@ -0,0 +1,84 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from buckets.models import Bucket
+from s3api.models import BucketTableMigration
+from s3api.utils import (BucketFileManagement, ensure_table_for_model_class, is_model_table_exists,
+                         set_table_migration_completed, build_add_skey_sql)
+
+
+class Command(BaseCommand):
+    """
+    为已存在的存储桶对象元数据表(bucket_N)添加可排序的对象key虚拟列skey和索引，每个表记录完成状态；
+    完成后，该桶的对象列举按key排序分页，前缀列举走skey索引范围查询
+    """
+
+    help = """** manage.py add_bucket_table_skey **
+           ** manage.py add_bucket_table_skey --bucket-name xxx --sleep 1 **
+        """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default='', dest='bucket_name', type=str,
+            help='Only migrate the table of this bucket.',
+        )
+        parser.add_argument(
+            '--sleep', default=1.0, dest='sleep', type=float,
+            help='Seconds to sleep after each table, to limit the load on the database.',
+        )
+
+    def handle(self, *args, **options):
+        bucket_name = options['bucket_name']
+        sleep = options['sleep']
+
+        if not ensure_table_for_model_class(BucketTableMigration):
+            raise CommandError("Failed to create the table of BucketTableMigration.")
+
+        qs = Bucket.objects.all()
+        if bucket_name:
+            qs = qs.filter(name=bucket_name)
+
+        buckets = list(qs.order_by('id').values_list('id', 'name', 'collection_name'))
+        if bucket_name and not buckets:
+            raise CommandError("Bucket not found.")
+
+        self.stdout.write(self.style.NOTICE(f'Will add column skey for {len(buckets)} buckets.'))
+        for bucket_id, name, collection_name in buckets:
+            table_name = collection_name if collection_name else f'bucket_{bucket_id}'
+            try:
+                migrated = self.migrate_table(table_name=table_name)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Failed to add column skey to table {table_name} of bucket {name}, {str(e)}'))
+                continue
+
+            if migrated and sleep > 0:
+                time.sleep(sleep)
+
+    def migrate_table(self, table_name: str):
+        """
+        :return:
+            True    # 执行了表结构变更
+            False   # 跳过
+        """
+        if BucketTableMigration.objects.filter(
+                table_name=table_name, name=BucketTableMigration.NAME_SKEY, completed=True).exists():
+            self.stdout.write(f'Table {table_name} has been completed, skip.')
+            return False
+
+        model_class = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+        if not is_model_table_exists(model_class):
+            self.stdout.write(self.style.WARNING(f'Table {table_name} is not exists, skip.'))
+            return False
+
+        start_time = time.time()
+        connection = connections[router.db_for_write(model_class)]
+        with connection.cursor() as cursor:
+            columns = [c.name for c in connection.introspection.get_table_description(cursor, table_name)]
+            if 'skey' not in columns:
+                cursor.execute(build_add_skey_sql(table_name))
+
+        set_table_migration_completed(table_name=table_name, name=BucketTableMigration.NAME_SKEY)
+        self.stdout.write(self.style.SUCCESS(f'Table {table_name} completed, in {time.time() - start_time:.1f}s.'))
+        return True
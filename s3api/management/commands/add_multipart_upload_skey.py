@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+
+from s3api.models import BucketTableMigration, MultipartUpload
+from s3api.utils import (ensure_table_for_model_class, is_model_table_exists, set_table_migration_completed,
+                         build_add_upload_skey_sql)
+
+
+class Command(BaseCommand):
+    """
+    为已存在的多部分上传表(multipart_upload)添加可排序的对象key虚拟列skey和索引(bucket_id, skey)，记录完成状态；
+    完成后，ListMultipartUploads按(key, upload id)索引范围分页，前缀列举走索引范围查询
+    """
+
+    help = """** manage.py add_multipart_upload_skey **"""
+
+    def handle(self, *args, **options):
+        if not ensure_table_for_model_class(BucketTableMigration):
+            raise CommandError("Failed to create the table of BucketTableMigration.")
+
+        table_name = MultipartUpload._meta.db_table
+        if BucketTableMigration.objects.filter(
+                table_name=table_name, name=BucketTableMigration.NAME_SKEY, completed=True).exists():
+            self.stdout.write(f'Table {table_name} has been completed, skip.')
+            return
+
+        if not is_model_table_exists(MultipartUpload):
+            raise CommandError(f'Table {table_name} is not exists.')
+
+        start_time = time.time()
+        connection = connections[router.db_for_write(MultipartUpload)]
+        with connection.cursor() as cursor:
+            columns = [c.name for c in connection.introspection.get_table_description(cursor, table_name)]
+            if 'skey' not in columns:
+                cursor.execute(build_add_upload_skey_sql(table_name))
+
+        set_table_migration_completed(table_name=table_name, name=BucketTableMigration.NAME_SKEY)
+        self.stdout.write(self.style.SUCCESS(f'Table {table_name} completed, in {time.time() - start_time:.1f}s.'))
@@ -0,0 +1,100 @@
+import time
+from datetime import datetime
+from hashlib import sha256
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from rest_framework.request import Request
+
+from s3api.auth import S3V4Authentication, signing_key_cache, SIGV4_TIMESTAMP, AWS4_HMAC_SHA256
+from users.cache import auth_key_cache
+from users.models import AuthKey
+
+
+class Command(BaseCommand):
+    """
+    S3 v4签名认证性能测试，对比无缓存和有缓存时每个请求的认证耗时和数据库查询次数
+    """
+
+    help = """** manage.py auth_benchmark --access-key xxx **"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--access-key', default='', dest='access_key', type=str,
+            help='The access key used to sign requests.',
+        )
+        parser.add_argument(
+            '--count', default=1000, dest='count', type=int,
+            help='The number of requests to authenticate in each round.',
+        )
+        parser.add_argument(
+            '--path', default='/', dest='path', type=str,
+            help='The request path to sign.',
+        )
+
+    def handle(self, *args, **options):
+        access_key = options['access_key']
+        count = options['count']
+        path = options['path']
+        if not access_key:
+            raise CommandError("Must input the access key.")
+        if count <= 0:
+            raise CommandError("Invalid value of count.")
+
+        auth_key = AuthKey.objects.filter(id=access_key).first()
+        if auth_key is None:
+            raise CommandError("Access key not found.")
+
+        request = self.build_signed_request(path=path, access_key=access_key, secret_key=auth_key.secret_key)
+
+        self.stdout.write(f'Authenticate {count} requests each round.')
+        self.run_round(name='no cache', request=request, count=count, clear_cache=True)
+        self.run_round(name='cached', request=request, count=count, clear_cache=False)
+        self.stdout.write(f'auth key cache stats: {auth_key_cache.get_stats()}')
+        self.stdout.write(f'signing key cache stats: {signing_key_cache.get_stats()}')
+
+    def run_round(self, name, request, count, clear_cache: bool):
+        auth_key_cache.clear()
+        signing_key_cache.clear()
+        S3V4Authentication().authenticate(request)    # 预热
+
+        connection = connections[DEFAULT_DB_ALIAS]
+        with CaptureQueriesContext(connection) as ctx:
+            start = time.perf_counter()
+            for _ in range(count):
+                if clear_cache:
+                    auth_key_cache.clear()
+                    signing_key_cache.clear()
+
+                S3V4Authentication().authenticate(request)
+            seconds = time.perf_counter() - start
+
+        self.stdout.write(self.style.SUCCESS(
+            f'[{name}] total {seconds:.3f}s, {seconds * 1e6 / count:.1f}us/request, '
+            f'{len(ctx.captured_queries) / count:.2f} queries/request'))
+
+    @staticmethod
+    def build_signed_request(path, access_key, secret_key):
+        amz_date = datetime.utcnow().strftime(SIGV4_TIMESTAMP)
+        credential = f'{access_key}/{amz_date[0:8]}/us-east-1/s3/aws4_request'
+        signed_headers = 'host;x-amz-content-sha256;x-amz-date'
+        headers = {
+            'HTTP_HOST': 'localhost',
+            'HTTP_X_AMZ_DATE': amz_date,
+            'HTTP_X_AMZ_CONTENT_SHA256': sha256(b'').hexdigest()
+        }
+        http_request = RequestFactory().get(path, **headers)
+
+        auth = S3V4Authentication()
+        auth.s3_timestamp = amz_date
+        auth.s3_credential = credential
+        auth._access_key = access_key
+        auth._region_name = 'us-east-1'
+        auth._service_name = 's3'
+        signature = auth.generate_signature(request=Request(http_request), signed_headers=signed_headers,
+                                            secret_key=secret_key)
+        http_request.META['HTTP_AUTHORIZATION'] = f'{AWS4_HMAC_SHA256} Credential={credential},' \
+                                                  f'SignedHeaders={signed_headers},Signature={signature}'
+        return Request(http_request)
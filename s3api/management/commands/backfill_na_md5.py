@@ -0,0 +1,108 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from buckets.models import Bucket, get_str_hexMD5
+from s3api.models import BucketTableMigration
+from s3api.utils import (BucketFileManagement, ensure_table_for_model_class, is_model_table_exists,
+                         set_table_migration_completed)
+
+
+class Command(BaseCommand):
+    """
+    为所有存储桶对象元数据表(bucket_N)回填na_md5，按对象id分批处理，每个表记录进度，中断后再次执行会从断点继续；
+    表回填完成后，查询对象只走na_md5索引
+    """
+
+    help = """** manage.py backfill_na_md5 **
+           ** manage.py backfill_na_md5 --bucket-name xxx --batch-size 2000 --sleep 0.2 **
+        """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default='', dest='bucket_name', type=str,
+            help='Only backfill the table of this bucket.',
+        )
+        parser.add_argument(
+            '--batch-size', default=1000, dest='batch_size', type=int,
+            help='The number of rows scanned in one batch.',
+        )
+        parser.add_argument(
+            '--sleep', default=0.1, dest='sleep', type=float,
+            help='Seconds to sleep after each batch, to limit the load on the database.',
+        )
+        parser.add_argument(
+            '--reset', default=False, nargs='?', dest='reset', type=bool, const=True,
+            help='Ignore the recorded progress and start from the beginning.',
+        )
+
+    def handle(self, *args, **options):
+        bucket_name = options['bucket_name']
+        batch_size = options['batch_size']
+        sleep = options['sleep']
+        reset = options['reset']
+        if batch_size <= 0:
+            raise CommandError("Invalid value of batch size.")
+
+        if not ensure_table_for_model_class(BucketTableMigration):
+            raise CommandError("Failed to create the table of BucketTableMigration.")
+
+        qs = Bucket.objects.all()
+        if bucket_name:
+            qs = qs.filter(name=bucket_name)
+
+        buckets = list(qs.order_by('id').values_list('id', 'name', 'collection_name'))
+        if bucket_name and not buckets:
+            raise CommandError("Bucket not found.")
+
+        self.stdout.write(self.style.NOTICE(f'Will backfill na_md5 for {len(buckets)} buckets.'))
+        for bucket_id, name, collection_name in buckets:
+            table_name = collection_name if collection_name else f'bucket_{bucket_id}'
+            try:
+                self.backfill_table(table_name=table_name, batch_size=batch_size, sleep=sleep, reset=reset)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Failed to backfill table {table_name} of bucket {name}, {str(e)}'))
+
+    def backfill_table(self, table_name: str, batch_size: int, sleep: float, reset: bool):
+        model_class = BucketFileManagement(collection_name=table_name).get_obj_model_class()
+        if not is_model_table_exists(model_class):
+            self.stdout.write(self.style.WARNING(f'Table {table_name} is not exists, skip.'))
+            return
+
+        migration, created = BucketTableMigration.objects.get_or_create(
+            table_name=table_name, name=BucketTableMigration.NAME_NA_MD5)
+        if reset:
+            migration.last_id = 0
+            migration.completed = False
+            migration.save(update_fields=['last_id', 'completed', 'modified_time'])
+        elif migration.completed:
+            self.stdout.write(f'Table {table_name} has been completed, skip.')
+            return
+
+        updated_count = 0
+        start_time = time.time()
+        while True:
+            rows = list(model_class.objects.filter(id__gt=migration.last_id).order_by('id').values_list(
+                'id', 'na', 'na_md5')[0:batch_size])
+            if not rows:
+                break
+
+            objs = [model_class(id=obj_id, na_md5=get_str_hexMD5(na)) for obj_id, na, na_md5 in rows if not na_md5]
+            if objs:
+                model_class.objects.bulk_update(objs, fields=['na_md5'])
+                updated_count += len(objs)
+
+            migration.last_id = rows[-1][0]
+            migration.save(update_fields=['last_id', 'modified_time'])
+            if sleep > 0:
+                time.sleep(sleep)
+
+        # 回填期间可能有旧代码写入的记录，确认没有na_md5为空的记录才标记完成
+        if model_class.objects.filter(na_md5__isnull=True).exists():
+            self.stdout.write(self.style.WARNING(
+                f'Table {table_name} still has rows without na_md5, run the command again later.'))
+            return
+
+        set_table_migration_completed(table_name=table_name, name=BucketTableMigration.NAME_NA_MD5)
+        self.stdout.write(self.style.SUCCESS(
+            f'Table {table_name} completed, updated {updated_count} rows, in {time.time() - start_time:.1f}s.'))
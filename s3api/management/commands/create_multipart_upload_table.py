@@ -1,7 +1,8 @@
 from django.core.management.base import BaseCommand, CommandError
 
-from s3api.utils import (create_table_for_model_class, is_model_table_exists, delete_table_for_model_class)
-from s3api.models import MultipartUpload
+from s3api.utils import (create_table_for_model_class, is_model_table_exists, delete_table_for_model_class,
+                         ensure_table_for_model_class, set_table_migration_completed)
+from s3api.models import MultipartUpload, BucketTableMigration
 
 
 class Command(BaseCommand):
@@ -45,6 +46,10 @@ class Command(BaseCommand):
                     raise CommandError("cancelled.")
 
                 if create_table_for_model_class(MultipartUpload):
+                    # 新建的表已有skey列
+                    if ensure_table_for_model_class(BucketTableMigration):
+                        set_table_migration_completed(table_name=MultipartUpload._meta.db_table,
+                                                      name=BucketTableMigration.NAME_SKEY)
                     self.stdout.write(self.style.SUCCESS('Create the table Successfully.'))
                 else:
                     self.stdout.write(self.style.ERROR('Failed to create the table'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from s3api.utils import create_table_for_model_class, is_model_table_exists
+from s3api.models import RadosGarbage
+
+
+class Command(BaseCommand):
+    """
+    创建rados数据删除队列数据库表
+    """
+
+    help = """** manage.py create_rados_garbage_table **"""
+
+    def handle(self, *args, **options):
+        RadosGarbage._meta.managed = True
+        if is_model_table_exists(RadosGarbage):
+            self.stdout.write(self.style.SUCCESS('The table already exists'))
+            return
+
+        if input('Are you sure to create the table?\n\n' + "Type 'yes' to continue, or 'no' to cancel: ") != 'yes':
+            raise CommandError("cancelled.")
+
+        if create_table_for_model_class(RadosGarbage):
+            self.stdout.write(self.style.SUCCESS('Create the table Successfully.'))
+        else:
+            self.stdout.write(self.style.ERROR('Failed to create the table'))
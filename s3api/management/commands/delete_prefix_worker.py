@@ -0,0 +1,82 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from s3api.models import DeletePrefixJob
+from s3api.delete_prefix import PrefixDeleter
+
+
+class Command(BaseCommand):
+    """
+    执行删除前缀任务
+
+    按创建顺序领取等待中的任务，以及进度长时间未更新(执行进程中断)的执行中任务，领取后从头重新执行(已删除的不会重复删除)；
+    可以启动多个进程，每个任务只会被一个进程领取
+    """
+
+    help = """** manage.py delete_prefix_worker **
+           ** manage.py delete_prefix_worker --batch-size 1000 --once **
+        """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', default=getattr(settings, 'DELETE_PREFIX_BATCH_SIZE', 1000), dest='batch_size', type=int,
+            help='The number of objects deleted in one batch.',
+        )
+        parser.add_argument(
+            '--stale-timeout', default=600, dest='stale_timeout', type=int,
+            help='Seconds after which a running job without progress is taken over.',
+        )
+        parser.add_argument(
+            '--idle-sleep', default=5, dest='idle_sleep', type=float,
+            help='Seconds to sleep when there is no job.',
+        )
+        parser.add_argument(
+            '--once', default=False, nargs='?', dest='once', type=bool, const=True,
+            help='Exit when there is no job, instead of waiting.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size <= 0:
+            raise CommandError("Invalid value of batch size.")
+
+        stale_timeout = timedelta(seconds=options['stale_timeout'])
+        self.stdout.write(self.style.NOTICE('Delete prefix worker started.'))
+        while True:
+            job = self.claim_job(stale_timeout=stale_timeout)
+            if job is None:
+                if options['once']:
+                    break
+
+                time.sleep(options['idle_sleep'])
+                continue
+
+            self.stdout.write(f'Job {job.id} started, bucket {job.bucket_name}, prefix "{job.prefix}".')
+            PrefixDeleter(job=job, batch_size=batch_size, log=self.stdout.write).run()
+
+        self.stdout.write(self.style.SUCCESS('Delete prefix worker completed.'))
+
+    @staticmethod
+    def claim_job(stale_timeout):
+        """
+        领取一个任务，条件更新保证只被一个进程领取
+
+        :return: DeletePrefixJob() or None
+        """
+        now = timezone.now()
+        lookups = Q(status=DeletePrefixJob.STATUS_PENDING) | Q(
+            status=DeletePrefixJob.STATUS_RUNNING, modified_time__lt=now - stale_timeout)
+        for job in DeletePrefixJob.objects.filter(lookups).order_by('create_time')[0:10]:
+            r = DeletePrefixJob.objects.filter(id=job.id, status=job.status, modified_time=job.modified_time).update(
+                status=DeletePrefixJob.STATUS_RUNNING, start_time=now, modified_time=now)
+            if r > 0:
+                job.status = DeletePrefixJob.STATUS_RUNNING
+                job.start_time = job.modified_time = now
+                return job
+
+        return None
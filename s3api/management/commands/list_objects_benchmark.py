@@ -0,0 +1,92 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from buckets.models import Bucket
+from s3api import serializers, renders
+from s3api.utils import BucketFileManagement, as_list_rows_queryset
+
+
+class Command(BaseCommand):
+    """
+    列举对象序列化性能测试，对比模型实例+DRF序列化器和只查询需要的列+元组行数据两种方式，
+    每1000个key的CPU时间(包括从数据库结果构建行、序列化和渲染xml)
+    """
+
+    help = """** manage.py list_objects_benchmark --bucket-name xxx **"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default='', dest='bucket_name', type=str,
+            help='The bucket to list objects.',
+        )
+        parser.add_argument(
+            '--max-keys', default=1000, dest='max_keys', type=int,
+            help='The number of keys listed in each request.',
+        )
+        parser.add_argument(
+            '--rounds', default=20, dest='rounds', type=int,
+            help='The number of listings in each case.',
+        )
+
+    def handle(self, *args, **options):
+        bucket_name = options['bucket_name']
+        max_keys = options['max_keys']
+        rounds = options['rounds']
+        if not bucket_name:
+            raise CommandError("Must input the bucket name.")
+        if max_keys <= 0 or rounds <= 0:
+            raise CommandError("Invalid value of max-keys or rounds.")
+
+        bucket = Bucket.get_bucket_by_name(bucket_name)
+        if not bucket:
+            raise CommandError("Bucket not found.")
+
+        bfm = BucketFileManagement(collection_name=bucket.get_bucket_table_name())
+        if bfm.has_sortable_key():
+            queryset = bfm.get_key_ordered_queryset()
+        else:
+            queryset = bfm.get_objects_dirs_queryset()
+
+        user = bucket.user
+        key_count = len(list(as_list_rows_queryset(queryset)[0:max_keys]))
+        if key_count == 0:
+            raise CommandError("The bucket is empty.")
+
+        self.stdout.write(f'List {key_count} keys per request, {rounds} rounds each case.')
+        for version, renderer_class in [('v1', renders.ListObjectsV1XMLRenderer),
+                                        ('v2', renders.ListObjectsV2XMLRenderer)]:
+            with_owner = version == 'v1'
+
+            def model_listing():
+                objs = list(queryset[0:max_keys])
+                if with_owner:
+                    s = serializers.ObjectListWithOwnerSerializer(objs, many=True, context={'user': user})
+                else:
+                    s = serializers.ObjectListV2Serializer(objs, many=True)
+                return renderer_class().render({'Name': bucket_name, 'Contents': s.data})
+
+            def rows_listing():
+                rows = list(as_list_rows_queryset(queryset)[0:max_keys])
+                s = serializers.ObjectListRowsSerializer(rows, user=user, with_owner=with_owner)
+                return renderer_class().render({'Name': bucket_name, 'Contents': s.data})
+
+            if model_listing() != rows_listing():
+                self.stdout.write(self.style.WARNING(f'[{version}] the outputs of the two ways are different.'))
+
+            before = self.cpu_time_per_1000_keys(model_listing, rounds=rounds, key_count=key_count)
+            after = self.cpu_time_per_1000_keys(rows_listing, rounds=rounds, key_count=key_count)
+            self.stdout.write(self.style.SUCCESS(
+                f'[{version}] model objects: {before:.2f}ms, rows: {after:.2f}ms per 1000 keys, '
+                f'{before / after if after else 0:.1f}x'))
+
+    @staticmethod
+    def cpu_time_per_1000_keys(func, rounds: int, key_count: int):
+        """
+        :return: CPU毫秒
+        """
+        start = time.process_time()
+        for _ in range(rounds):
+            func()
+        seconds = time.process_time() - start
+        return seconds * 1000 / rounds * 1000 / key_count
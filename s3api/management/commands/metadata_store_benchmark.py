@@ -0,0 +1,103 @@
+import os
+import time
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from s3api.metastore import get_metadata_store, BACKEND_ORM
+
+
+class Command(BaseCommand):
+    """
+    元数据存储后端性能测试，在临时表中批量创建、按路径查询、keyset分页列举、统计和批量删除，输出每秒操作数
+    """
+
+    help = """** manage.py metadata_store_benchmark --backend orm --count 100000 **"""
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--backend', default=BACKEND_ORM, dest='backend', choices=[BACKEND_ORM],
+            help='The metadata store backend.',
+        )
+        parser.add_argument(
+            '--count', default=100000, dest='count', type=int,
+            help='The number of objects created.',
+        )
+        parser.add_argument(
+            '--batch-size', default=1000, dest='batch_size', type=int,
+            help='The number of objects in one bulk operation.',
+        )
+        parser.add_argument(
+            '--gets', default=10000, dest='gets', type=int,
+            help='The number of random gets by path.',
+        )
+
+    def handle(self, *args, **options):
+        count = options['count']
+        batch_size = options['batch_size']
+        gets = options['gets']
+        if count <= 0 or batch_size <= 0 or gets < 0:
+            raise CommandError("Invalid value of count, batch size or gets.")
+
+        store = get_metadata_store(f'bucket_benchmark_{os.getpid()}', backend=options['backend'])
+        if not store.create_table():
+            raise CommandError(f'Failed to create table {store.table_name}.')
+
+        try:
+            self.run(store=store, count=count, batch_size=batch_size, gets=gets)
+        finally:
+            store.drop_table()
+
+    def run(self, store, count: int, batch_size: int, gets: int):
+        dirs = [store.create(na=f'dir{i}', did=store.ROOT_DIR_ID, fod=False) for i in range(100)]
+        paths = []
+        items = []
+        for i in range(count):
+            d = dirs[i % len(dirs)]
+            na = f'{d.na}/obj{i:010}'
+            paths.append(na)
+            items.append({'na': na, 'did': d.id, 'si': i, 'md5': 'd41d8cd98f00b204e9800998ecf8427e'})
+
+        self.report('bulk create', count, lambda: store.bulk_create(items, batch_size=batch_size))
+
+        samples = random.choices(paths, k=gets)
+        self.report('get by path', gets, lambda: [store.get(p) for p in samples])
+
+        def list_all():
+            after = ''
+            while True:
+                page = store.list_prefix(after_key=after, limit=batch_size)
+                if not page:
+                    break
+                after = page[-1].na
+
+        self.report('list prefix', count + len(dirs), list_all)
+
+        def list_dirs():
+            for d in dirs:
+                after = ''
+                while True:
+                    page = store.list_dir(d.id, after_name=after, limit=batch_size)
+                    if not page:
+                        break
+                    after = page[-1].name
+
+        self.report('list dir', count, list_dirs)
+        self.report('stats', 1, store.stats)
+
+        def delete_all():
+            after = ''
+            while True:
+                page = store.list_prefix(after_key=after, limit=batch_size)
+                if not page:
+                    break
+                after = page[-1].na
+                store.bulk_delete([o.id for o in page], batch_size=batch_size)
+
+        self.report('bulk delete', count + len(dirs), delete_all)
+
+    def report(self, name: str, ops: int, func):
+        start = time.time()
+        func()
+        seconds = max(time.time() - start, 1e-6)
+        self.stdout.write(f'{name:<12}: {ops} in {seconds:.3f}s, {ops / seconds:.0f} ops/s')
@@ -0,0 +1,267 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction, IntegrityError
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+
+from buckets.models import Bucket, BucketFileBase
+from buckets.cache import bucket_cache
+from buckets.shards import (DEFAULT_SHARD, METADATA, PART_METADATA, is_valid_shard, get_shard_db_alias,
+                            set_table_shard_cache, table_shard_cache)
+from s3api.models import BucketTableMigration
+from s3api.managers import get_parts_model_class
+from s3api.utils import (BucketFileManagement, create_table_for_model_class, delete_table_for_model_class,
+                         is_model_table_exists, set_table_migration_completed)
+
+
+EXTRA_OBJ_COLUMNS = ['mp_etag', 'mp_parts_count']
+
+
+class Command(BaseCommand):
+    """
+    在线迁移存储桶的对象元数据表和part元数据表到另一个分片数据库
+
+    1. 不锁定桶，按id分批复制和校对数据到目标分片；
+    2. 锁定桶写(只读)，等待所有进程的桶缓存过期，再次校对数据；
+    3. 修改桶的分片，等待所有进程的分片缓存过期，最后校对一次数据，解锁；
+    4. 可选删除源分片的表
+    """
+
+    help = """** manage.py move_bucket_shard --bucket-name xxx --to-shard shard1 **
+           ** manage.py move_bucket_shard --bucket-name xxx --to-shard default --drop-source **
+        """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--bucket-name', default='', dest='bucket_name', type=str,
+            help='The bucket to move.',
+        )
+        parser.add_argument(
+            '--to-shard', default='', dest='to_shard', type=str,
+            help='The target shard name in settings.METADATA_SHARDS, "default" is the default database.',
+        )
+        parser.add_argument(
+            '--batch-size', default=2000, dest='batch_size', type=int,
+            help='The number of rows copied in one batch.',
+        )
+        parser.add_argument(
+            '--sleep', default=0.05, dest='sleep', type=float,
+            help='Seconds to sleep after each batch, to limit the load on the database.',
+        )
+        parser.add_argument(
+            '--lock-wait', default=60, dest='lock_wait', type=float,
+            help='Seconds to wait after locking the bucket, for the writing requests in progress to finish.',
+        )
+        parser.add_argument(
+            '--drop-source', default=False, nargs='?', dest='drop_source', type=bool, const=True,
+            help='Drop the tables in the source shard after moving.',
+        )
+
+    def handle(self, *args, **options):
+        bucket_name = options['bucket_name']
+        to_shard = options['to_shard']
+        self.batch_size = options['batch_size']
+        self.sleep = options['sleep']
+        lock_wait = options['lock_wait']
+        drop_source = options['drop_source']
+
+        if not bucket_name:
+            raise CommandError("Must input the bucket name.")
+        if to_shard == 'default':
+            to_shard = DEFAULT_SHARD
+        elif not to_shard or not is_valid_shard(to_shard):
+            raise CommandError("Invalid value of to-shard.")
+        if self.batch_size <= 0:
+            raise CommandError("Invalid value of batch size.")
+
+        bucket = Bucket.objects.filter(name=bucket_name).first()
+        if bucket is None:
+            raise CommandError("Bucket not found.")
+
+        from_shard = bucket.shard
+        if from_shard == to_shard:
+            raise CommandError("The bucket is already in the shard.")
+
+        if bucket.lock != Bucket.LOCK_READWRITE:
+            raise CommandError("The bucket is locked, unlock it first.")
+
+        tables = self.get_tables_to_move(bucket=bucket, from_shard=from_shard, to_shard=to_shard)
+        if not tables:
+            self.stdout.write('The source and target shards are the same databases, only update the shard of bucket.')
+            self.set_bucket_shard(bucket, to_shard)
+            return
+
+        self.stdout.write(self.style.NOTICE(f'Will move bucket {bucket_name} from shard "{from_shard}" to "{to_shard}".'))
+        for model, src, dst in tables:
+            if not is_model_table_exists(model, using=dst):
+                if not create_table_for_model_class(model, using=dst):
+                    raise CommandError(f'Failed to create table {model._meta.db_table} in database {dst}.')
+
+        # 不锁定桶，复制数据
+        self.sync_tables(tables)
+
+        self.set_bucket_lock(bucket, Bucket.LOCK_READONLY)
+        try:
+            self.stdout.write(f'Bucket locked for writing, wait {lock_wait}s.')
+            time.sleep(lock_wait)
+            self.sync_tables(tables)
+
+            self.set_bucket_shard(bucket, to_shard)
+            wait = table_shard_cache.timeout
+            self.stdout.write(f'Shard of bucket changed, wait {wait}s for the shard cache of other processes.')
+            time.sleep(wait)
+            # 缓存过期前其他进程可能仍写入源分片
+            self.sync_tables(tables)
+        finally:
+            self.set_bucket_lock(bucket, Bucket.LOCK_READWRITE)
+
+        # 目标分片的新表创建时已添加skey列
+        set_table_migration_completed(table_name=bucket.get_bucket_table_name(), name=BucketTableMigration.NAME_SKEY)
+        self.stdout.write(self.style.SUCCESS(f'Bucket {bucket_name} moved to shard "{to_shard}".'))
+
+        if drop_source:
+            for model, src, dst in tables:
+                if delete_table_for_model_class(model, using=src):
+                    self.stdout.write(f'Dropped table {model._meta.db_table} in database {src}.')
+                else:
+                    self.stdout.write(self.style.ERROR(f'Failed to drop table {model._meta.db_table} in database {src}.'))
+
+    @staticmethod
+    def get_tables_to_move(bucket, from_shard: str, to_shard: str):
+        """
+        :return: [(model, src_db_alias, dst_db_alias), ]
+        """
+        obj_model = BucketFileManagement(collection_name=bucket.get_bucket_table_name()).get_obj_model_class()
+        parts_model = get_parts_model_class(bucket.get_parts_table_name())
+        tables = []
+        for model, db_type in [(obj_model, METADATA), (parts_model, PART_METADATA)]:
+            src = get_shard_db_alias(from_shard, db_type)
+            dst = get_shard_db_alias(to_shard, db_type)
+            if src == dst:
+                continue
+
+            if not is_model_table_exists(model, using=src):     # 非S3桶可能没有part表
+                continue
+
+            tables.append((model, src, dst))
+
+        return tables
+
+    @staticmethod
+    def set_bucket_lock(bucket, lock: int):
+        Bucket.objects.filter(id=bucket.id).update(lock=lock)
+        bucket_cache.invalidate(bucket.name)
+
+    @staticmethod
+    def set_bucket_shard(bucket, shard: str):
+        Bucket.objects.filter(id=bucket.id).update(shard=shard)
+        bucket.shard = shard
+        bucket_cache.invalidate(bucket.name)
+        set_table_shard_cache(bucket, shard=shard)
+
+    def sync_tables(self, tables):
+        for model, src, dst in tables:
+            start_time = time.time()
+            inserted, updated, deleted = self.sync_table(model=model, src=src, dst=dst)
+            self.stdout.write(f'Table {model._meta.db_table} synced from {src} to {dst}, inserted {inserted}, '
+                              f'updated {updated}, deleted {deleted}, in {time.time() - start_time:.1f}s.')
+
+    @staticmethod
+    def get_extra_columns(model, src: str, dst: str):
+        """
+        源表和目标表都有的、模型中没有定义的列，比如对象元数据表的mp_etag、mp_parts_count
+        """
+        if not issubclass(model, BucketFileBase):
+            return []
+
+        columns = []
+        for using in (src, dst):
+            connection = connections[using]
+            with connection.cursor() as cursor:
+                columns.append({c.name for c in connection.introspection.get_table_description(
+                    cursor, model._meta.db_table)})
+
+        return [c for c in EXTRA_OBJ_COLUMNS if c in columns[0] and c in columns[1]]
+
+    def sync_table(self, model, src: str, dst: str):
+        """
+        按id分批校对，使目标表和源表数据一致
+
+        :return: (inserted, updated, deleted)
+        """
+        fields = [f.attname for f in model._meta.concrete_fields]
+        extra_columns = self.get_extra_columns(model=model, src=src, dst=dst)
+        extra = {c: RawSQL(f'`{c}`', ()) for c in extra_columns}
+        inserted = updated = deleted = 0
+        last_id = 0
+        while True:
+            src_rows = list(model.objects.using(src).filter(id__gt=last_id).annotate(**extra).order_by('id').values_list(
+                *fields, *extra_columns)[0:self.batch_size])
+            dst_qs = model.objects.using(dst).filter(id__gt=last_id).annotate(**extra)
+            if not src_rows:
+                # 源表之后已没有数据
+                deleted += dst_qs.delete()[0]
+                break
+
+            upper_id = src_rows[-1][0]
+            dst_rows = {row[0]: row for row in dst_qs.filter(id__lte=upper_id).values_list(*fields, *extra_columns)}
+            to_insert = []
+            to_update = []
+            for row in src_rows:
+                dst_row = dst_rows.pop(row[0], None)
+                if dst_row is None:
+                    to_insert.append(row)
+                elif dst_row != row:
+                    to_update.append(row)
+
+            to_delete = list(dst_rows.keys())
+            try:
+                self.apply_batch(model, dst, extra_columns, to_insert, to_update, to_delete)
+            except IntegrityError:
+                # 目标表中还未校对的行和本批次的行唯一约束冲突，删除冲突行后重试
+                self.remove_unique_conflicts(model, dst, fields, to_insert + to_update)
+                self.apply_batch(model, dst, extra_columns, to_insert, to_update, to_delete)
+
+            inserted += len(to_insert)
+            updated += len(to_update)
+            deleted += len(to_delete)
+            last_id = upper_id
+            if self.sleep > 0:
+                time.sleep(self.sleep)
+
+        return inserted, updated, deleted
+
+    @staticmethod
+    def apply_batch(model, dst: str, extra_columns, to_insert, to_update, to_delete):
+        """
+        变更的行先删除再插入；不使用bulk_create、bulk_update，避免auto_now字段的值被修改
+
+        :param extra_columns: 行中模型字段之后的额外列名
+        """
+        to_delete = to_delete + [row[0] for row in to_update]
+        to_insert = to_insert + to_update
+        connection = connections[dst]
+        with transaction.atomic(using=dst):
+            if to_delete:
+                model.objects.using(dst).filter(id__in=to_delete).delete()
+
+            if to_insert:
+                concrete_fields = model._meta.concrete_fields
+                n = len(concrete_fields)
+                columns = [f.column for f in concrete_fields] + list(extra_columns)
+                columns = ', '.join(connection.ops.quote_name(c) for c in columns)
+                placeholders = ', '.join(['%s'] * (n + len(extra_columns)))
+                sql = f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) VALUES ({placeholders})'
+                params = [[f.get_db_prep_save(v, connection=connection) for f, v in zip(concrete_fields, row)] +
+                          list(row[n:]) for row in to_insert]
+                with connection.cursor() as cursor:
+                    cursor.executemany(sql, params)
+
+    @staticmethod
+    def remove_unique_conflicts(model, dst: str, fields, rows):
+        for unique_fields in model._meta.unique_together:
+            indexes = [fields.index(model._meta.get_field(name).attname) for name in unique_fields]
+            for row in rows:
+                lookup = {name: row[i] for name, i in zip(unique_fields, indexes)}
+                model.objects.using(dst).filter(Q(**lookup) & ~Q(id=row[0])).delete()
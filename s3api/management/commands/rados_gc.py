@@ -0,0 +1,135 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from s3api.managers import RadosGarbageManager
+from s3api.models import RadosGarbage
+from utils.oss import HarborObject
+from utils.oss.pyrados import HarborObjectStructure
+
+
+class Command(BaseCommand):
+    """
+    删除rados数据删除队列中到期的数据
+
+    按批次从队列取出到期的数据，展开为rados对象后aio批量删除，删除成功的出队，删除失败的推迟重试；
+    删除是幂等的，但同一个队列建议只运行一个GC进程
+    """
+
+    help = """** manage.py rados_gc **
+           ** manage.py rados_gc --batch-size 500 --rate 200 --once **
+        """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', default=500, dest='batch_size', type=int,
+            help='The number of queue items taken in one batch.',
+        )
+        parser.add_argument(
+            '--aio-batch', default=64, dest='aio_batch', type=int,
+            help='The number of rados objects removed concurrently by aio.',
+        )
+        parser.add_argument(
+            '--rate', default=200, dest='rate', type=float,
+            help='Max rados objects removed per second, 0 is unlimited.',
+        )
+        parser.add_argument(
+            '--idle-sleep', default=10, dest='idle_sleep', type=float,
+            help='Seconds to sleep when there is nothing to remove.',
+        )
+        parser.add_argument(
+            '--once', default=False, nargs='?', dest='once', type=bool, const=True,
+            help='Exit when there is nothing to remove, instead of waiting.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.aio_batch = options['aio_batch']
+        self.rate = options['rate']
+        idle_sleep = options['idle_sleep']
+        once = options['once']
+
+        if batch_size <= 0 or self.aio_batch <= 0:
+            raise CommandError("Invalid value of batch size.")
+
+        self.rados_apis = {}    # pool_name: RadosAPI()
+        removed_count = failed_count = 0
+        self.stdout.write(self.style.NOTICE('Rados GC started.'))
+        while True:
+            garbages = RadosGarbageManager.get_due_garbages(limit=batch_size)
+            if not garbages:
+                if once:
+                    break
+
+                time.sleep(idle_sleep)
+                continue
+
+            start_time = time.time()
+            removed, failed, rados_count = self.remove_garbages(garbages)
+            removed_count += removed
+            failed_count += failed
+            self.stdout.write(f'Removed {removed} items ({rados_count} rados objects), failed {failed}, '
+                              f'in {time.time() - start_time:.1f}s.')
+            self.throttle(start_time=start_time, rados_count=rados_count)
+
+        self.stdout.write(self.style.SUCCESS(f'Rados GC completed, removed {removed_count}, failed {failed_count}.'))
+
+    def throttle(self, start_time, rados_count: int):
+        if self.rate <= 0:
+            return
+
+        wait = rados_count / self.rate - (time.time() - start_time)
+        if wait > 0:
+            time.sleep(wait)
+
+    def get_rados_api(self, pool_name: str):
+        api = self.rados_apis.get(pool_name)
+        if api is None:
+            api = HarborObject(pool_name=pool_name, obj_id='').get_rados_api()
+            self.rados_apis[pool_name] = api
+
+        return api
+
+    def remove_garbages(self, garbages: list):
+        """
+        :return: (removed, failed, rados_count)
+        """
+        pools = {}
+        for g in garbages:
+            pools.setdefault(g.pool_name, []).append(g)
+
+        removed = []
+        failed = 0
+        rados_count = 0
+        for pool_name, items in pools.items():
+            rados_ids = {}      # garbage id: [rados object id, ]
+            for g in items:
+                if g.layout == RadosGarbage.LAYOUT_HARBOR_OBJECT:
+                    rados_ids[g.id] = HarborObjectStructure(obj_id=g.rados_key, obj_size=g.size).parts_id
+                else:
+                    rados_ids[g.id] = [g.rados_key]
+
+            all_ids = [i for ids in rados_ids.values() for i in ids]
+            rados_count += len(all_ids)
+            try:
+                errors = self.get_rados_api(pool_name).remove_objects(obj_ids=all_ids, batch_size=self.aio_batch)
+            except Exception as e:
+                self.rados_apis.pop(pool_name, None)
+                RadosGarbageManager.set_retry(items, error=str(e))
+                failed += len(items)
+                continue
+
+            retry = {}
+            for g in items:
+                err = next((errors[i] for i in rados_ids[g.id] if i in errors), None)
+                if err is None:
+                    removed.append(g)
+                else:
+                    retry.setdefault(err, []).append(g)
+
+            for err, gs in retry.items():
+                RadosGarbageManager.set_retry(gs, error=err)
+                failed += len(gs)
+
+        RadosGarbageManager.dequeue(removed)
+        return len(removed), failed, rados_count
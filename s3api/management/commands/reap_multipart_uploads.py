@@ -0,0 +1,335 @@
+import time
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, router
+from django.db.models import Q
+from django.utils import timezone
+
+from buckets.models import Bucket
+from s3api.models import MultipartUpload, build_part_rados_key
+from s3api.managers import ObjectPartManager
+from utils.oss.pyrados import HarborObjectStructure, ObjectPart
+
+
+class Command(BaseCommand):
+    """
+    清理过期的多部分上传
+
+    按(status, expire_time)索引分批查询过期的上传任务：
+    上传中的任务先设置为清理中并把expire_time设为认领时间(客户端不能再操作)，多线程aio批量删除part rados数据，
+    成功后批量删除part和上传任务记录，失败的恢复为上传中，下次重试；
+    清理中的任务认领超过reclaim_after秒(上次清理进程中途退出)，重新认领清理；
+    已完成的任务只删除任务记录(part属于对象)；所属桶已删除的任务直接删除记录；
+    组合中的任务不处理。按删除速率和rados删除延迟自动限速
+    """
+
+    help = """** manage.py reap_multipart_uploads **
+           ** manage.py reap_multipart_uploads --batch-size 200 --workers 4 --rate 200 --reclaim-after 3600 --once **
+        """
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', default=200, dest='batch_size', type=int,
+            help='The number of uploads handled in one batch.',
+        )
+        parser.add_argument(
+            '--workers', default=4, dest='workers', type=int,
+            help='The number of threads removing part rados data.',
+        )
+        parser.add_argument(
+            '--aio-batch', default=64, dest='aio_batch', type=int,
+            help='The number of rados objects removed concurrently by aio in one thread.',
+        )
+        parser.add_argument(
+            '--rate', default=200, dest='rate', type=float,
+            help='Max rados objects removed per second, 0 is unlimited.',
+        )
+        parser.add_argument(
+            '--max-latency', default=2, dest='max_latency', type=float,
+            help='Slow down when one aio batch takes more seconds than this, 0 is disabled.',
+        )
+        parser.add_argument(
+            '--idle-sleep', default=600, dest='idle_sleep', type=float,
+            help='Seconds to sleep when there is no expired upload.',
+        )
+        parser.add_argument(
+            '--reclaim-after', default=3600, dest='reclaim_after', type=float,
+            help='Reclaim the uploads claimed by a reaper more than these seconds ago, the reaper may have exited.',
+        )
+        parser.add_argument(
+            '--once', default=False, nargs='?', dest='once', type=bool, const=True,
+            help='Exit when there is no expired upload, instead of waiting.',
+        )
+        parser.add_argument(
+            '--add-index', default=False, nargs='?', dest='add_index', type=bool, const=True,
+            help='Add the index (status, expire_time) to table multipart_upload if it is not exists.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        workers = options['workers']
+        self.aio_batch = options['aio_batch']
+        self.rate = options['rate']
+        self.max_latency = options['max_latency']
+        idle_sleep = options['idle_sleep']
+        once = options['once']
+        self.reclaim_after = options['reclaim_after']
+
+        if batch_size <= 0 or self.aio_batch <= 0:
+            raise CommandError("Invalid value of batch size.")
+        if workers <= 0:
+            raise CommandError("Invalid value of workers.")
+        if self.reclaim_after <= 0:
+            raise CommandError("Invalid value of reclaim after.")
+
+        self.check_index(add=options['add_index'])
+        self.pause = 0      # 根据rados删除延迟自动增减的每批次后暂停时间
+        self.rados_api = None
+        self.stdout.write(self.style.NOTICE('Multipart upload reaper started.'))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            self.executor = executor
+            while True:
+                count = self.reap_expired(batch_size=batch_size)
+                if once:
+                    break
+
+                if count == 0:
+                    time.sleep(idle_sleep)
+
+        self.stdout.write(self.style.SUCCESS('Multipart upload reaper completed.'))
+
+    def check_index(self, add: bool):
+        index = next(i for i in MultipartUpload._meta.indexes if i.name == 'status_expire_time_idx')
+        connection = connections[router.db_for_write(MultipartUpload)]
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, MultipartUpload._meta.db_table)
+
+        if index.name in constraints:
+            return
+
+        if not add:
+            self.stdout.write(self.style.WARNING(
+                f'Index {index.name} is not exists, query expired uploads will scan the table, '
+                f'use option "--add-index" to add it.'))
+            return
+
+        with connection.schema_editor() as schema_editor:
+            schema_editor.add_index(MultipartUpload, index)
+
+        self.stdout.write(self.style.SUCCESS(f'Index {index.name} added.'))
+
+    def reap_expired(self, batch_size: int):
+        """
+        清理一遍当前已过期的上传任务
+
+        :return: 处理的上传任务数
+        """
+        now = timezone.now()
+        count = 0
+        passes = [
+            (MultipartUpload.STATUS_UPLOADING, now),
+            (MultipartUpload.STATUS_REAPING, now - timedelta(seconds=self.reclaim_after)),    # 认领后未清理完的
+            (MultipartUpload.STATUS_COMPLETED, now)
+        ]
+        for status, before in passes:
+            last = None
+            while True:
+                uploads = self.get_expired_uploads(status=status, now=before, last=last, limit=batch_size)
+                if not uploads:
+                    break
+
+                last = uploads[-1]
+                start_time = time.time()
+                if status == MultipartUpload.STATUS_COMPLETED:
+                    removed, failed, rados_count = self.delete_uploads(uploads, status=status), 0, 0
+                else:
+                    removed, failed, rados_count = self.reap_uploading(uploads, status=status, now=now)
+
+                count += len(uploads)
+                self.stdout.write(f'Reaped {removed} uploads ({rados_count} rados objects), failed {failed}, '
+                                  f'in {time.time() - start_time:.1f}s.')
+                self.throttle(start_time=start_time, rados_count=rados_count)
+
+        return count
+
+    @staticmethod
+    def get_expired_uploads(status: int, now, last, limit: int):
+        """
+        按(expire_time, id)顺序分页查询过期的上传任务
+
+        :param last: 上一页最后一个上传任务，None表示第一页
+        """
+        qs = MultipartUpload.objects.filter(status=status, expire_time__lte=now)
+        if last is not None:
+            qs = qs.filter(Q(expire_time__gt=last.expire_time) | Q(expire_time=last.expire_time, id__gt=last.id))
+
+        return list(qs.order_by('expire_time', 'id')[0:limit])
+
+    @staticmethod
+    def delete_uploads(uploads: list, status: int):
+        """
+        批量删除状态为status的上传任务记录
+
+        :return: 删除的记录数
+        """
+        if not uploads:
+            return 0
+
+        r = MultipartUpload.objects.filter(id__in=[u.id for u in uploads], status=status).delete()
+        return r[0]
+
+    def reap_uploading(self, uploads: list, status: int, now):
+        """
+        清理过期的上传中的任务，或认领后未清理完的清理中的任务
+
+        :param status: 上传任务的状态，上传中或清理中
+        :param now: 认领时间
+
+        :return: (removed, failed, rados_count)
+        """
+        buckets = {b.id: b for b in Bucket.objects.filter(id__in={u.bucket_id for u in uploads})}
+        orphans = []        # 所属桶已删除
+        bucket_uploads = {}     # bucket_id: [upload, ]
+        for u in uploads:
+            bucket = buckets.get(u.bucket_id)
+            if bucket is None or not u.belong_to_bucket(bucket):
+                orphans.append(u)
+            else:
+                bucket_uploads.setdefault(u.bucket_id, []).append(u)
+
+        removed = self.delete_uploads(orphans, status=status)
+        failed = rados_count = 0
+        for bucket_id, ups in bucket_uploads.items():
+            claimed = self.claim_uploads(ups, now=now)
+            if not claimed:
+                continue
+
+            try:
+                ok_ids, count = self.remove_uploads_parts(bucket=buckets[bucket_id], upload_ids=claimed)
+            except Exception as e:
+                self.stdout.write(self.style.ERROR(f'Failed to remove parts of bucket(id={bucket_id}), {str(e)}'))
+                ok_ids, count = [], 0
+
+            rados_count += count
+            failed_ids = list(set(claimed) - set(ok_ids))
+            if ok_ids:
+                MultipartUpload.objects.filter(id__in=ok_ids, status=MultipartUpload.STATUS_REAPING).delete()
+            if failed_ids:
+                MultipartUpload.objects.filter(id__in=failed_ids, status=MultipartUpload.STATUS_REAPING).update(
+                    status=MultipartUpload.STATUS_UPLOADING)
+
+            removed += len(ok_ids)
+            failed += len(failed_ids)
+
+        return removed, failed, rados_count
+
+    @staticmethod
+    def claim_uploads(uploads: list, now):
+        """
+        上传任务设置为清理中，expire_time设为认领时间，客户端不能再上传part、组合或终止；
+        只有状态和expire_time在查询后未被修改(客户端未重新创建上传、其他清理进程未认领)的任务才能设置成功
+
+        :param now: 认领时间
+        :return: 设置成功的上传任务id列表
+        """
+        claimed = []
+        for u in uploads:
+            r = MultipartUpload.objects.filter(id=u.id, status=u.status, expire_time=u.expire_time).update(
+                status=MultipartUpload.STATUS_REAPING, expire_time=now)
+            if r > 0:
+                claimed.append(u.id)
+
+        return claimed
+
+    def remove_uploads_parts(self, bucket, upload_ids: list):
+        """
+        删除一个桶的多个上传任务的part rados数据和元数据
+
+        :return: (ok_ids, rados_count)
+            ok_ids: list        # part全部删除成功的上传任务id
+            rados_count: int    # 删除的rados对象数
+        """
+        model = ObjectPartManager(bucket=bucket).get_parts_model_class()
+        parts = model.objects.filter(upload_id__in=upload_ids, obj_id=0).values_list(
+            'upload_id', 'part_num', 'size')
+        rados_ids = {}      # rados对象id: upload_id
+        for upload_id, part_num, size in parts:
+            key = build_part_rados_key(upload_id=upload_id, part_num=part_num)
+            for rados_id in HarborObjectStructure(obj_id=key, obj_size=size).parts_id:
+                rados_ids[rados_id] = upload_id
+
+        errors = self.remove_rados_objects(list(rados_ids.keys()))
+        failed_ids = {rados_ids[i] for i in errors}
+        ok_ids = [i for i in upload_ids if i not in failed_ids]
+        if ok_ids:
+            model.objects.filter(upload_id__in=ok_ids, obj_id=0).delete()
+
+        return ok_ids, len(rados_ids)
+
+    def get_rados_api(self):
+        if self.rados_api is None:
+            self.rados_api = ObjectPart(part_key='').get_rados_api()
+
+        return self.rados_api
+
+    def remove_rados_objects(self, rados_ids: list):
+        """
+        多线程删除rados对象，每个线程aio批量删除
+
+        :return: {rados_id: str}     # 删除失败的
+        """
+        if not rados_ids:
+            return {}
+
+        chunk_size = self.aio_batch * 4
+        chunks = [rados_ids[i:i + chunk_size] for i in range(0, len(rados_ids), chunk_size)]
+        errors = {}
+        elapsed = 0
+        rounds = 0
+        for chunk, result in zip(chunks, self.executor.map(self._remove_chunk, chunks)):
+            err, seconds = result
+            if isinstance(err, Exception):
+                self.rados_api = None
+                errors.update({i: str(err) for i in chunk})
+                continue
+
+            errors.update(err)
+            elapsed += seconds
+            rounds += (len(chunk) + self.aio_batch - 1) // self.aio_batch
+
+        if rounds > 0:
+            self.adjust_pause(latency=elapsed / rounds)
+
+        return errors
+
+    def _remove_chunk(self, rados_ids: list):
+        start = time.time()
+        try:
+            errors = self.get_rados_api().remove_objects(obj_ids=rados_ids, batch_size=self.aio_batch)
+        except Exception as e:
+            return e, 0
+
+        return errors, time.time() - start
+
+    def adjust_pause(self, latency: float):
+        """
+        rados删除延迟过大时，说明集群负载高，增加每批次后的暂停时间；延迟恢复后逐步减少
+        """
+        if self.max_latency <= 0:
+            return
+
+        if latency > self.max_latency:
+            self.pause = min(max(self.pause * 2, 1), 60)
+            self.stdout.write(self.style.WARNING(f'Rados remove latency {latency:.2f}s, pause {self.pause}s.'))
+        elif self.pause > 0:
+            self.pause = self.pause / 2 if self.pause >= 0.5 else 0
+
+    def throttle(self, start_time, rados_count: int):
+        wait = self.pause
+        if self.rate > 0:
+            wait = max(wait, rados_count / self.rate - (time.time() - start_time))
+
+        if wait > 0:
+            time.sleep(wait)
@@ -1,42 +1,36 @@
 import logging
 from datetime import timedelta
 
-from django.apps import apps
+from django.conf import settings
 from django.core.exceptions import MultipleObjectsReturned
+from django.db.models.expressions import RawSQL
 from django.utils import timezone
 
 from utils.md5 import get_str_hexMD5
-from s3api.models import ObjectPartBase, MultipartUpload
+from utils.model_factory import DynamicModelFactory
+from s3api.models import ObjectPartBase, MultipartUpload, RadosGarbage, BucketTableMigration
+from s3api.utils import (is_table_migration_completed, get_prefix_upper_bound, UPLOAD_SKEY_MAX_LENGTH)
 from . import exceptions
 
 
 logger = logging.getLogger('django.request')    # 这里的日志记录器要和setting中的loggers选项对应，不能随意给参
 
 
+# part表模型类工厂，最多缓存DYNAMIC_MODEL_CACHE_SIZE个表的模型类
+parts_model_factory = DynamicModelFactory(base_model=ObjectPartBase, name_prefix='PartsModel',
+                                          max_size=getattr(settings, 'DYNAMIC_MODEL_CACHE_SIZE', 1000))
+
+
 def get_parts_model_class(table_name):
     """
     动态创建存储桶对应的对象part模型类
 
-    RuntimeWarning: Model 'xxxxx_' was already registered. Reloading models is not advised as it can
-    lead to inconsistencies most notably with related models.
-    如上述警告所述, Django 不建议重复创建Model 的定义.可以直接通过get_obj_model_class创建，无视警告.
-    这里先通过 get_registered_model 获取已经注册的 Model, 如果获取不到， 再生成新的模型类.
+    模型类不注册到django全局app注册表，由parts_model_factory按LRU缓存，同一个表在缓存期间返回同一个模型类
 
     :param table_name: 数据库表名，模型类对应的数据库表名
     :return: Model class
     """
-    model_name = 'PartsModel' + table_name
-    app_leble = ObjectPartBase.Meta.app_label
-    try:
-        cls = apps.get_registered_model(app_label=app_leble, model_name=model_name)
-        return cls
-    except LookupError:
-        pass
-
-    meta = ObjectPartBase.Meta
-    meta.abstract = False
-    meta.db_table = table_name  # 数据库表名
-    return type(model_name, (ObjectPartBase,), {'Meta': meta, '__module__': ObjectPartBase.__module__})
+    return parts_model_factory.get_model_class(table_name)
 
 
 def create_multipart_upload_task(bucket, obj_key: str, obj_perms_code: int, obj_id: int = 0, expire_time=None):
@@ -150,24 +144,42 @@ class MultipartUploadManager:
         except Exception as e:
             raise exceptions.S3InternalError(extend_msg=str(e))
 
-    def list_multipart_uploads_queryset(self, bucket_name: str, prefix: str = None, delimiter: str = None):
+    def list_multipart_uploads_queryset(self, bucket, prefix: str = None, delimiter: str = None):
         """
-        查询多部分上传记录
+        查询一个桶的多部分上传记录，按(key, upload id)排序
 
-        :param bucket_name: 桶名
+        表已添加skey列时，通过索引(bucket_id, skey)按key排序和前缀范围查询，否则按obj_key排序；
+        同时按bucket_name过滤，表还没有(bucket_id, skey)索引时使用bucket_name_idx索引，不会全表扫描
+
+        :param bucket: 桶
         :param prefix: prefix of s3 object key
         :param delimiter: 暂时不支持
         :return:
-            Queryset()
+            Queryset()      # 有skey列时已annotate skey
 
         :raises: S3Error
         """
-        lookups = {}
-        if prefix:
-            lookups['obj_key__startswith'] = prefix
-
+        table_name = MultipartUpload._meta.db_table
         try:
-            return MultipartUpload.objects.filter(bucket_name=bucket_name, **lookups).order_by('-create_time').all()
+            qs = MultipartUpload.objects.filter(bucket_name=bucket.name, bucket_id=bucket.id)
+            if not is_table_migration_completed(table_name=table_name, name=BucketTableMigration.NAME_SKEY):
+                if prefix:
+                    qs = qs.filter(obj_key__startswith=prefix)
+
+                return qs.order_by('obj_key', 'id')
+
+            qs = qs.annotate(skey=RawSQL('`skey`', ())).order_by('skey', 'id')
+            if prefix:
+                skey_prefix = prefix[0:UPLOAD_SKEY_MAX_LENGTH]
+                qs = qs.filter(skey__gte=skey_prefix)
+                upper = get_prefix_upper_bound(skey_prefix)
+                if upper is not None:
+                    qs = qs.filter(skey__lt=upper)
+
+                if len(prefix) > UPLOAD_SKEY_MAX_LENGTH:
+                    qs = qs.filter(obj_key__startswith=prefix)
+
+            return qs
         except Exception as e:
             raise exceptions.S3InternalError(extend_msg=str(e))
 
@@ -191,6 +203,8 @@ class MultipartUploadManager:
                         upload.delete()
                     except Exception as e:
                         pass
+                elif upload.is_reaping():   # 过期正在清理的
+                    continue
                 else:
                     valid_uploads.append(upload)
         except Exception as e:
@@ -341,5 +355,151 @@ class ObjectPartManager:
 
         return True
 
+    def remove_objects_parts(self, obj_ids: list):
+        """
+        一次删除多个对象的part元数据
+        :param obj_ids: 对象id列表
+        :return:
+            True
+            False
+        """
+        if not obj_ids:
+            return True
+
+        model = self.get_parts_model_class()
+        try:
+            model.objects.filter(obj_id__in=obj_ids).delete()
+        except Exception as e:
+            return False
+
+        return True
+
+    @staticmethod
+    def save_parts_obj_info(parts, batch_size: int = 1000):
+        """
+        批量更新part元数据在对象中的偏移量、对象ETag、对象id和part总数
+
+        :param parts: part实例，同一个part表的
+        :param batch_size: 每条UPDATE语句更新的part数
+        :return:
+            True
+            False
+        """
+        parts = list(parts)
+        if not parts:
+            return True
+
+        model = type(parts[0])
+        try:
+            model.objects.bulk_update(parts, fields=['obj_offset', 'obj_etag', 'obj_id', 'parts_count'],
+                                      batch_size=batch_size)
+        except Exception as e:
+            return False
+
+        return True
+
+    @staticmethod
+    def remove_parts(parts, batch_size: int = 1000):
+        """
+        按id删除多个part元数据
+
+        :param parts: part实例，同一个part表的
+        :param batch_size: 每条DELETE语句删除的part数
+        :return:
+            True
+            False
+        """
+        ids = [p.id for p in parts]
+        if not ids:
+            return True
+
+        model = type(parts[0])
+        try:
+            for i in range(0, len(ids), batch_size):
+                model.objects.filter(id__in=ids[i:i + batch_size]).delete()
+        except Exception as e:
+            return False
+
+        return True
+
 
+class RadosGarbageManager:
+    """
+    待删除rados数据队列管理
+
+    入队的数据延迟settings.RADOS_GC_DELAY秒后才会被GC命令删除，正在进行的下载请求可以读完数据；
+    删除失败的按重试次数指数退避，最长间隔RADOS_GC_MAX_RETRY_INTERVAL秒
+    """
+    @staticmethod
+    def is_enabled():
+        return getattr(settings, 'RADOS_GC_ENABLED', False)
+
+    @staticmethod
+    def enqueue(items: list):
+        """
+        rados数据加入删除队列，必须在引用此rados数据的元数据删除或修改提交之后调用，不提供撤销入队
+
+        :param items: [(pool_name, rados_key, size), ]
+        :return:
+            [RadosGarbage()]    # success，批量入队时id可能未设置
+            None                # failed
+        """
+        if not items:
+            return []
+
+        next_time = timezone.now() + timedelta(seconds=getattr(settings, 'RADOS_GC_DELAY', 60))
+        garbages = [RadosGarbage(pool_name=pool_name, rados_key=rados_key, size=size or 0, next_time=next_time,
+                                 layout=RadosGarbage.LAYOUT_HARBOR_OBJECT)
+                    for pool_name, rados_key, size in items]
+        try:
+            if len(garbages) == 1:
+                garbages[0].save(force_insert=True)
+            else:
+                garbages = RadosGarbage.objects.bulk_create(garbages)
+        except Exception as e:
+            logger.error(f'Failed to enqueue rados garbage, {str(e)}')
+            return None
 
+        return garbages
+
+    @staticmethod
+    def dequeue(garbages: list):
+        """
+        从删除队列移除已删除的rados数据
+
+        :return:
+            True
+            False
+        """
+        ids = [g.id for g in garbages if g.id]
+        if not ids:
+            return True
+
+        try:
+            RadosGarbage.objects.filter(id__in=ids).delete()
+        except Exception as e:
+            logger.error(f'Failed to dequeue rados garbage {ids}, {str(e)}')
+            return False
+
+        return True
+
+    @staticmethod
+    def get_due_garbages(limit: int):
+        """
+        到期需要删除的rados数据
+        """
+        return list(RadosGarbage.objects.filter(next_time__lte=timezone.now()).order_by('next_time', 'id')[0:limit])
+
+    @staticmethod
+    def set_retry(garbages: list, error: str):
+        """
+        删除失败，推迟下次删除时间
+        """
+        max_interval = getattr(settings, 'RADOS_GC_MAX_RETRY_INTERVAL', 3600)
+        now = timezone.now()
+        for g in garbages:
+            g.retries += 1
+            g.next_time = now + timedelta(seconds=min(2 ** min(g.retries, 20), max_interval))
+            g.last_error = error[:255]
+            RadosGarbage.objects.filter(id=g.id).update(retries=g.retries, next_time=g.next_time,
+                                                        last_error=g.last_error)
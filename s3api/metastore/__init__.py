@@ -0,0 +1,25 @@
+"""
+存储桶对象和目录元数据存储
+
+目前只用于后端一致性测试和性能测试命令(manage.py metadata_store_benchmark)，服务的请求处理仍直接使用ORM模型；
+后端：
+    'orm'       # Django ORM，MySQL每个桶一个表，默认
+"""
+from .base import MetadataStore, MetadataStoreError, DuplicateKeyError, ObjectMeta
+
+
+BACKEND_ORM = 'orm'
+
+
+def get_metadata_store(table_name: str, backend: str = BACKEND_ORM):
+    """
+    :param table_name: 存储桶对象元数据表名
+    :param backend: 后端名称
+    :return: MetadataStore()
+    :raises: MetadataStoreError
+    """
+    if backend == BACKEND_ORM:
+        from .orm import ORMMetadataStore
+        return ORMMetadataStore(table_name=table_name)
+
+    raise MetadataStoreError(f'Invalid metadata store backend "{backend}".')
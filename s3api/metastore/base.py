@@ -0,0 +1,178 @@
+from collections import namedtuple
+
+from utils.md5 import EMPTY_HEX_MD5
+
+
+class MetadataStoreError(Exception):
+    pass
+
+
+class DuplicateKeyError(MetadataStoreError):
+    """
+    同一目录下已存在同名的对象或目录
+    """
+    pass
+
+
+# 元数据记录的字段，和BucketFileBase的列一致(na_md5由后端维护)
+META_FIELDS = ('id', 'na', 'name', 'fod', 'did', 'si', 'ult', 'upt', 'dlc', 'shp', 'stl', 'sst', 'set', 'sds',
+               'md5', 'share')
+# 创建和更新时可以设置的字段
+WRITABLE_FIELDS = frozenset(META_FIELDS) - {'id', 'name'}
+
+
+class ObjectMeta(namedtuple('ObjectMeta', META_FIELDS)):
+    """
+    非ORM后端返回的对象或目录元数据，属性和方法与对象模型实例一致
+    """
+    __slots__ = ()
+
+    def is_dir(self):
+        return not self.fod
+
+    def is_file(self):
+        return bool(self.fod)
+
+    @property
+    def obj_size(self):
+        return self.si
+
+    @property
+    def hex_md5(self):
+        if self.is_dir() or self.obj_size == 0:
+            return EMPTY_HEX_MD5
+
+        return self.md5
+
+
+def get_name_from_path(na: str):
+    """
+    全路径中的对象名或目录名
+    """
+    return na.rsplit('/', 1)[-1]
+
+
+class MetadataStore:
+    """
+    一个存储桶的对象和目录元数据存储接口
+
+    记录是对象模型实例或ObjectMeta()，都有META_FIELDS属性和is_dir()、is_file()方法；
+    列举按keyset分页，返回的最后一条记录的排序键作为下一页的游标
+    """
+    ROOT_DIR_ID = 0
+
+    def __init__(self, table_name: str):
+        """
+        :param table_name: 存储桶对象元数据表名
+        """
+        self.table_name = table_name
+
+    def create_table(self):
+        """
+        :return: True(success); False(failed)
+        """
+        raise NotImplementedError
+
+    def drop_table(self):
+        """
+        :return: True(success); False(failed)
+        """
+        raise NotImplementedError
+
+    def table_exists(self):
+        raise NotImplementedError
+
+    def get(self, path: str):
+        """
+        按全路径获取对象或目录
+
+        :return: record or None
+        """
+        raise NotImplementedError
+
+    def get_many(self, paths: list):
+        """
+        :return: {path: record}     # 不存在的路径不包含在内
+        """
+        raise NotImplementedError
+
+    def get_by_id(self, obj_id: int):
+        """
+        :return: record or None
+        """
+        raise NotImplementedError
+
+    def list_dir(self, dir_id: int, after_name: str = '', limit: int = 1000):
+        """
+        列举目录下的对象和子目录，按名称排序
+
+        :param dir_id: 目录id，根目录为ROOT_DIR_ID
+        :param after_name: 游标，上一页最后一条记录的name
+        :return: [record, ]
+        """
+        raise NotImplementedError
+
+    def list_prefix(self, prefix: str = '', after_key: str = '', limit: int = 1000):
+        """
+        列举全路径有前缀prefix的对象和目录，按全路径(二进制)排序
+
+        :param after_key: 游标，上一页最后一条记录的na
+        :return: [record, ]
+        """
+        raise NotImplementedError
+
+    def create(self, na: str, did: int, fod: bool = True, **fields):
+        """
+        创建对象或目录，名称由全路径得到
+
+        :param na: 全路径
+        :param did: 父目录id
+        :param fields: WRITABLE_FIELDS中的其他字段
+        :return: record
+        :raises: DuplicateKeyError, MetadataStoreError
+        """
+        raise NotImplementedError
+
+    def update(self, obj_id: int, **fields):
+        """
+        更新字段，更新na时名称随之更新
+
+        :return: 更新的记录数
+        :raises: DuplicateKeyError, MetadataStoreError
+        """
+        raise NotImplementedError
+
+    def delete(self, obj_id: int):
+        """
+        :return: True(已删除); False(不存在)
+        """
+        raise NotImplementedError
+
+    def bulk_create(self, items: list, batch_size: int = 1000):
+        """
+        批量创建
+
+        :param items: [{'na': str, 'did': int, 'fod': bool, ...}, ]
+        :return: 创建的记录数
+        :raises: DuplicateKeyError, MetadataStoreError
+        """
+        raise NotImplementedError
+
+    def bulk_delete(self, obj_ids: list, batch_size: int = 1000):
+        """
+        :return: 删除的记录数
+        """
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        :return:
+            {'count': 对象数, 'space': 对象总大小, 'dirs': 目录数}
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def check_fields(fields: dict):
+        invalid = set(fields) - WRITABLE_FIELDS
+        if invalid:
+            raise MetadataStoreError(f'Invalid fields {sorted(invalid)}.')
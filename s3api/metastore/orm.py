@@ -0,0 +1,122 @@
+from django.db import IntegrityError
+from django.db.models import Q, Sum, Count
+
+from buckets.models import get_str_hexMD5
+from s3api.utils import (BucketFileManagement, create_table_for_model_class, delete_table_for_model_class,
+                         is_model_table_exists, SKEY_MAX_LENGTH)
+from .base import MetadataStore, MetadataStoreError, DuplicateKeyError, get_name_from_path
+
+
+class ORMMetadataStore(MetadataStore):
+    """
+    Django ORM后端，每个桶一个对象元数据表(bucket_N)，数据库由db路由按桶所在分片决定；记录为对象模型实例
+    """
+    def __init__(self, table_name: str):
+        super().__init__(table_name=table_name)
+        self.bfm = BucketFileManagement(collection_name=table_name)
+        self.model = self.bfm.get_obj_model_class()
+
+    def create_table(self):
+        return create_table_for_model_class(self.model)
+
+    def drop_table(self):
+        return delete_table_for_model_class(self.model)
+
+    def table_exists(self):
+        return is_model_table_exists(self.model)
+
+    def get(self, path: str):
+        try:
+            return self.bfm.get_obj(path=path)
+        except Exception as e:
+            raise MetadataStoreError(str(e))
+
+    def get_many(self, paths: list):
+        try:
+            return self.bfm.get_objs_by_paths(paths=paths)
+        except Exception as e:
+            raise MetadataStoreError(str(e))
+
+    def get_by_id(self, obj_id: int):
+        return self.model.objects.filter(id=obj_id).first()
+
+    def list_dir(self, dir_id: int, after_name: str = '', limit: int = 1000):
+        qs = self.model.objects.filter(did=dir_id)
+        if after_name:
+            qs = qs.filter(name__gt=after_name)
+
+        return list(qs.order_by('name')[0:limit])
+
+    def list_prefix(self, prefix: str = '', after_key: str = '', limit: int = 1000):
+        if not self.bfm.has_sortable_key():
+            qs = self.model.objects.all()
+            if prefix:
+                qs = qs.filter(na__startswith=prefix)
+            if after_key:
+                qs = qs.filter(na__gt=after_key)
+
+            return list(qs.order_by('na', 'id')[0:limit])
+
+        qs = self.bfm.get_key_ordered_queryset(prefix=prefix)
+        if after_key:
+            if len(after_key) <= SKEY_MAX_LENGTH:
+                qs = qs.filter(skey__gt=after_key)
+            else:
+                skey = after_key[0:SKEY_MAX_LENGTH]
+                qs = qs.filter(Q(skey__gt=skey) | Q(skey=skey, na__gt=after_key))
+
+        return list(qs[0:limit])
+
+    def _build(self, na: str, did: int, fod: bool = True, **fields):
+        self.check_fields(fields)
+        return self.model(na=na, na_md5=get_str_hexMD5(na), name=get_name_from_path(na), did=did, fod=fod, **fields)
+
+    def create(self, na: str, did: int, fod: bool = True, **fields):
+        obj = self._build(na=na, did=did, fod=fod, **fields)
+        try:
+            obj.save(force_insert=True)
+        except IntegrityError as e:
+            raise DuplicateKeyError(str(e))
+        except Exception as e:
+            raise MetadataStoreError(str(e))
+
+        return obj
+
+    def update(self, obj_id: int, **fields):
+        self.check_fields(fields)
+        if 'na' in fields:
+            fields['na_md5'] = get_str_hexMD5(fields['na'])
+            fields['name'] = get_name_from_path(fields['na'])
+
+        try:
+            return self.model.objects.filter(id=obj_id).update(**fields)
+        except IntegrityError as e:
+            raise DuplicateKeyError(str(e))
+        except Exception as e:
+            raise MetadataStoreError(str(e))
+
+    def delete(self, obj_id: int):
+        return self.bulk_delete([obj_id]) > 0
+
+    def bulk_create(self, items: list, batch_size: int = 1000):
+        objs = [self._build(**item) for item in items]
+        try:
+            self.model.objects.bulk_create(objs, batch_size=batch_size)
+        except IntegrityError as e:
+            raise DuplicateKeyError(str(e))
+        except Exception as e:
+            raise MetadataStoreError(str(e))
+
+        return len(objs)
+
+    def bulk_delete(self, obj_ids: list, batch_size: int = 1000):
+        count = 0
+        for i in range(0, len(obj_ids), batch_size):
+            count += self.model.objects.filter(id__in=obj_ids[i:i + batch_size]).delete()[0]
+
+        return count
+
+    def stats(self):
+        files = self.model.objects.filter(fod=True).aggregate(space=Sum('si'), count=Count('id'))
+        dirs = self.model.objects.filter(fod=False).count()
+        return {'count': files['count'], 'space': files['space'] or 0, 'dirs': dirs}
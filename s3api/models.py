@@ -46,10 +46,12 @@ class MultipartUpload(models.Model):
     STATUS_UPLOADING = 1
     STATUS_COMPOSING = 2
     STATUS_COMPLETED = 3
+    STATUS_REAPING = 4      # 过期任务正在被reap_multipart_uploads命令清理，expire_time为认领时间
     STATUS_CHOICES = (
         (STATUS_UPLOADING, '上传中'),
         (STATUS_COMPOSING, '组合中'),
-        (STATUS_COMPLETED, '上传完成')
+        (STATUS_COMPLETED, '上传完成'),
+        (STATUS_REAPING, '清理中')
     )
 
     id = models.CharField(verbose_name='ID', primary_key=True, max_length=64, help_text='uuid1+uuid4')
@@ -68,7 +70,8 @@ class MultipartUpload(models.Model):
         db_table = 'multipart_upload'
         indexes = [
             models.Index(fields=('key_md5',), name='key_md5_idx'),
-            models.Index(fields=('bucket_name',), name='bucket_name_idx')
+            models.Index(fields=('bucket_name',), name='bucket_name_idx'),
+            models.Index(fields=('status', 'expire_time'), name='status_expire_time_idx')
         ]
         app_label = 'part_metadata'  # 用于db路由指定此模型对应的数据库
         verbose_name = '对象多部分上传'
@@ -158,6 +161,15 @@ class MultipartUpload(models.Model):
         """
         return self.status == self.STATUS_COMPLETED
 
+    def is_reaping(self):
+        """
+        是否是正在清理的过期上传任务
+        :return:
+            True        # 已过期正在清理，不允许任何操作
+            False
+        """
+        return self.status == self.STATUS_REAPING
+
     def set_composing(self):
         """
         设置为正在组合对象
@@ -236,6 +248,8 @@ class ObjectPartBase(models.Model):
     obj_etag = models.CharField(verbose_name='ETag', max_length=64, default='')
     parts_count = models.IntegerField(verbose_name='对象Part总数', default=0)
 
+    SHARDED_BY_BUCKET = True    # 按桶分片，db路由由表名查询桶所在的分片数据库
+
     class Meta:
         unique_together = ['upload_id', 'part_num']
         indexes = [models.Index(fields=('obj_id',), name='obj_id_idx')]
@@ -260,3 +274,124 @@ class ObjectPartBase(models.Model):
             return False
 
         return True
+
+
+class BucketTableMigration(models.Model):
+    """
+    存储桶对象元数据表(bucket_N)的数据迁移进度，每个表每项迁移一条记录，用于迁移命令的断点续传，
+    和查询时判断表的数据是否已迁移完成
+    """
+    NAME_NA_MD5 = 'na_md5'      # 回填na_md5
+    NAME_SKEY = 'skey'          # 添加可排序的对象key列skey和索引
+    NAME_MP_ETAG = 'mp_etag'    # 添加多部分对象ETag和part总数列mp_etag、mp_parts_count，并回填
+    NAME_PURGE = 'purge'        # 清理已删除归档的桶，last_id为已扫描的最大对象ID
+
+    id = models.BigAutoField(verbose_name='ID', primary_key=True)
+    table_name = models.CharField(verbose_name='表名', max_length=64)
+    name = models.CharField(verbose_name='迁移名称', max_length=64)
+    last_id = models.BigIntegerField(verbose_name='已完成的最大对象ID', default=0)
+    completed = models.BooleanField(verbose_name='是否完成', default=False)
+    modified_time = models.DateTimeField(verbose_name='修改时间', auto_now=True)
+
+    class Meta:
+        managed = False
+        db_table = 'bucket_table_migration'
+        unique_together = ('table_name', 'name')
+        app_label = 'metadata'  # 用于db路由指定此模型对应的数据库
+        verbose_name = '存储桶表数据迁移'
+        verbose_name_plural = verbose_name
+
+    def __repr__(self):
+        return f'BucketTableMigration(table_name={self.table_name}, name={self.name}, completed={self.completed})'
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class RadosGarbage(models.Model):
+    """
+    待删除的rados数据队列，对象删除和覆盖上传时元数据提交后入队，由GC命令异步删除rados数据
+    """
+    LAYOUT_HARBOR_OBJECT = 1    # HarborObject结构，按MAXSIZE_PER_RADOS_OBJ分为多个rados对象
+    LAYOUT_CHOICES = (
+        (LAYOUT_HARBOR_OBJECT, 'HarborObject'),
+    )
+
+    id = models.BigAutoField(verbose_name='ID', primary_key=True)
+    pool_name = models.CharField(verbose_name='pool name', max_length=128)
+    rados_key = models.CharField(verbose_name='rados key', max_length=255)
+    size = models.BigIntegerField(verbose_name='数据大小', default=0)
+    layout = models.SmallIntegerField(verbose_name='数据结构', choices=LAYOUT_CHOICES, default=LAYOUT_HARBOR_OBJECT)
+    create_time = models.DateTimeField(verbose_name='入队时间', auto_now_add=True)
+    next_time = models.DateTimeField(verbose_name='下次删除时间', db_index=True)
+    retries = models.IntegerField(verbose_name='重试次数', default=0)
+    last_error = models.CharField(verbose_name='最后错误', max_length=255, default='')
+
+    class Meta:
+        managed = False
+        db_table = 'rados_garbage'
+        app_label = 'metadata'  # 用于db路由指定此模型对应的数据库
+        verbose_name = 'rados数据删除队列'
+        verbose_name_plural = verbose_name
+
+    def __repr__(self):
+        return f'RadosGarbage(pool_name={self.pool_name}, rados_key={self.rados_key}, size={self.size})'
+
+    def __str__(self):
+        return self.__repr__()
+
+
+class DeletePrefixJob(models.Model):
+    """
+    服务端删除存储桶中指定前缀的所有对象和目录的任务，由删除前缀命令执行，客户端按任务id查询进度
+    """
+    STATUS_PENDING = 0
+    STATUS_RUNNING = 1
+    STATUS_COMPLETED = 2
+    STATUS_FAILED = 3
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_COMPLETED, 'Completed'),
+        (STATUS_FAILED, 'Failed')
+    )
+
+    id = models.CharField(verbose_name='ID', primary_key=True, max_length=32)
+    bucket_id = models.BigIntegerField(verbose_name='bucket id')
+    bucket_name = models.CharField(verbose_name='bucket name', max_length=63)
+    prefix = models.CharField(verbose_name='对象key前缀', max_length=1024)
+    user_id = models.BigIntegerField(verbose_name='用户id', default=0)
+    status = models.SmallIntegerField(verbose_name='状态', choices=STATUS_CHOICES, default=STATUS_PENDING)
+    rate = models.IntegerField(verbose_name='每秒最多删除数', default=0, help_text='0不限制')
+    deleted_objects = models.BigIntegerField(verbose_name='已删除对象数', default=0)
+    deleted_dirs = models.BigIntegerField(verbose_name='已删除目录数', default=0)
+    deleted_size = models.BigIntegerField(verbose_name='已删除对象总大小', default=0)
+    failed = models.BigIntegerField(verbose_name='删除失败数', default=0)
+    last_error = models.CharField(verbose_name='最后错误', max_length=255, default='')
+    create_time = models.DateTimeField(verbose_name='创建时间', auto_now_add=True)
+    start_time = models.DateTimeField(verbose_name='开始时间', null=True, default=None)
+    end_time = models.DateTimeField(verbose_name='结束时间', null=True, default=None)
+    modified_time = models.DateTimeField(verbose_name='进度更新时间', auto_now=True)
+
+    class Meta:
+        managed = False
+        db_table = 'delete_prefix_job'
+        indexes = [
+            models.Index(fields=('status', 'modified_time'), name='status_modified_time_idx'),
+            models.Index(fields=('bucket_id', 'status'), name='bucket_status_idx')
+        ]
+        app_label = 'metadata'  # 用于db路由指定此模型对应的数据库
+        verbose_name = '删除前缀任务'
+        verbose_name_plural = verbose_name
+
+    def __repr__(self):
+        return f'DeletePrefixJob(id={self.id}, bucket={self.bucket_name}, prefix={self.prefix})'
+
+    def save(self, *args, **kwargs):
+        if not self.id:
+            self.id = uuid.uuid4().hex
+
+        super().save(*args, **kwargs)
+
+    def is_finished(self):
+        return self.status in (self.STATUS_COMPLETED, self.STATUS_FAILED)
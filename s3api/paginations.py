@@ -1,14 +1,18 @@
+import base64
+import binascii
 from urllib import parse
 
+from django.db.models import Q
 from django.utils.encoding import force_str
 from django.utils.translation import gettext as _
-from rest_framework.pagination import CursorPagination, Cursor
+from rest_framework.pagination import CursorPagination, Cursor, _positive_int
 from rest_framework.exceptions import NotFound
 
 from .managers import MultipartUploadManager
 from .models import get_datetime_from_upload_id
 from . import exceptions
 from .harbor import HarborManager
+from .utils import SKEY_MAX_LENGTH, UPLOAD_SKEY_MAX_LENGTH
 
 
 def get_query_param(url, key):
@@ -25,6 +29,314 @@ def get_query_param(url, key):
     return query_dict.get(key, None)
 
 
+def encode_key_token(key: str):
+    """
+    对象key编码为分页token
+    """
+    return base64.urlsafe_b64encode(key.encode('utf-8')).decode('ascii')
+
+
+def decode_key_token(token: str):
+    """
+    分页token解码为对象key
+
+    :raises: ValueError
+    """
+    try:
+        return base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8')
+    except (binascii.Error, UnicodeError) as e:
+        raise ValueError(str(e))
+
+
+def get_obj_key(obj):
+    """
+    对象或目录在S3中的key，目录以'/'结尾
+    """
+    if obj.is_dir():
+        return obj.na + '/'
+    return obj.na
+
+
+def get_name_key(obj):
+    """
+    对象或目录在所在目录中的key，即名称，目录以'/'结尾
+    """
+    name = obj.na.rsplit('/', maxsplit=1)[-1]
+    if obj.is_dir():
+        return name + '/'
+    return name
+
+
+class ListObjectsKeyPaginationBase:
+    """
+    按对象key排序的keyset分页器基类
+
+    分页位置就是上一页最后一个对象的key，每一页都是一次索引范围扫描，没有offset，也不需要查询marker对应的对象；
+    递归列举按可排序的对象key列skey排序；
+    列举目录下的对象和子目录也按key(S3字节顺序)排序，目录的key是名称加'/'，通过索引(did, name)按名称分批读取后调整为key顺序
+    """
+    ORDER_BY_KEY = 'skey'
+    ORDER_BY_NAME = 'name'
+
+    page_size = 1000
+    max_page_size = 1000
+    page_size_query_param = 'max-keys'
+
+    def __init__(self, context, ordering=ORDER_BY_KEY):
+        """
+        :param context:
+            {
+                'bucket': bucket,
+                'bucket_name': bucket_name,
+                'prefix': 'a/b/'        # 按名称排序时，列举的目录的路径前缀，根目录为''
+            }
+        :param ordering: ORDER_BY_KEY or ORDER_BY_NAME
+        """
+        if 'bucket' not in context and 'bucket_name' not in context:
+            raise ValueError('Invalid param "context", one of "bucket" and "bucket_name" needs to be in it.')
+
+        self._context = context
+        self.ordering = ordering
+        self.has_next = False
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+
+        return self.page_size
+
+    def get_start_key(self, request):
+        """
+        分页的起始位置，列举此key之后的对象
+
+        :return:
+            str     # key
+            None    # 从头开始
+
+        :raises: S3Error
+        """
+        raise NotImplementedError('`get_start_key()` must be implemented.')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        start_key = self.get_start_key(request)
+        if start_key:
+            queryset = self.filter_after_key(queryset, start_key)
+
+        if queryset is None:
+            data = []
+        else:
+            if self.ordering == self.ORDER_BY_NAME:
+                data = self.list_dir_in_key_order(queryset, limit=self.page_size + 1)
+            else:
+                data = list(queryset.order_by('skey', 'id')[0:self.page_size + 1])
+
+        self.has_next = len(data) > self.page_size
+        self._data = data[0:self.page_size]
+        self.key_count = len(self._data)
+        return self._data
+
+    def filter_after_key(self, queryset, key: str):
+        """
+        过滤出key之后的对象
+
+        :return:
+            QuerySet()
+            None        # 没有key之后的对象
+        """
+        if self.ordering == self.ORDER_BY_NAME:
+            prefix = self._context.get('prefix', '')
+            if not key.startswith(prefix):
+                if key < prefix:
+                    return queryset
+
+                return None
+
+            name_key = key[len(prefix):]
+            if '/' in name_key:     # key在子目录中，跳过子目录
+                name_key = name_key.split('/', maxsplit=1)[0] + '/'
+
+            # 目录的key(名称加'/')大于name_key的条件：名称大于name_key，或名称等于name_key，
+            # 或名称是name_key的前缀并且name_key之后的字符小于'/'(比如目录"a"在"a-1"、"a.txt"之后)
+            dir_names = [name_key] + [name_key[0:i] for i in range(1, len(name_key)) if name_key[i] < '/']
+            return queryset.filter(Q(name__gt=name_key) | Q(fod=False, name__in=dir_names))
+
+        if len(key) <= SKEY_MAX_LENGTH:
+            return queryset.filter(skey__gt=key)
+
+        # skey被截断，截断部分相同的key再通过全路径比较
+        skey = key[0:SKEY_MAX_LENGTH]
+        return queryset.filter(Q(skey__gt=skey) | Q(skey=skey, na__gt=key.rstrip('/')))
+
+    @staticmethod
+    def list_dir_in_key_order(queryset, limit: int):
+        """
+        按key顺序列举目录下的对象和子目录
+
+        通过索引(did, name)按名称keyset分批读取；名称顺序和key顺序只在目录名称加'/'时不同，
+        未读取的对象名称都大于已读取的最大名称，key也都大于它，所以key不大于已读取最大名称的对象顺序已确定
+
+        :param queryset: 目录下对象的查询集，ObjectListRow或模型实例
+        :param limit: 最多返回数量
+        :return: list
+        """
+        result = []
+        pending = []    # 已读取，还不能确定顺序的
+        last_name = None
+        while len(result) < limit:
+            qs = queryset if last_name is None else queryset.filter(name__gt=last_name)
+            rows = list(qs.order_by('name')[0:limit])
+            exhausted = len(rows) < limit
+            if rows:
+                last_name = rows[-1].na.rsplit('/', maxsplit=1)[-1]
+
+            pending += rows
+            pending.sort(key=get_name_key)
+            i = 0
+            while i < len(pending) and (exhausted or get_name_key(pending[i]) <= last_name):
+                i += 1
+
+            result += pending[0:i]
+            pending = pending[i:]
+            if exhausted:
+                break
+
+        return result[0:limit]
+
+    @property
+    def page_data(self):
+        if hasattr(self, '_data'):
+            return self._data
+
+        raise AssertionError('You must call `.paginate_queryset()` before accessing `.data`.')
+
+    def get_last_key(self):
+        """
+        本页最后一个对象的key，有下一页时作为下一页的分页位置
+        """
+        if not self.has_next or not self.page_data:
+            return None
+
+        return get_obj_key(self.page_data[-1])
+
+    def get_objects_and_dirs(self):
+        if not hasattr(self, 'objects') or not hasattr(self, 'dirs'):
+            objects = []
+            dirs = []
+            for obj in self.page_data:
+                if obj.is_file():
+                    objects.append(obj)
+                else:
+                    dirs.append(obj)
+            self.objects = objects
+            self.dirs = dirs
+
+        return self.objects, self.dirs
+
+    def get_common_prefix(self, delimiter='/'):
+        if not delimiter:
+            delimiter = '/'
+
+        common_prefix = []
+        for d in self.dirs:
+            na = d.na
+            if not na.endswith(delimiter):
+                na = na + delimiter
+            common_prefix.append({"Prefix": na})
+
+        return common_prefix
+
+
+class ListObjectsV2KeyPagination(ListObjectsKeyPaginationBase):
+    """
+    ListObjectsV2按对象key排序的分页器，continuation-token是上一页最后一个对象key的编码
+    """
+    cursor_query_param = 'continuation-token'
+    start_after_query_param = 'start-after'  # used if no cursor_query_param
+
+    def get_start_key(self, request):
+        token = self.get_continuation_token(request)
+        if token:
+            try:
+                return decode_key_token(token)
+            except ValueError as e:
+                raise exceptions.S3InvalidArgument(message=_('无效的参数continuation-token'))
+
+        start_after = request.query_params.get(self.start_after_query_param, None)
+        if start_after:
+            return start_after
+
+        return None
+
+    def get_paginated_data(self, common_prefixes=False, delimiter='/'):
+        is_truncated = 'true' if self.has_next else 'false'
+        data = {
+            'IsTruncated': is_truncated,  # can not use True
+            'MaxKeys': self.page_size,
+            'KeyCount': self.key_count
+        }
+        c_token = self.get_continuation_token(request=self.request)
+        if c_token:
+            data['ContinuationToken'] = c_token
+
+        nc_token = self.get_next_continuation_token()
+        if nc_token:
+            data['NextContinuationToken'] = nc_token
+
+        if common_prefixes:
+            data['CommonPrefixes'] = self.get_common_prefix(delimiter)
+
+        return data
+
+    def get_continuation_token(self, request):
+        return request.query_params.get(self.cursor_query_param, None)
+
+    def get_next_continuation_token(self):
+        key = self.get_last_key()
+        if key is None:
+            return None
+
+        return encode_key_token(key)
+
+
+class ListObjectsV1KeyPagination(ListObjectsKeyPaginationBase):
+    """
+    ListObjects(v1)按对象key排序的分页器，marker就是对象key
+    """
+    cursor_query_param = 'marker'
+
+    def get_start_key(self, request):
+        marker = self.get_marker(request)
+        return marker if marker else None
+
+    def get_paginated_data(self, common_prefixes=False, delimiter=None):
+        is_truncated = 'true' if self.has_next else 'false'
+        data = {
+            'IsTruncated': is_truncated,  # can not use True
+            'MaxKeys': self.page_size,
+            'KeyCount': self.key_count
+        }
+        marker = self.get_marker(request=self.request)
+        data['Marker'] = marker if marker else ''
+
+        if delimiter:   # 请求有delimiter才有 NextMarker
+            next_marker = self.get_last_key()
+            if next_marker:
+                data['NextMarker'] = next_marker
+
+        if common_prefixes:
+            data['CommonPrefixes'] = self.get_common_prefix(delimiter)
+
+        return data
+
+    def get_marker(self, request):
+        return request.query_params.get(self.cursor_query_param, None)
+
+
 class ListObjectsV2CursorPagination(CursorPagination):
     """
     存储通文件对象分页器
@@ -165,7 +477,7 @@ class ListObjectsV2CursorPagination(CursorPagination):
         hm = HarborManager()
         bucket = self._context.get('bucket', None)
         if not bucket:
-            bucket_name = self._context('bucket_name')
+            bucket_name = self._context.get('bucket_name')
             bucket = hm.get_bucket(bucket_name=bucket_name)
 
         if not bucket:
@@ -397,13 +709,108 @@ class ListUploadsCursorPagination(CursorPagination):
         return Cursor(offset=0, reverse=False, position=position)
 
 
-class ListUploadsKeyPagination(ListUploadsCursorPagination):
+class ListUploadsKeyPagination:
     """
-    按Key排序
+    多部分上传按(key, upload id)排序的keyset分页器
+
+    有upload-id-marker时，列举key等于key-marker且upload id大于upload-id-marker的上传，和key大于key-marker的上传；
+    否则只列举key大于key-marker的上传；每一页都是一次索引范围扫描，不需要查询marker对应的上传记录
     """
-    ordering = 'obj_key'
+    page_size = 1000
+    max_page_size = 1000
+    page_size_query_param = 'max-uploads'
+    key_marker_query_param = 'key-marker'
+    upload_id_marker_query_param = 'upload-id-marker'
 
-    def decode_cursor(self, request):
+    def __init__(self, context):
+        """
+        :param context:
+            {
+                'bucket': bucket,
+                ...
+            }
+        """
+        if 'bucket' not in context:
+            raise ValueError('Invalid param "context", "bucket" needs to be in it.')
+
+        self._context = context
+        self.has_next = False
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(request.query_params[self.page_size_query_param], strict=True,
+                                 cutoff=self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+
+        return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        :param queryset: MultipartUploadManager.list_multipart_uploads_queryset()返回的已排序的QuerySet
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
         key_marker = self.get_key_marker(request)
-        position = key_marker if key_marker else None
-        return Cursor(offset=0, reverse=False, position=position)
+        if key_marker:
+            queryset = self.filter_after_marker(queryset, key=key_marker,
+                                                upload_id=self.get_upload_id_marker(request))
+
+        data = list(queryset[0:self.page_size + 1])
+        self.has_next = len(data) > self.page_size
+        self._data = data[0:self.page_size]
+        self.key_count = len(self._data)
+        return self._data
+
+    @staticmethod
+    def filter_after_marker(queryset, key: str, upload_id: str = ''):
+        """
+        过滤出(key, upload_id)之后的上传
+        """
+        if 'skey' not in queryset.query.annotations:
+            after = Q(obj_key__gt=key)
+            same = Q(obj_key=key)
+        elif len(key) <= UPLOAD_SKEY_MAX_LENGTH:
+            after = Q(skey__gt=key)
+            same = Q(skey=key)
+        else:
+            # skey被截断，截断部分相同的key再通过obj_key比较
+            skey = key[0:UPLOAD_SKEY_MAX_LENGTH]
+            after = Q(skey__gt=skey) | Q(skey=skey, obj_key__gt=key)
+            same = Q(skey=skey, obj_key=key)
+
+        if upload_id:
+            return queryset.filter(after | (same & Q(id__gt=upload_id)))
+
+        return queryset.filter(after)
+
+    @property
+    def page_data(self):
+        if hasattr(self, '_data'):
+            return self._data
+
+        raise AssertionError('You must call `.paginate_queryset()` before accessing `.data`.')
+
+    def get_paginated_data(self):
+        is_truncated = 'true' if self.has_next else 'false'
+        next_key_marker, next_upload_id_marker = self.get_next_key_marker_upload_id_marker()
+        return {'IsTruncated': is_truncated,
+                'MaxUploads': self.page_size,
+                'KeyCount': self.key_count,
+                'KeyMarker': self.get_key_marker(request=self.request),
+                'UploadIdMarker': self.get_upload_id_marker(request=self.request),
+                'NextKeyMarker': next_key_marker,
+                'NextUploadIdMarker': next_upload_id_marker}
+
+    def get_key_marker(self, request):
+        return request.query_params.get(self.key_marker_query_param, '')
+
+    def get_upload_id_marker(self, request):
+        return request.query_params.get(self.upload_id_marker_query_param, '')
+
+    def get_next_key_marker_upload_id_marker(self):
+        if self.key_count > 0:
+            up = self.page_data[-1]
+            return up.obj_key, up.id
+
+        return '', ''
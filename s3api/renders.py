@@ -1,4 +1,5 @@
 from io import StringIO
+from types import GeneratorType
 
 from django.utils.encoding import force_str
 from django.utils.xmlutils import SimplerXMLGenerator
@@ -6,6 +7,39 @@ from rest_framework.renderers import BaseRenderer
 from rest_framework_xml.renderers import XMLRenderer
 
 
+class XMLRows:
+    """
+    行数据为元组的列表，fields是元组中每个值对应的xml标签名；值是已格式化的字符串，或者是字典(子元素)，None不输出
+    """
+    def __init__(self, fields, rows):
+        self.fields = fields
+        self.rows = rows
+
+    def __iter__(self):
+        return iter(self.rows)
+
+
+def row_to_xml(xml, item_tag_name: str, fields, row):
+    xml.startElement(item_tag_name, {})
+    for name, value in zip(fields, row):
+        xml.startElement(name, {})
+        if isinstance(value, dict):
+            for k, v in value.items():
+                xml.startElement(k, {})
+                xml.characters(force_str(v))
+                xml.endElement(k)
+        elif value is not None:
+            xml.characters(value)
+        xml.endElement(name)
+    xml.endElement(item_tag_name)
+
+
+def rows_to_xml(xml, item_tag_name: str, rows: XMLRows):
+    fields = rows.fields
+    for row in rows:
+        row_to_xml(xml, item_tag_name, fields, row)
+
+
 class CusXMLRenderer(XMLRenderer):
     def __init__(self, root_tag_name: str = 'root', item_tag_name: str = "list-item"):
         self.root_tag_name = root_tag_name
@@ -27,7 +61,9 @@ class ListObjectsV2XMLRenderer(XMLRenderer):
 
         elif isinstance(data, dict):
             for key, value in data.items():
-                if key in ['Contents', 'CommonPrefixes']:
+                if isinstance(value, XMLRows):
+                    rows_to_xml(xml, key, value)
+                elif key in ['Contents', 'CommonPrefixes']:
                     self.cur_item_tag_name = key
                     self._to_xml(xml, value)
                     self.cur_item_tag_name = self.item_tag_name
@@ -132,7 +168,9 @@ class CommonXMLRenderer(BaseRenderer):
 
         elif isinstance(data, dict):
             for key, value in data.items():
-                if isinstance(value, (list, tuple)):
+                if isinstance(value, XMLRows):
+                    rows_to_xml(xml, key, value)
+                elif isinstance(value, (list, tuple)):
                     self.item_tag_name = key
                     self._to_xml(xml, value)
                 else:
@@ -151,3 +189,78 @@ class CommonXMLRenderer(BaseRenderer):
 class ListObjectsV1XMLRenderer(CommonXMLRenderer):
     def __init__(self):
         super().__init__(root_tag_name='ListBucketResult')
+
+
+class XMLStreamRenderer:
+    """
+    流式xml渲染器，列表项的渲染方式同CommonXMLRenderer；
+
+    列表项(XMLRows、list、生成器)逐项渲染，缓冲区数据达到chunk_size时输出一块，
+    不需要先把整个xml文档渲染成字符串
+    """
+    media_type = "application/xml"
+    charset = 'utf-8'
+    chunk_size = 32 * 1024
+
+    def __init__(self, root_tag_name: str, chunk_size: int = None):
+        self.root_tag_name = root_tag_name
+        if chunk_size:
+            self.chunk_size = chunk_size
+
+    def render(self, data: dict):
+        """
+        :param data: dict
+        :return: generator, 每次输出bytes
+        """
+        stream = StringIO()
+        xml = SimplerXMLGenerator(stream, self.charset)
+        xml.startDocument()
+        xml.startElement(self.root_tag_name, {})
+        for _ in self._iter_xml(xml, data):
+            if stream.tell() >= self.chunk_size:
+                yield self._pop_chunk(stream)
+
+        xml.endElement(self.root_tag_name)
+        xml.endDocument()
+        yield self._pop_chunk(stream)
+
+    def _pop_chunk(self, stream):
+        chunk = stream.getvalue()
+        stream.seek(0)
+        stream.truncate(0)
+        return chunk.encode(self.charset)
+
+    def _iter_xml(self, xml, data: dict):
+        """
+        每渲染完一个列表项yield一次
+        """
+        for key, value in data.items():
+            if isinstance(value, XMLRows):
+                fields = value.fields
+                for row in value:
+                    row_to_xml(xml, key, fields, row)
+                    yield
+            elif isinstance(value, (list, tuple, GeneratorType)):
+                for item in value:
+                    xml.startElement(key, {})
+                    self._to_xml(xml, item)
+                    xml.endElement(key)
+                    yield
+            else:
+                xml.startElement(key, {})
+                self._to_xml(xml, value)
+                xml.endElement(key)
+
+    def _to_xml(self, xml, data):
+        if isinstance(data, dict):
+            for key, value in data.items():
+                xml.startElement(key, {})
+                self._to_xml(xml, value)
+                xml.endElement(key)
+
+        elif data is None:
+            # Don't output any value
+            pass
+
+        else:
+            xml.characters(force_str(data))
@@ -1,6 +1,16 @@
+import re
+
+from django.conf import settings
 from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_vary_headers
+from django.utils.text import compress_sequence
 from rest_framework_xml.renderers import XMLRenderer
 
+from .renders import XMLStreamRenderer
+
+
+re_accepts_gzip = re.compile(r'\bgzip\b')
+
 
 class XMLResponse(HttpResponse):
     """
@@ -37,3 +47,33 @@ class IterResponse(StreamingHttpResponse):
     def __iter__(self):
         return self.iter_content
 
+
+
+class XMLStreamResponse(StreamingHttpResponse):
+    """
+    流式输出xml的响应，客户端请求头Accept-Encoding包含gzip时，gzip压缩输出
+    """
+    def __init__(self, data: dict, root_tag_name: str, request=None, **kwargs):
+        """
+        :param data: dict, 列表项可以是XMLRows、list、生成器
+        :param root_tag_name: xml根节点名称
+        :param request: 请求对象，用于判断客户端是否接受gzip压缩
+        """
+        kwargs.setdefault('content_type', 'application/xml')
+        content = XMLStreamRenderer(root_tag_name=root_tag_name).render(data)
+        use_gzip = self.accepts_gzip(request)
+        if use_gzip:
+            content = compress_sequence(content)
+
+        super().__init__(streaming_content=content, **kwargs)
+        if use_gzip:
+            self['Content-Encoding'] = 'gzip'
+
+        patch_vary_headers(self, ('Accept-Encoding',))
+
+    @staticmethod
+    def accepts_gzip(request):
+        if request is None or not getattr(settings, 'S3_XML_RESPONSE_GZIP', True):
+            return False
+
+        return bool(re_accepts_gzip.search(request.META.get('HTTP_ACCEPT_ENCODING', '')))
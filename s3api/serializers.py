@@ -1,7 +1,10 @@
+from django.utils import timezone
 from django.utils.timezone import utc
 from rest_framework import serializers
 
 from utils.time import GMT_FORMAT
+from utils.md5 import EMPTY_HEX_MD5
+from .renders import XMLRows
 
 
 def time_to_gmt(value):
@@ -94,6 +97,68 @@ class ObjectListV2WithOwnerSerializer(ObjectListWithOwnerSerializer):
     pass
 
 
+def format_utc_iso_time(value):
+    """
+    和serializers.DateTimeField(default_timezone=utc).to_representation()输出相同，不需要每次创建字段实例
+    """
+    if not value:
+        return None
+
+    if timezone.is_aware(value):
+        if value.tzinfo is not utc:
+            value = value.astimezone(utc)
+    else:
+        value = timezone.make_aware(value, utc)
+
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+class ObjectListRowsSerializer:
+    """
+    列举对象的快速序列化器，输入ObjectListRow()，输出元组行数据XMLRows，
+    输出内容和ObjectListSerializer、ObjectListWithOwnerSerializer相同
+    """
+    fields = ('Key', 'LastModified', 'ETag', 'Size', 'StorageClass')
+    owner_fields = fields + ('Owner',)
+
+    def __init__(self, rows, user=None, with_owner: bool = False):
+        """
+        :param rows: [ObjectListRow(),]
+        :param user: 对象所有者
+        :param with_owner: True(包含Owner)
+        """
+        self.rows = rows
+        self.with_owner = with_owner
+        self.owner = {'ID': user.id, "DisplayName": user.username} if user else {}
+
+    @property
+    def data(self):
+        """
+        行数据是生成器，渲染时逐行格式化
+        """
+        if self.with_owner:
+            return XMLRows(self.owner_fields, self._iter_rows())
+
+        return XMLRows(self.fields, self._iter_rows())
+
+    def _iter_rows(self):
+        fmt_time = format_utc_iso_time
+        empty_md5 = EMPTY_HEX_MD5
+        owner = (self.owner,) if self.with_owner else ()
+        for r in self.rows:
+            if r.fod:
+                key = r.na
+                etag = r.md5 if r.si else empty_md5
+            else:
+                key = r.na + '/'
+                etag = empty_md5
+
+            yield (key, fmt_time(r.upt if r.upt else r.ult), etag, str(r.si), 'STANDARD') + owner
+
+
 class ListMultipartUploadsSerializer(serializers.Serializer):
     """
     多部分上传列化器
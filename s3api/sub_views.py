@@ -2,6 +2,7 @@ import base64
 import re
 from collections import OrderedDict
 
+from django.conf import settings
 from django.utils.translation import gettext
 from django.http import FileResponse
 from django.utils.http import urlquote
@@ -12,6 +13,9 @@ from rest_framework.exceptions import UnsupportedMediaType
 from rest_framework.parsers import FileUploadParser
 
 from buckets.models import Bucket
+from buckets.counters import buffered_counters
+from buckets.shards import choose_shard_for_new_bucket, set_table_shard_cache
+from buckets.table_pool import claim_bucket_tables
 from utils.storagers import FileUploadToCephHandler, PartUploadToCephHandler
 from utils.md5 import EMPTY_BYTES_MD5, EMPTY_HEX_MD5, FileMD5Handler
 from utils.oss.pyrados import HarborObject, RadosError
@@ -21,7 +25,7 @@ from . import renders
 from .viewsets import CustomGenericViewSet
 from .validators import DNSStringValidator, bucket_limit_validator
 from .utils import (get_ceph_poolname_rand, BucketFileManagement, create_table_for_model_class,
-                    delete_table_for_model_class)
+                    delete_table_for_model_class, set_table_migration_completed, as_list_rows_queryset)
 from . import exceptions
 from .harbor import HarborManager
 from . import serializers
@@ -29,8 +33,9 @@ from . import paginations
 from .managers import (get_parts_model_class, MultipartUploadManager, ObjectPartManager)
 from .negotiation import CusContentNegotiation
 from . import parsers
-from .models import build_part_rados_key
+from .models import build_part_rados_key, BucketTableMigration, DeletePrefixJob
 from .handlers import MULTIPART_UPLOAD_MAX_SIZE
+from .responses import XMLStreamResponse
 from . import handlers
 
 
@@ -45,7 +50,12 @@ class BucketViewSet(CustomGenericViewSet):
         list objects (v1 && v2)
         get object metadata
         ListMultipartUploads
+        DeletePrefix job status
         """
+        delete_prefix = request.query_params.get('delete-prefix', None)
+        if delete_prefix is not None:
+            return self.get_delete_prefix_job(request)
+
         uploads = request.query_params.get('uploads', None)
         if uploads is not None:
             return self.list_multipart_uploads(request=request, args=args, kwargs=kwargs)
@@ -59,11 +69,16 @@ class BucketViewSet(CustomGenericViewSet):
     def create(self, request, *args, **kwargs):
         """
         DeleteObjects
+        DeletePrefix
         """
         delete = request.query_params.get('delete')
         if delete is not None:
             return self.delete_objects(request)
 
+        delete_prefix = request.query_params.get('delete-prefix')
+        if delete_prefix is not None:
+            return self.delete_prefix(request)
+
         return self.exception_response(request, exceptions.S3MethodNotAllowed())
 
     def update(self, request, *args, **kwargs):
@@ -189,13 +204,20 @@ class BucketViewSet(CustomGenericViewSet):
         user = request.user
         perms = acl_choices[acl]
         pool_name = get_ceph_poolname_rand()
-        bucket = Bucket(pool_name=pool_name, user=user, name=bucket_name, access_permission=perms, type=Bucket.TYPE_S3)
+        bucket = Bucket(pool_name=pool_name, user=user, name=bucket_name, access_permission=perms, type=Bucket.TYPE_S3,
+                        shard=choose_shard_for_new_bucket())
         try:
             bucket.save()
         except Exception as e:
             return self.exception_response(request, exceptions.S3InternalError(message=gettext('创建存储桶失败，存储桶元数据错误'), extend_msg=str(e)))
 
+        # 表池中预先创建的表已标记完成数据迁移
+        if claim_bucket_tables(bucket):
+            set_table_shard_cache(bucket, shard=bucket.shard)
+            return Response(status=status.HTTP_200_OK, headers={'Location': '/' + bucket_name})
+
         col_name = bucket.get_bucket_table_name()
+        set_table_shard_cache(bucket, shard=bucket.shard)     # 在桶所在分片创建表
         bfm = BucketFileManagement(collection_name=col_name)
         model_class = bfm.get_obj_model_class()
         if not create_table_for_model_class(model=model_class):
@@ -211,6 +233,12 @@ class BucketViewSet(CustomGenericViewSet):
             delete_table_for_model_class(model=model_class)
             return self.exception_response(request, exceptions.S3InternalError(message=gettext('创建存储桶失败，存储桶parts表错误')))
 
+        # 新表的记录都有na_md5，不需要回填
+        set_table_migration_completed(table_name=col_name, name=BucketTableMigration.NAME_NA_MD5)
+        # 新表创建时已添加skey列
+        set_table_migration_completed(table_name=col_name, name=BucketTableMigration.NAME_SKEY)
+        # 新表创建时已添加mp_etag列
+        set_table_migration_completed(table_name=col_name, name=BucketTableMigration.NAME_MP_ETAG)
         return Response(status=status.HTTP_200_OK, headers={'Location': '/' + bucket_name})
 
     def list_objects_v2(self, request, *args, **kwargs):
@@ -238,7 +266,8 @@ class BucketViewSet(CustomGenericViewSet):
         if obj is None:
             return self.list_objects_v2_no_match(request=request, prefix=prefix, delimiter=delimiter, bucket=bucket)
 
-        paginator = paginations.ListObjectsV2CursorPagination(context={'bucket': bucket})
+        paginator = paginations.ListObjectsV2KeyPagination(
+            context={'bucket': bucket, 'prefix': prefix}, ordering=paginations.ListObjectsV2KeyPagination.ORDER_BY_NAME)
         max_keys = paginator.get_page_size(request=request)
         ret_data = {
             'IsTruncated': 'false',     # can not use bool
@@ -253,20 +282,15 @@ class BucketViewSet(CustomGenericViewSet):
             if not obj.is_dir():
                 return self.list_objects_v2_no_match(request=request, prefix=prefix, delimiter=delimiter, bucket=bucket)
 
-            objs_qs = hm.list_dir_queryset(bucket=bucket, dir_obj=obj)
+            objs_qs = as_list_rows_queryset(hm.list_dir_queryset(bucket=bucket, dir_obj=obj))
             paginator.paginate_queryset(objs_qs, request=request)
             objs, _ = paginator.get_objects_and_dirs()
-
-            if fetch_owner == 'true':
-                serializer = serializers.ObjectListV2WithOwnerSerializer(objs, many=True, context={'user': request.user})
-            else:
-                serializer = serializers.ObjectListV2Serializer(objs, many=True)
+            serializer = serializers.ObjectListRowsSerializer(objs, user=request.user, with_owner=(fetch_owner == 'true'))
 
             data = paginator.get_paginated_data(common_prefixes=True, delimiter=delimiter)
             ret_data.update(data)
             ret_data['Contents'] = serializer.data
-            self.set_renderer(request, renders.ListObjectsV2XMLRenderer())
-            return Response(data=ret_data, status=status.HTTP_200_OK)
+            return XMLStreamResponse(data=ret_data, root_tag_name='ListBucketResult', request=request)
 
         # list object metadata
         if not obj.is_file():
@@ -295,21 +319,25 @@ class BucketViewSet(CustomGenericViewSet):
         except exceptions.S3Error as e:
             return self.exception_response(request, e)
 
-        paginator = paginations.ListObjectsV2CursorPagination(context={'bucket': bucket})
-        objs_dirs = paginator.paginate_queryset(objs_qs, request=request)
-        if fetch_owner == 'true':
-            serializer = serializers.ObjectListV2WithOwnerSerializer(objs_dirs, many=True, context={'user': request.user})
+        if BucketFileManagement(collection_name=bucket.get_bucket_table_name()).has_sortable_key():
+            paginator = paginations.ListObjectsV2KeyPagination(context={'bucket': bucket})
+            objs_dirs = paginator.paginate_queryset(as_list_rows_queryset(objs_qs), request=request)
+            serializer = serializers.ObjectListRowsSerializer(objs_dirs, user=request.user,
+                                                              with_owner=(fetch_owner == 'true'))
         else:
-            serializer = serializers.ObjectListV2Serializer(objs_dirs, many=True)
+            paginator = paginations.ListObjectsV2CursorPagination(context={'bucket': bucket})
+            objs_dirs = paginator.paginate_queryset(objs_qs, request=request)
+            if fetch_owner == 'true':
+                serializer = serializers.ObjectListV2WithOwnerSerializer(objs_dirs, many=True, context={'user': request.user})
+            else:
+                serializer = serializers.ObjectListV2Serializer(objs_dirs, many=True)
 
         data = paginator.get_paginated_data()
         data['Contents'] = serializer.data
         data['Name'] = bucket_name
         data['Prefix'] = prefix
         data['EncodingType'] = 'url'
-
-        self.set_renderer(request, renders.ListObjectsV2XMLRenderer())
-        return Response(data=data, status=status.HTTP_200_OK)
+        return XMLStreamResponse(data=data, root_tag_name='ListBucketResult', request=request)
 
     def list_objects_v2_no_match(self, request, prefix, delimiter, bucket=None):
         if bucket:
@@ -319,7 +347,7 @@ class BucketViewSet(CustomGenericViewSet):
             bucket_name = self.get_bucket_name(request)
             context = {'bucket_name': bucket_name}
 
-        paginator = paginations.ListObjectsV2CursorPagination(context=context)
+        paginator = paginations.ListObjectsV2KeyPagination(context=context)
         max_keys = paginator.get_page_size(request=request)
         ret_data = {
             'IsTruncated': 'false',     # can not use True
@@ -360,7 +388,7 @@ class BucketViewSet(CustomGenericViewSet):
             except ValueError:
                 return self.exception_response(request, exceptions.S3AccessDenied())
 
-        queryset = MultipartUploadManager().list_multipart_uploads_queryset(bucket_name=bucket_name, prefix=prefix)
+        queryset = MultipartUploadManager().list_multipart_uploads_queryset(bucket=bucket, prefix=prefix)
         paginator = paginations.ListUploadsKeyPagination(context={'bucket': bucket})
 
         ret_data = {
@@ -371,12 +399,11 @@ class BucketViewSet(CustomGenericViewSet):
             ret_data['EncodingType'] = encoding_type
 
         ups = paginator.paginate_queryset(queryset, request=request)
-        serializer = serializers.ListMultipartUploadsSerializer(ups, many=True, context={'user': request.user})
+        serializer = serializers.ListMultipartUploadsSerializer(context={'user': request.user})
         data = paginator.get_paginated_data()
         ret_data.update(data)
-        ret_data['Upload'] = serializer.data
-        self.set_renderer(request, renders.CommonXMLRenderer(root_tag_name='ListMultipartUploadsResult'))
-        return Response(data=ret_data, status=status.HTTP_200_OK)
+        ret_data['Upload'] = (serializer.to_representation(up) for up in ups)
+        return XMLStreamResponse(data=ret_data, root_tag_name='ListMultipartUploadsResult', request=request)
 
     def delete_objects(self, request):
         bucket_name = self.get_bucket_name(request)
@@ -419,8 +446,109 @@ class BucketViewSet(CustomGenericViewSet):
         else:
             data = {'Error': err_objs, 'Deleted': deleted_objs}
 
-        self.set_renderer(request, renders.CommonXMLRenderer(root_tag_name='DeleteResult'))
-        return Response(data=data, status=status.HTTP_200_OK)
+        return XMLStreamResponse(data=data, root_tag_name='DeleteResult', request=request)
+
+    @staticmethod
+    def get_user_own_bucket(request):
+        """
+        :raises: S3Error
+        """
+        bucket = Bucket.get_bucket_by_name(BucketViewSet.get_bucket_name(request))
+        if not bucket:
+            raise exceptions.S3NoSuchBucket()
+
+        if not bucket.check_user_own_bucket(request.user):
+            raise exceptions.S3AccessDenied()
+
+        return bucket
+
+    def delete_prefix(self, request):
+        """
+        服务端删除前缀下的所有对象和目录(扩展操作)，创建后台任务，返回任务id，通过GET /?delete-prefix&job-id=xxx查询进度
+
+        Params:
+            prefix: 对象key前缀，不能为空；以"/"结尾时包括此目录
+            max-rate: 每秒最多删除的对象和目录数
+        """
+        prefix = request.query_params.get('prefix', '')
+        if not prefix or len(prefix) > 1024:
+            return self.exception_response(request, exceptions.S3InvalidArgument(
+                'The value of param "prefix" is invalid, it must be non-empty and at most 1024 characters.'))
+
+        max_rate = getattr(settings, 'DELETE_PREFIX_MAX_RATE', 5000)
+        rate = request.query_params.get('max-rate', None)
+        if rate is None:
+            rate = getattr(settings, 'DELETE_PREFIX_DEFAULT_RATE', 1000)
+        else:
+            try:
+                rate = int(rate)
+                if rate <= 0:
+                    raise ValueError
+            except ValueError:
+                return self.exception_response(request, exceptions.S3InvalidArgument(
+                    'The value of param "max-rate" must be a positive integer.'))
+
+        rate = min(rate, max_rate) if max_rate > 0 else rate
+        try:
+            bucket = self.get_user_own_bucket(request)
+            # 同一前缀未结束的任务不重复创建
+            job = DeletePrefixJob.objects.filter(
+                bucket_id=bucket.id, prefix=prefix,
+                status__in=[DeletePrefixJob.STATUS_PENDING, DeletePrefixJob.STATUS_RUNNING]).first()
+            if job is None:
+                job = DeletePrefixJob(bucket_id=bucket.id, bucket_name=bucket.name, prefix=prefix,
+                                      user_id=request.user.id, rate=rate)
+                job.save(force_insert=True)
+        except exceptions.S3Error as e:
+            return self.exception_response(request, e)
+        except Exception as e:
+            return self.exception_response(request, exceptions.S3InternalError(extend_msg=str(e)))
+
+        self.set_renderer(request, renders.CusXMLRenderer(root_tag_name='DeletePrefixResult'))
+        return Response(data=self.get_delete_prefix_job_data(job), status=status.HTTP_200_OK)
+
+    def get_delete_prefix_job(self, request):
+        """
+        查询删除前缀任务的进度
+
+        Params:
+            job-id: 任务id
+        """
+        job_id = request.query_params.get('job-id', '')
+        if not job_id:
+            return self.exception_response(request, exceptions.S3InvalidArgument('Missing param "job-id".'))
+
+        try:
+            bucket = self.get_user_own_bucket(request)
+            job = DeletePrefixJob.objects.filter(id=job_id, bucket_id=bucket.id).first()
+        except exceptions.S3Error as e:
+            return self.exception_response(request, e)
+        except Exception as e:
+            return self.exception_response(request, exceptions.S3InternalError(extend_msg=str(e)))
+
+        if job is None:
+            return self.exception_response(request, exceptions.S3NoSuchJob())
+
+        self.set_renderer(request, renders.CusXMLRenderer(root_tag_name='DeletePrefixResult'))
+        return Response(data=self.get_delete_prefix_job_data(job), status=status.HTTP_200_OK)
+
+    @staticmethod
+    def get_delete_prefix_job_data(job):
+        return {
+            'JobId': job.id,
+            'Bucket': job.bucket_name,
+            'Prefix': job.prefix,
+            'Status': job.get_status_display(),
+            'MaxRate': job.rate,
+            'DeletedObjects': job.deleted_objects,
+            'DeletedDirs': job.deleted_dirs,
+            'DeletedSize': job.deleted_size,
+            'Failed': job.failed,
+            'Error': job.last_error,
+            'CreateTime': serializers.format_utc_iso_time(job.create_time),
+            'StartTime': serializers.format_utc_iso_time(job.start_time),
+            'EndTime': serializers.format_utc_iso_time(job.end_time)
+        }
 
 
 class ObjViewSet(CustomGenericViewSet):
@@ -667,13 +795,10 @@ class ObjViewSet(CustomGenericViewSet):
             obj.download_cound_increase()
 
         # multipart object check
-        parts_qs = ObjectPartManager(bucket=bucket).get_parts_queryset_by_obj_id(obj_id=obj.id)
-        part = parts_qs.first()
-        if part:        #
-            response['ETag'] = part.obj_etag
-            response['x-amz-mp-parts-count'] = part.parts_count
-        else:
-            response['ETag'] = obj.md5
+        etag, parts_count = self.get_object_etag_and_parts_count(bucket=bucket, obj=obj)
+        response['ETag'] = etag
+        if parts_count:
+            response['x-amz-mp-parts-count'] = parts_count
 
         last_modified = obj.upt if obj.upt else obj.ult
         filename = urlquote(filename)  # 中文文件名需要
@@ -844,7 +969,8 @@ class ObjViewSet(CustomGenericViewSet):
             except Exception:
                 pass
             if created:
-                obj.do_delete()
+                if obj.do_delete():
+                    buffered_counters.add_bucket_stats(bucket.id, count=-1)
 
         try:
             self.kwargs['filename'] = 'filename'
@@ -898,6 +1024,7 @@ class ObjViewSet(CustomGenericViewSet):
             clean_put(uploader, obj, created)
             return self.exception_response(request, exceptions.S3InternalError('更新对象元数据错误'))
 
+        buffered_counters.add_bucket_stats(bucket.id, size=obj_size)
         headers = {'ETag': obj_md5}
         x_amz_acl = request.headers.get('x-amz-acl', None)
         if x_amz_acl:
@@ -1156,7 +1283,7 @@ class ObjViewSet(CustomGenericViewSet):
         mu_mgr = MultipartUploadManager()
         upload = mu_mgr.get_multipart_upload_by_id(upload_id=upload_id)
 
-        if not upload:
+        if not upload or upload.is_reaping():     # 过期正在清理的
             raise exceptions.S3NoSuchUpload()
 
         if upload.obj_key != obj_path_name:
@@ -1322,14 +1449,34 @@ class ObjViewSet(CustomGenericViewSet):
         :raises: S3Error
         """
         # multipart object check
-        parts_qs = ObjectPartManager(bucket=bucket).get_parts_queryset_by_obj_id(obj_id=obj.id)
-        part = parts_qs.first()
-        headers = self.head_object_common_headers(obj=obj, part=part)
+        etag, parts_count = self.get_object_etag_and_parts_count(bucket=bucket, obj=obj)
+        headers = self.head_object_common_headers(obj=obj, etag=etag, parts_count=parts_count)
 
         return Response(status=status.HTTP_200_OK, headers=headers)
 
     @staticmethod
-    def head_object_common_headers(obj, part=None):
+    def get_object_etag_and_parts_count(bucket, obj):
+        """
+        对象的ETag和part总数；对象元数据表已有mp_etag列时直接从对象行获取，否则查询part表
+
+        :return:
+            (etag, parts_count)     # 非多部分对象parts_count为None
+        """
+        mp_etag = getattr(obj, 'mp_etag', None)
+        if mp_etag is not None:
+            if mp_etag:
+                return mp_etag, obj.mp_parts_count
+
+            return obj.md5, None
+
+        part = ObjectPartManager(bucket=bucket).get_parts_queryset_by_obj_id(obj_id=obj.id).first()
+        if part:
+            return part.obj_etag, part.parts_count
+
+        return obj.md5, None
+
+    @staticmethod
+    def head_object_common_headers(obj, etag: str = None, parts_count: int = None):
         last_modified = obj.upt if obj.upt else obj.ult
         headers = {
             'Content-Length': obj.si,
@@ -1338,11 +1485,9 @@ class ObjViewSet(CustomGenericViewSet):
             'Content-Type': 'binary/octet-stream'
         }
 
-        if part:
-            headers['ETag'] = part.obj_etag
-            headers['x-amz-mp-parts-count'] = part.parts_count
-        else:
-            headers['ETag'] = obj.md5
+        headers['ETag'] = etag if etag else obj.md5
+        if parts_count:
+            headers['x-amz-mp-parts-count'] = parts_count
 
         return headers
 
@@ -1365,13 +1510,10 @@ class ObjViewSet(CustomGenericViewSet):
             offset, end = self.get_object_offset_and_end(header_range, filesize=obj_size)
 
             # multipart object check
-            parts_qs = ObjectPartManager(bucket=bucket).get_parts_queryset_by_obj_id(obj_id=obj.id)
-            part = parts_qs.first()
-            if part:
-                response['ETag'] = part.obj_etag
-                response['x-amz-mp-parts-count'] = part.parts_count
-            else:
-                response['ETag'] = obj.md5
+            etag, parts_count = self.get_object_etag_and_parts_count(bucket=bucket, obj=obj)
+            response['ETag'] = etag
+            if parts_count:
+                response['x-amz-mp-parts-count'] = parts_count
         elif part_number:
             part = self.get_object_part(bucket=bucket, obj_id=obj.id, part_number=part_number)
             if not part:
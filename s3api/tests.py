@@ -0,0 +1,172 @@
+from datetime import timedelta
+
+from django.db import connections, router
+from django.test import SimpleTestCase
+from django.utils import timezone
+
+from s3api.metastore import get_metadata_store, DuplicateKeyError, MetadataStoreError
+from s3api.metastore.orm import ORMMetadataStore
+
+
+class MetadataStoreConformanceMixin:
+    """
+    元数据存储后端一致性测试，每个后端都需要通过
+    """
+    table_name = 'bucket_conformance'
+
+    def get_store(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        self.store = self.get_store()
+        self.assertTrue(self.store.create_table())
+        self.assertTrue(self.store.table_exists())
+
+    def tearDown(self):
+        self.assertTrue(self.store.drop_table())
+
+    def make_tree(self):
+        """
+        a/
+        a/b/
+        a/b/c.txt
+        a/d.txt
+        a/中文.txt
+        e.txt
+        """
+        s = self.store
+        a = s.create(na='a', did=s.ROOT_DIR_ID, fod=False)
+        b = s.create(na='a/b', did=a.id, fod=False)
+        s.create(na='a/b/c.txt', did=b.id, si=3, md5='c' * 32)
+        s.create(na='a/d.txt', did=a.id, si=4, md5='d' * 32)
+        s.create(na='a/中文.txt', did=a.id, si=5)
+        s.create(na='e.txt', did=s.ROOT_DIR_ID, si=6)
+        return a, b
+
+    def test_create_and_get(self):
+        now = timezone.now().replace(microsecond=0)
+        obj = self.store.create(na='x/y.txt', did=7, si=10, md5='a' * 32, ult=now, upt=now)
+        self.assertTrue(obj.id > 0)
+        self.assertEqual(obj.name, 'y.txt')
+
+        got = self.store.get('x/y.txt')
+        self.assertEqual(got.id, obj.id)
+        self.assertEqual((got.na, got.name, got.did, got.si, got.md5), ('x/y.txt', 'y.txt', 7, 10, 'a' * 32))
+        self.assertTrue(got.is_file())
+        self.assertFalse(got.is_dir())
+        self.assertIs(got.sds, False)
+        self.assertEqual(got.ult, now)
+        self.assertEqual(got.upt, now)
+        self.assertIsNone(got.sst)
+        self.assertIsNone(self.store.get('x/y'))
+        self.assertEqual(self.store.get_by_id(obj.id).na, 'x/y.txt')
+        self.assertIsNone(self.store.get_by_id(obj.id + 100))
+
+    def test_duplicate(self):
+        self.store.create(na='dup', did=0)
+        with self.assertRaises(DuplicateKeyError):
+            self.store.create(na='dup', did=0)
+
+        with self.assertRaises(MetadataStoreError):
+            self.store.create(na='bad', did=0, unknown=1)
+
+    def test_get_many(self):
+        self.make_tree()
+        objs = self.store.get_many(['a', 'a/d.txt', 'a/中文.txt', 'none'])
+        self.assertEqual(sorted(objs), ['a', 'a/d.txt', 'a/中文.txt'])
+        self.assertTrue(objs['a'].is_dir())
+        self.assertEqual(self.store.get_many([]), {})
+
+    def test_list_dir(self):
+        a, b = self.make_tree()
+        names = [o.name for o in self.store.list_dir(a.id)]
+        self.assertEqual(names, ['b', 'd.txt', '中文.txt'])
+        self.assertEqual([o.name for o in self.store.list_dir(self.store.ROOT_DIR_ID)], ['a', 'e.txt'])
+
+        page = self.store.list_dir(a.id, limit=2)
+        self.assertEqual([o.name for o in page], ['b', 'd.txt'])
+        page = self.store.list_dir(a.id, after_name=page[-1].name, limit=2)
+        self.assertEqual([o.name for o in page], ['中文.txt'])
+
+    def test_list_prefix(self):
+        self.make_tree()
+        keys = [o.na for o in self.store.list_prefix()]
+        self.assertEqual(keys, ['a', 'a/b', 'a/b/c.txt', 'a/d.txt', 'a/中文.txt', 'e.txt'])
+        self.assertEqual([o.na for o in self.store.list_prefix(prefix='a/')],
+                         ['a/b', 'a/b/c.txt', 'a/d.txt', 'a/中文.txt'])
+        self.assertEqual(self.store.list_prefix(prefix='zz'), [])
+
+        collected = []
+        after = ''
+        while True:
+            page = self.store.list_prefix(prefix='a', after_key=after, limit=2)
+            if not page:
+                break
+
+            collected += [o.na for o in page]
+            after = page[-1].na
+
+        self.assertEqual(collected, ['a', 'a/b', 'a/b/c.txt', 'a/d.txt', 'a/中文.txt'])
+
+    def test_update(self):
+        a, b = self.make_tree()
+        obj = self.store.get('a/d.txt')
+        later = timezone.now().replace(microsecond=0) + timedelta(days=1)
+        self.assertEqual(self.store.update(obj.id, si=100, upt=later, sds=True), 1)
+        got = self.store.get('a/d.txt')
+        self.assertEqual((got.si, got.upt, got.sds), (100, later, True))
+
+        self.assertEqual(self.store.update(obj.id, na='a/b/d2.txt', did=b.id), 1)
+        self.assertIsNone(self.store.get('a/d.txt'))
+        got = self.store.get('a/b/d2.txt')
+        self.assertEqual((got.id, got.name, got.did), (obj.id, 'd2.txt', b.id))
+
+        with self.assertRaises(DuplicateKeyError):
+            self.store.update(got.id, na='a/b/c.txt')
+
+        self.assertEqual(self.store.update(obj.id + 100, si=1), 0)
+
+    def test_delete(self):
+        self.make_tree()
+        obj = self.store.get('e.txt')
+        self.assertTrue(self.store.delete(obj.id))
+        self.assertFalse(self.store.delete(obj.id))
+        self.assertIsNone(self.store.get('e.txt'))
+
+    def test_bulk(self):
+        items = [{'na': f'bulk/{i:04}', 'did': 1, 'si': i} for i in range(1200)]
+        items.append({'na': 'bulk', 'did': 0, 'fod': False})
+        self.assertEqual(self.store.bulk_create(items, batch_size=500), 1201)
+        self.assertEqual(self.store.stats(), {'count': 1200, 'space': sum(range(1200)), 'dirs': 1})
+
+        with self.assertRaises(DuplicateKeyError):
+            self.store.bulk_create([{'na': 'bulk/0001', 'did': 1}])
+
+        ids = [o.id for o in self.store.list_prefix(prefix='bulk/', limit=1000)]
+        self.assertEqual(self.store.bulk_delete(ids, batch_size=300), 1000)
+        self.assertEqual(self.store.stats(), {'count': 200, 'space': sum(range(1000, 1200)), 'dirs': 1})
+        self.assertEqual(self.store.bulk_delete([]), 0)
+
+    def test_empty_stats(self):
+        self.assertEqual(self.store.stats(), {'count': 0, 'space': 0, 'dirs': 0})
+
+
+class ORMMetadataStoreTests(MetadataStoreConformanceMixin, SimpleTestCase):
+    databases = {'metadata'}
+
+    def get_store(self):
+        store = get_metadata_store(self.table_name, backend='orm')
+        self.assertIsInstance(store, ORMMetadataStore)
+        if connections[router.db_for_write(store.model)].vendor != 'mysql':
+            # 建表、删除表函数只支持MySQL
+            store.create_table = lambda: self._schema_edit(store.model, 'create_model')
+            store.drop_table = lambda: self._schema_edit(store.model, 'delete_model')
+
+        return store
+
+    @staticmethod
+    def _schema_edit(model, method: str):
+        with connections[router.db_for_write(model)].schema_editor() as schema_editor:
+            getattr(schema_editor, method)(model)
+
+        return True
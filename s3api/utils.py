@@ -1,17 +1,22 @@
 import random
 import logging
 import traceback
+from collections import namedtuple
 
 from django.db.backends.mysql.schema import DatabaseSchemaEditor
 from django.db import connections, router
 from django.db.models import Sum, Count
+from django.db.models.expressions import RawSQL
+from django.db.models.query import ValuesListIterable
 from django.db.models.query import Q
 from django.db.utils import ProgrammingError
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
-from django.apps import apps
 from django.conf import settings
 
 from buckets.models import BucketFileBase, get_str_hexMD5
+from utils.cache import TTLCache
+from utils.model_factory import DynamicModelFactory
+from .models import BucketTableMigration, MultipartUpload
 
 
 logger = logging.getLogger('django.request')
@@ -21,6 +26,10 @@ class InvalidPathError(Exception):
     pass
 
 
+SKEY_MAX_LENGTH = 1024      # 可排序的对象key列skey的最大长度(字符)
+UPLOAD_SKEY_MAX_LENGTH = 1020   # 多部分上传表可排序key列skey的最大长度(字符)，索引(bucket_id, skey)不超过3072字节
+
+
 
 def get_ceph_poolname_rand():
     """
@@ -43,27 +52,33 @@ def get_ceph_poolname_rand():
     raise ValueError('配置文件CEPH_RADOS中POOL_NAME配置项需要是一个元组tuple')
 
 
-def create_table_for_model_class(model):
+def create_table_for_model_class(model, using: str = None):
     """
     创建Model类对应的数据库表
 
     :param model: Model类
+    :param using: 数据库别名，默认由db路由决定
     :return:
             True: success
             False: failure
     """
     try:
-        using = router.db_for_write(model)
+        using = using if using else router.db_for_write(model)
         with DatabaseSchemaEditor(connection=connections[using]) as schema_editor:
             schema_editor.create_model(model)
-            try:
-                table_name = schema_editor.quote_name(model.Meta.db_table)
-                sql = f"ALTER TABLE {table_name} CHANGE COLUMN `na` `na` LONGTEXT NOT NULL COLLATE 'utf8_bin' AFTER " \
-                      f"`id`, CHANGE COLUMN `name` `name` VARCHAR(255) NOT NULL COLLATE 'utf8_bin' AFTER `na_md5`;"
-                schema_editor.execute(sql=sql)
-            except Exception as exc:
-                if delete_table_for_model_class(model):
-                    raise exc       # model table 删除成功，抛出错误
+            if issubclass(model, BucketFileBase):   # 只有对象元数据表有na和name列
+                try:
+                    table_name = schema_editor.quote_name(model._meta.db_table)
+                    sql = f"ALTER TABLE {table_name} CHANGE COLUMN `na` `na` LONGTEXT NOT NULL COLLATE 'utf8_bin' AFTER " \
+                          f"`id`, CHANGE COLUMN `name` `name` VARCHAR(255) NOT NULL COLLATE 'utf8_bin' AFTER `na_md5`;"
+                    schema_editor.execute(sql=sql)
+                    schema_editor.execute(sql=build_add_skey_sql(model._meta.db_table))
+                    schema_editor.execute(sql=build_add_mp_etag_sql(model._meta.db_table))
+                except Exception as exc:
+                    if delete_table_for_model_class(model, using=using):
+                        raise exc       # model table 删除成功，抛出错误
+            elif model is MultipartUpload:
+                schema_editor.execute(sql=build_add_upload_skey_sql(model._meta.db_table))
     except Exception as e:
         msg = traceback.format_exc()
         logger.error(msg)
@@ -72,17 +87,52 @@ def create_table_for_model_class(model):
     return True
 
 
-def delete_table_for_model_class(model):
+def build_add_skey_sql(table_name: str):
+    """
+    为对象元数据表添加可排序的对象key列skey和索引的sql
+
+    skey是由na生成的虚拟列，对象是na，目录是na + '/'，即S3中对象或目录的key，utf8_bin按字节排序和S3的key顺序一致；
+    不需要应用维护，na变更时(移动、重命名)数据库自动更新，超出SKEY_MAX_LENGTH的部分截断
+    """
+    return f"ALTER TABLE `{table_name}` ADD COLUMN `skey` VARCHAR({SKEY_MAX_LENGTH}) CHARACTER SET utf8 " \
+           f"COLLATE utf8_bin AS (LEFT(IF(`fod`, `na`, CONCAT(`na`, '/')), {SKEY_MAX_LENGTH})) VIRTUAL, " \
+           f"ADD INDEX `skey_idx` (`skey`);"
+
+
+def build_add_upload_skey_sql(table_name: str):
+    """
+    为多部分上传表添加可排序的对象key列skey和索引(bucket_id, skey)的sql
+
+    skey是由obj_key生成的虚拟列，utf8_bin按字节排序和S3的key顺序一致，超出UPLOAD_SKEY_MAX_LENGTH的部分截断；
+    InnoDB二级索引包含主键id，索引顺序即ListMultipartUploads的(key, upload id)顺序，列举一个桶只扫描这个桶的索引范围
+    """
+    return f"ALTER TABLE `{table_name}` ADD COLUMN `skey` VARCHAR({UPLOAD_SKEY_MAX_LENGTH}) CHARACTER SET utf8 " \
+           f"COLLATE utf8_bin AS (LEFT(`obj_key`, {UPLOAD_SKEY_MAX_LENGTH})) VIRTUAL, " \
+           f"ADD INDEX `bucket_skey_idx` (`bucket_id`, `skey`);"
+
+
+def build_add_mp_etag_sql(table_name: str):
+    """
+    为对象元数据表添加多部分对象ETag列mp_etag和part总数列mp_parts_count的sql
+
+    多部分上传完成时写入，覆盖上传时清空；非多部分对象mp_etag为空字符串，GET、HEAD不需要再查询part表
+    """
+    return f"ALTER TABLE `{table_name}` ADD COLUMN `mp_etag` VARCHAR(64) NOT NULL DEFAULT '', " \
+           f"ADD COLUMN `mp_parts_count` INT NOT NULL DEFAULT 0;"
+
+
+def delete_table_for_model_class(model, using: str = None):
     """
     删除Model类对应的数据库表
 
     :param model: Model类
+    :param using: 数据库别名，默认由db路由决定
     :return:
             True: success
             False: failure
     """
     try:
-        using = router.db_for_write(model)
+        using = using if using else router.db_for_write(model)
         with DatabaseSchemaEditor(connection=connections[using]) as schema_editor:
             schema_editor.delete_model(model)
     except (Exception, ProgrammingError) as e:
@@ -96,13 +146,14 @@ def delete_table_for_model_class(model):
     return True
 
 
-def is_model_table_exists(model):
+def is_model_table_exists(model, using: str = None):
     """
     检查模型类Model的数据库表是否已存在
     :param model:
+    :param using: 数据库别名，默认由db路由决定
     :return: True(existing); False(not existing)
     """
-    using = router.db_for_write(model)
+    using = using if using else router.db_for_write(model)
     connection = connections[using]
     if hasattr(model, '_meta'):
         db_table = model._meta.db_table
@@ -111,30 +162,157 @@ def is_model_table_exists(model):
     return db_table in connection.introspection.table_names()
 
 
+# 已完成的数据迁移(table_name, name)，完成后不会再变为未完成，进程内一直有效
+_completed_table_migrations = set()
+# 未完成的数据迁移(table_name, name)，缓存一段时间，避免每次都查询
+_uncompleted_table_migrations = TTLCache(timeout=getattr(settings, 'BUCKET_TABLE_MIGRATION_CHECK_INTERVAL', 60),
+                                         max_size=10000)
+
+
+def is_table_migration_completed(table_name: str, name: str):
+    """
+    存储桶对象元数据表的数据迁移是否已完成
+
+    :param table_name: 数据库表名
+    :param name: 迁移名称，比如BucketTableMigration.NAME_NA_MD5
+    :return:
+        True    # 已完成
+        False   # 未完成，或者无法确定
+    """
+    key = (table_name, name)
+    if key in _completed_table_migrations:
+        return True
+
+    if _uncompleted_table_migrations.get(key) is not None:
+        return False
+
+    try:
+        completed = BucketTableMigration.objects.filter(table_name=table_name, name=name, completed=True).exists()
+    except Exception as e:     # 迁移记录表可能不存在
+        completed = False
+
+    if completed:
+        _completed_table_migrations.add(key)
+    else:
+        _uncompleted_table_migrations.set(key, True)
+
+    return completed
+
+
+def set_table_migration_completed(table_name: str, name: str):
+    """
+    标记存储桶对象元数据表的数据迁移已完成，新建的表不需要迁移，可以直接标记完成
+
+    :return:
+        True    # success
+        False   # failed
+    """
+    try:
+        BucketTableMigration.objects.update_or_create(table_name=table_name, name=name,
+                                                      defaults={'completed': True})
+    except Exception as e:
+        logger.error(f'set table migration({table_name}, {name}) completed error, {str(e)}')
+        return False
+
+    key = (table_name, name)
+    _completed_table_migrations.add(key)
+    _uncompleted_table_migrations.invalidate(key)
+    return True
+
+
+# 目录id缓存，(桶的数据库表名, 目录全路径) -> 目录id；本进程删除目录时失效，
+# 其他进程可能已删除目录，创建对象使用缓存的目录id前需要按主键确认目录存在
+dir_id_cache = TTLCache(timeout=getattr(settings, 'DIR_ID_CACHE_TIMEOUT', 30),
+                        max_size=getattr(settings, 'DIR_ID_CACHE_MAX_SIZE', 100000))
+
+
+def get_prefix_upper_bound(prefix: str):
+    """
+    前缀范围查询的上界，所有以prefix开头的字符串s满足 prefix <= s < upper；
+    utf8_bin按UTF-8字节排序和字符码点顺序一致，MySQL utf8只能存储BMP字符
+
+    :return:
+        str
+        None    # 没有上界
+    """
+    chars = list(prefix)
+    while chars:
+        c = ord(chars[-1])
+        if c < 0xFFFF:
+            c = c + 1
+            if 0xD800 <= c <= 0xDFFF:     # 跳过代理码点
+                c = 0xE000
+            chars[-1] = chr(c)
+            return ''.join(chars)
+
+        chars.pop()
+
+    return None
+
+
+def ensure_table_for_model_class(model):
+    """
+    Model类对应的数据库表不存在时创建
+
+    :return:
+            True: success
+            False: failure
+    """
+    model._meta.managed = True
+    if is_model_table_exists(model):
+        return True
+
+    return create_table_for_model_class(model)
+
+
+# 对象元数据表模型类工厂，最多缓存DYNAMIC_MODEL_CACHE_SIZE个表的模型类
+obj_model_factory = DynamicModelFactory(base_model=BucketFileBase, name_prefix='ObjModel',
+                                        max_size=getattr(settings, 'DYNAMIC_MODEL_CACHE_SIZE', 1000))
+
+
 def get_obj_model_class(table_name):
     """
     动态创建存储桶对应的对象模型类
 
-    RuntimeWarning: Model 'xxxxx_' was already registered. Reloading models is not advised as it can
-    lead to inconsistencies most notably with related models.
-    如上述警告所述, Django 不建议重复创建Model 的定义.可以直接通过get_obj_model_class创建，无视警告.
-    这里先通过 get_registered_model 获取已经注册的 Model, 如果获取不到， 再生成新的模型类.
+    模型类不注册到django全局app注册表，由obj_model_factory按LRU缓存，同一个表在缓存期间返回同一个模型类
 
     :param table_name: 数据库表名，模型类对应的数据库表名
     :return: Model class
     """
-    model_name = 'ObjModel' + table_name
-    app_leble = BucketFileBase.Meta.app_label
-    try:
-        cls = apps.get_registered_model(app_label=app_leble, model_name=model_name)
-        return cls
-    except LookupError:
-        pass
+    return obj_model_factory.get_model_class(table_name)
+
+
+# 列举对象时只需要查询的列
+LIST_OBJECT_FIELDS = ('na', 'fod', 'si', 'upt', 'ult', 'md5')
+
+
+class ObjectListRow(namedtuple('ObjectListRow', LIST_OBJECT_FIELDS)):
+    """
+    列举对象的一行数据，只包含LIST_OBJECT_FIELDS列，代替完整的模型实例
+    """
+    __slots__ = ()
+
+    def is_dir(self):
+        return not self.fod
 
-    meta = BucketFileBase.Meta
-    meta.abstract = False
-    meta.db_table = table_name  # 数据库表名
-    return type(model_name, (BucketFileBase,), {'Meta': meta, '__module__': BucketFileBase.__module__})
+    def is_file(self):
+        return bool(self.fod)
+
+
+class ObjectListRowIterable(ValuesListIterable):
+    def __iter__(self):
+        make = ObjectListRow._make
+        for row in super().__iter__():
+            yield make(row)
+
+
+def as_list_rows_queryset(queryset):
+    """
+    对象查询集只查询列举对象需要的列，迭代返回ObjectListRow()
+    """
+    qs = queryset.values_list(*LIST_OBJECT_FIELDS)
+    qs._iterable_class = ObjectListRowIterable
+    return qs
 
 
 def get_bfmanager(path='', table_name=''):
@@ -407,8 +585,18 @@ class BucketFileManagement:
         """
         na_md5 = get_str_hexMD5(path)
         model_class = self.get_obj_model_class()
+        if is_table_migration_completed(self.get_collection_name(), BucketTableMigration.NAME_NA_MD5):
+            # 所有记录都已有na_md5，只走na_md5索引，na用于校验MD5碰撞
+            lookups = Q(na_md5=na_md5)
+        else:
+            lookups = Q(na_md5=na_md5) | Q(na_md5__isnull=True)
+
+        qs = model_class.objects.all()
+        if self.has_multipart_etag():
+            qs = qs.annotate(mp_etag=RawSQL('`mp_etag`', ()), mp_parts_count=RawSQL('`mp_parts_count`', ()))
+
         try:
-            obj = model_class.objects.get(Q(na_md5=na_md5) | Q(na_md5__isnull=True), na=path)
+            obj = qs.get(lookups, na=path)
         except model_class.DoesNotExist as e:
             return None
         except MultipleObjectsReturned as e:
@@ -422,6 +610,110 @@ class BucketFileManagement:
 
         return obj
 
+    def get_objs_by_paths(self, paths: list):
+        """
+        一次查询获取多个目录或对象
+
+        :param paths: 目录或对象路径列表
+        :return:
+            {path: obj}     # 不存在的路径不包含在内
+
+        :raises: Exception
+        """
+        if not paths:
+            return {}
+
+        md5_list = [get_str_hexMD5(p) for p in paths]
+        model_class = self.get_obj_model_class()
+        if is_table_migration_completed(self.get_collection_name(), BucketTableMigration.NAME_NA_MD5):
+            lookups = Q(na_md5__in=md5_list)
+        else:
+            lookups = Q(na_md5__in=md5_list) | Q(na_md5__isnull=True, na__in=paths)
+
+        path_set = set(paths)
+        objs = {}
+        try:
+            for obj in model_class.objects.filter(lookups).all():
+                if obj.na not in path_set:      # MD5碰撞
+                    continue
+
+                if obj.na in objs:
+                    raise MultipleObjectsReturned()
+
+                objs[obj.na] = obj
+        except MultipleObjectsReturned as e:
+            msg = f'数据库表{self.get_collection_name()}中存在多个相同的目录：{paths}'
+            logger.error(msg)
+            raise Exception(msg)
+        except Exception as e:
+            msg = f'select {self.get_collection_name()},paths={paths},err={str(e)}'
+            logger.error(msg)
+            raise Exception(msg)
+
+        return objs
+
+    def has_sortable_key(self):
+        """
+        数据库表是否已有可排序的对象key列skey
+        """
+        return is_table_migration_completed(self.get_collection_name(), BucketTableMigration.NAME_SKEY)
+
+    def has_multipart_etag(self):
+        """
+        数据库表是否已有多部分对象ETag列mp_etag，并且已完成回填
+        """
+        return is_table_migration_completed(self.get_collection_name(), BucketTableMigration.NAME_MP_ETAG)
+
+    def set_multipart_etag(self, obj_id: int, etag: str = '', parts_count: int = 0):
+        """
+        设置对象的多部分ETag和part总数，默认清空(非多部分对象)；表还没有mp_etag列时忽略
+
+        :return:
+            True    # 成功，或者表没有mp_etag列
+            False   # 错误
+        """
+        model_class = self.get_obj_model_class()
+        table_name = model_class._meta.db_table
+        connection = connections[router.db_for_write(model_class)]
+        sql = f'UPDATE `{table_name}` SET `mp_etag` = %s, `mp_parts_count` = %s WHERE `id` = %s'
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [etag, parts_count, obj_id])
+        except Exception as e:
+            # 只有表没有mp_etag列时可以忽略
+            try:
+                with connection.cursor() as cursor:
+                    columns = [c.name for c in connection.introspection.get_table_description(cursor, table_name)]
+            except Exception as exc:
+                return False
+
+            return 'mp_etag' not in columns
+
+        return True
+
+    def get_key_ordered_queryset(self, prefix: str = ''):
+        """
+        获得所有文件对象和目录记录，按对象key(skey)排序，需要表已有skey列
+
+        :param prefix: 对象key前缀，通过skey索引范围查询
+        :return: QuerySet()
+        """
+        model_class = self.get_obj_model_class()
+        qs = model_class.objects.annotate(skey=RawSQL('`skey`', ())).order_by('skey', 'id')
+        if not prefix:
+            return qs
+
+        skey_prefix = prefix[0:SKEY_MAX_LENGTH]
+        qs = qs.filter(skey__gte=skey_prefix)
+        upper = get_prefix_upper_bound(skey_prefix)
+        if upper is not None:
+            qs = qs.filter(skey__lt=upper)
+
+        if len(prefix) > SKEY_MAX_LENGTH:
+            qs = qs.filter(na__startswith=prefix)
+
+        return qs
+
     def get_objects_dirs_queryset(self):
         """
         获得所有文件对象和目录记录
@@ -438,6 +730,9 @@ class BucketFileManagement:
         :param prefix: 路径前缀
         :return: QuerySet()
         """
+        if self.has_sortable_key():
+            return self.get_key_ordered_queryset(prefix=prefix)
+
         model_class = self.get_obj_model_class()
         return model_class.objects.filter(na__startswith=prefix).all()
 
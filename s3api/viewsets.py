@@ -7,7 +7,12 @@ from rest_framework import status
 from rest_framework.views import set_rollback
 from rest_framework.response import Response
 from rest_framework.exceptions import (APIException, NotAuthenticated, AuthenticationFailed)
+from rest_framework.permissions import SAFE_METHODS
 
+from buckets.models import Bucket
+from buckets.counters import buffered_counters
+from utils.db_replicas import (has_replicas, enable_replica_reads, disable_replica_reads, mark_recent_write,
+                               is_sticky_to_primary)
 from . import exceptions
 from .renders import CusXMLRenderer
 
@@ -75,6 +80,96 @@ class CustomGenericViewSet(GenericViewSet):
             except:
                 pass
 
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            disable_replica_reads()
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        self.check_bucket_lock(request)
+        self.route_db_reads(request)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if has_replicas() and request.method not in SAFE_METHODS:
+            # 写请求完成后重新计时，之后一段时间内的请求读主库
+            mark_recent_write(bucket_name=self.get_bucket_name(request), access_key=self.get_access_key(request))
+
+        self.record_traffic(request, response)
+        return super().finalize_response(request, response, *args, **kwargs)
+
+    def record_traffic(self, request, response):
+        """
+        记录成功请求的存储桶流量，上传按请求体大小，下载按响应的Content-Length
+        """
+        if not (200 <= response.status_code < 300):
+            return
+
+        bytes_in = bytes_out = 0
+        try:
+            if request.method in ('PUT', 'POST'):
+                bytes_in = int(request.META.get('CONTENT_LENGTH') or 0)
+            elif request.method == 'GET' and response.has_header('Content-Length'):
+                bytes_out = int(response['Content-Length'])
+        except ValueError:
+            return
+
+        if not bytes_in and not bytes_out:
+            return
+
+        bucket_name = self.get_bucket_name(request)
+        if not bucket_name:
+            return
+
+        bucket = Bucket.get_bucket_by_name(bucket_name)
+        if bucket is None:
+            return
+
+        buffered_counters.add_traffic(bucket_id=bucket.id, user_id=request.user.id,
+                                      bytes_in=bytes_in, bytes_out=bytes_out)
+
+    def route_db_reads(self, request):
+        """
+        只读请求(GET、HEAD)的读查询使用数据库只读副本；刚写入过的存储桶或访问密钥的请求读主库，保证读到自己的写入
+        """
+        if not has_replicas():
+            return
+
+        bucket_name = self.get_bucket_name(request)
+        access_key = self.get_access_key(request)
+        if request.method not in SAFE_METHODS:
+            mark_recent_write(bucket_name=bucket_name, access_key=access_key)
+            return
+
+        if not is_sticky_to_primary(bucket_name=bucket_name, access_key=access_key):
+            enable_replica_reads()
+
+    @staticmethod
+    def get_access_key(request):
+        auth = getattr(request, 'auth', None)
+        return getattr(auth, 'id', '') if auth is not None else ''
+
+    def check_bucket_lock(self, request):
+        """
+        检查存储桶读写锁，锁定写时只允许读请求
+
+        :raises: S3BucketLockWrite, S3BucketLockReadWrite
+        """
+        bucket_name = self.get_bucket_name(request)
+        if not bucket_name:
+            return
+
+        bucket = Bucket.get_bucket_by_name(bucket_name)
+        if bucket is None or bucket.lock == Bucket.LOCK_READWRITE:
+            return
+
+        if bucket.lock == Bucket.LOCK_NO_READWRITE:
+            raise exceptions.S3BucketLockReadWrite()
+
+        if request.method not in SAFE_METHODS:
+            raise exceptions.S3BucketLockWrite()
+
     @staticmethod
     def get_bucket_name(request):
         """
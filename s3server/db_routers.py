@@ -1,6 +1,15 @@
+from django.db import DEFAULT_DB_ALIAS
+
+from buckets.shards import get_table_db_alias
+from utils.db_replicas import get_read_db_alias, has_replicas, is_replica_reads_enabled
+
+
 class MetadataRouter(object):
     """
     A router to control all database operations on models that app_label == 'metadata'
+
+    存储桶对象元数据表和part元数据表模型(SHARDED_BY_BUCKET)，由表名查询存储桶所在的分片数据库；
+    当前请求开启副本读时，读查询路由到主库的只读副本
     """
     METADATA = 'metadata'
     METADATA_DB = METADATA
@@ -8,27 +17,43 @@ class MetadataRouter(object):
     PART_METADATA = 'part_metadata'
     PART_METADATA_DB = PART_METADATA
 
+    def _db_for_model(self, model):
+        app_label = model._meta.app_label
+        if app_label == self.METADATA:
+            db_type = self.METADATA_DB
+        elif app_label == self.PART_METADATA:
+            db_type = self.PART_METADATA_DB
+        else:
+            return None
+
+        if getattr(model, 'SHARDED_BY_BUCKET', False):
+            return get_table_db_alias(table_name=model._meta.db_table, db_type=db_type)
+
+        return db_type
+
     def db_for_read(self, model, **hints):
         """
         Attempts to read metadata models go to metadata.
         """
-        if model._meta.app_label == 'metadata':
-            return 'metadata'
-        elif model._meta.app_label == self.PART_METADATA:
-            return self.PART_METADATA_DB
+        alias = self._db_for_model(model)
+        if alias is None:
+            if not is_replica_reads_enabled():
+                return None
 
-        return None
+            alias = DEFAULT_DB_ALIAS
+
+        return get_read_db_alias(alias)
 
     def db_for_write(self, model, **hints):
         """
         Attempts to write metadata models go to metadata.
         """
-        if model._meta.app_label == 'metadata':
-            return 'metadata'
-        elif model._meta.app_label == self.PART_METADATA:
-            return self.PART_METADATA_DB
+        alias = self._db_for_model(model)
+        if alias is None and has_replicas():
+            # 从副本读取的模型实例保存时，不能按实例所在数据库写入副本
+            return DEFAULT_DB_ALIAS
 
-        return None
+        return alias
 
     def allow_relation(self, obj1, obj2, **hints):
         """
@@ -199,6 +199,24 @@ LOGGING = {
             'maxBytes': 1024*1024*200,  # 200MB
             'backupCount': 10           # 最多10个文件
         },
+        # 工作进程启动预热日志
+        'warmup': {
+            'level': 'INFO',
+            'class': 'concurrent_log_handler.ConcurrentRotatingFileHandler',
+            'filename': os.path.join(LOGGING_FILES_DIR, 'iharbor-s3-warmup.log'),
+            'formatter': 'verbose',
+            'maxBytes': 1024*1024*50,   # 50MB
+            'backupCount': 2
+        },
+        # 进程内缓冲计数(buckets.counters)的统计，每个uwsgi进程定时输出一行
+        'counters': {
+            'level': 'INFO',
+            'class': 'concurrent_log_handler.ConcurrentRotatingFileHandler',
+            'filename': os.path.join(LOGGING_FILES_DIR, 'iharbor-s3-counters.log'),
+            'formatter': 'verbose',
+            'maxBytes': 1024*1024*50,   # 50MB
+            'backupCount': 2
+        },
     },
     'loggers': {
         'django': {
@@ -216,6 +234,16 @@ LOGGING = {
             'level': 'WARNING',
             'propagate': False,
         },
+        'warmup': {
+            'handlers': ['warmup', 'console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+        'counters': {
+            'handlers': ['counters', 'console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
         # 'django.db.backends': {
         #     'handlers': ['console'],
         #     'propagate': True,
@@ -233,11 +261,74 @@ CEPH_RADOS = {
     'POOL_NAME': ('xxx',),
     'MULTIPART_POOL_NAME': 'obs_test',
 }
+# 进程内共享一个已连接的ceph集群句柄，False时每个请求连接一次集群
+CEPH_RADOS_SHARED_CLUSTER = True
 
 DATABASE_ROUTERS = [
     's3server.db_routers.MetadataRouter',
 ]
 
+# 存储桶元数据表(bucket_N、parts_N)分片，分片名称: {'metadata': 数据库别名, 'part_metadata': 数据库别名}，
+# 分片数据库需要在DATABASES中配置；桶所在分片记录在Bucket.shard，空字符串表示默认的metadata、part_metadata数据库
+METADATA_SHARDS = {}
+# 新建存储桶随机放置的分片
+METADATA_SHARDS_FOR_NEW_BUCKET = ['']
+
+# 存储桶表池：创建存储桶时领取表池命令(manage.py bucket_table_pool)预先创建的空表，池中没有可领取的表时同步建表；
+# 开启前需要先执行表池命令创建表池记录表
+BUCKET_TABLE_POOL_ENABLED = False
+# 表池命令为每个分片预留的可领取表数(对象表和part表为一对)
+BUCKET_TABLE_POOL_SIZE = 20
+
+# 数据库只读副本，主库别名: [副本别名, ]，副本需要在DATABASES中配置；只读请求(GET、HEAD)的读查询使用副本
+DATABASE_READ_REPLICAS = {}
+# 副本复制延迟超过此值(秒)时不使用
+DATABASE_REPLICA_MAX_LAG = 5
+# 写入存储桶或使用访问密钥写入后，此时间(秒)内的请求只读主库
+DATABASE_REPLICA_STICKY_SECONDS = 10
+# 记录写入的缓存(CACHES别名)，所有uwsgi进程和服务节点必须共享(memcached)，配置了副本时不能使用本地内存缓存，否则启动时报错
+DATABASE_REPLICA_STICKY_CACHE = 'replica_sticky'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'replica_sticky': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',   # 需要安装python-memcached
+        'LOCATION': '127.0.0.1:11211',
+        'KEY_PREFIX': 's3server',
+    }
+}
+
+# 删除和覆盖对象时，旧rados数据加入删除队列由rados_gc命令异步删除，需要先用create_rados_garbage_table命令建表
+RADOS_GC_ENABLED = True
+# 入队的数据延迟删除时间(秒)，正在进行的下载可以读完数据
+RADOS_GC_DELAY = 60
+
+# 服务端删除前缀(POST /?delete-prefix)任务由delete_prefix_worker命令执行，需要先用create_delete_prefix_job_table命令建表；
+# 任务每秒最多删除的对象和目录数，请求参数max-rate可以指定，不超过最大值
+DELETE_PREFIX_DEFAULT_RATE = 1000
+DELETE_PREFIX_MAX_RATE = 5000
+DELETE_PREFIX_BATCH_SIZE = 1000
+
+# 对象下载次数、存储桶流量(表bucket_traffic，用create_bucket_traffic_table命令建表)和存储桶对象数量、总大小的进程内缓冲写入数据库间隔(秒)
+COUNTERS_FLUSH_INTERVAL = 5
+# 缓冲计数未写入数据库超过此时间(秒)输出警告日志
+COUNTERS_FLUSH_LAG_WARNING = 60
+# 每个进程每隔此时间(秒)把缓冲计数的统计(待写入数量、写入延迟和耗时、写入失败次数)输出到counters日志，0不输出
+COUNTERS_STATS_LOG_INTERVAL = 60
+
+# 每个进程最多缓存的存储桶对象元数据表、part表动态模型类数量(两种表分别计数)，超出时按LRU淘汰，每个模型类约40KB
+DYNAMIC_MODEL_CACHE_SIZE = 1000
+
+# uwsgi工作进程启动时预热(s3server/warmup.py)：连接ceph集群，加载流量最大的前N个桶和其用户访问密钥到缓存
+WORKER_WARMUP_ENABLED = True
+WORKER_WARMUP_TOP_N = 100
+
+# 对象写入生成器提交已写入大小的间隔(秒)，进程被终止时最多丢失此间隔内写入的大小记录，上传可以续传；
+# 0表示只在写入结束时提交，进程被终止时已写入的数据无法访问
+WRITE_GENERATOR_CHECKPOINT_INTERVAL = 5
+
 # django-hosts
 ROOT_HOSTCONF = 's3server.hosts'
 DEFAULT_HOST = 'default'
@@ -0,0 +1,165 @@
+"""
+工作进程启动预热
+
+uwsgi工作进程(lazy-apps或fork后)开始处理请求前，预先导入url配置、连接ceph集群(进程内共享)、
+创建热点存储桶的模型类和填充桶、访问密钥缓存，避免工作进程重启后最初的请求变慢；各阶段耗时输出到日志
+
+django数据库连接是线程级的，预热线程的连接不能被uwsgi的请求线程使用，所以不预先连接数据库，请求线程首次查询时连接
+"""
+import time
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+
+logger = logging.getLogger('warmup')
+
+WORKER_WARMUP_ENABLED = getattr(settings, 'WORKER_WARMUP_ENABLED', False)
+WORKER_WARMUP_TOP_N = getattr(settings, 'WORKER_WARMUP_TOP_N', 100)
+
+
+def warm_up_urls():
+    from django.urls import get_resolver
+    from django_hosts.resolvers import get_host_patterns
+
+    count = len(get_resolver().url_patterns)
+    for host in get_host_patterns():
+        count += len(get_resolver(host.urlconf).url_patterns)
+
+    return count
+
+
+def warm_up_rados():
+    """
+    连接ceph集群，检查所有配置的pool
+    """
+    from utils.oss import HarborObject
+
+    pools = list(settings.CEPH_RADOS.get('POOL_NAME', ()))
+    multipart_pool = settings.CEPH_RADOS.get('MULTIPART_POOL_NAME', '')
+    if multipart_pool:
+        pools.append(multipart_pool)
+
+    for pool_name in pools:
+        cluster = HarborObject(pool_name=pool_name, obj_id='').get_rados_api().get_cluster()
+        cluster.pool_exists(pool_name)
+
+    return len(pools)
+
+
+def get_hot_bucket_ids(top_n: int):
+    """
+    最近两天流量最大的桶，没有流量记录时为最近修改的桶
+    """
+    from buckets.models import Bucket, BucketTraffic
+
+    try:
+        since = timezone.localdate() - timedelta(days=1)
+        ids = list(BucketTraffic.objects.filter(date__gte=since).values('bucket_id').annotate(
+            total=Sum(F('bytes_in') + F('bytes_out'))).order_by('-total').values_list('bucket_id', flat=True)[0:top_n])
+    except Exception as e:
+        ids = []
+
+    if not ids:
+        ids = list(Bucket.objects.order_by('-modified_time').values_list('id', flat=True)[0:top_n])
+
+    return ids
+
+
+def warm_up_buckets(top_n: int):
+    """
+    热点桶填充桶缓存、表分片缓存，创建对象表和part表模型类
+
+    :return: buckets
+    """
+    from buckets.cache import bucket_cache
+    from buckets.models import Bucket
+    from buckets.shards import set_table_shard_cache
+    from s3api.managers import get_parts_model_class
+    from s3api.utils import get_obj_model_class
+
+    ids = get_hot_bucket_ids(top_n)
+    buckets = list(Bucket.objects.select_related('user').filter(id__in=ids)) if ids else []
+    for bucket in buckets:
+        get_obj_model_class(bucket.get_bucket_table_name())
+        get_parts_model_class(bucket.get_parts_table_name())
+        set_table_shard_cache(bucket, bucket.shard)
+        bucket_cache.set(bucket)
+
+    return buckets
+
+
+def warm_up_auth_keys(buckets: list, top_n: int):
+    """
+    热点桶所属用户的访问密钥填充密钥缓存
+    """
+    from users.cache import auth_key_cache
+    from users.models import AuthKey
+
+    user_ids = {b.user_id for b in buckets}
+    if not user_ids:
+        return 0
+
+    keys = list(AuthKey.objects.select_related('user').filter(user_id__in=user_ids, state=True)[0:top_n])
+    for key in keys:
+        auth_key_cache.set(key)
+
+    return len(keys)
+
+
+def run_stage(name: str, func, *args, **kwargs):
+    """
+    执行一个预热阶段，出错不影响工作进程启动
+
+    :return: (result, seconds)
+    """
+    start = time.time()
+    try:
+        result = func(*args, **kwargs)
+    except Exception as e:
+        logger.warning(f'worker warm-up stage {name} failed, {str(e)}')
+        result = None
+
+    return result, time.time() - start
+
+
+def warm_up(top_n: int = WORKER_WARMUP_TOP_N):
+    """
+    执行所有预热阶段
+
+    :return: {stage: seconds}
+    """
+    start = time.time()
+    timings = {}
+    _, timings['urls'] = run_stage('urls', warm_up_urls)
+    _, timings['rados'] = run_stage('rados', warm_up_rados)
+    buckets, timings['buckets'] = run_stage('buckets', warm_up_buckets, top_n=top_n)
+    keys, timings['auth_keys'] = run_stage('auth_keys', warm_up_auth_keys, buckets=buckets or [], top_n=top_n)
+    timings['total'] = time.time() - start
+
+    stages = ', '.join(f'{k}={v * 1000:.0f}ms' for k, v in timings.items())
+    logger.info(f'worker warm-up completed, buckets={len(buckets or [])}, auth_keys={keys or 0}, {stages}')
+    return timings
+
+
+def schedule_warm_up():
+    """
+    在uwsgi工作进程中预热：lazy-apps时应用在工作进程中加载，直接预热；
+    否则应用在master进程加载，注册到fork后执行，数据库连接和ceph集群句柄不能在fork前创建
+    """
+    if not WORKER_WARMUP_ENABLED:
+        return
+
+    try:
+        import uwsgi
+        from uwsgidecorators import postfork
+    except ImportError:
+        return      # 不在uwsgi中运行，比如manage.py命令
+
+    if uwsgi.opt.get('lazy-apps') in (b'true', b'1', 'true', '1', True):
+        warm_up()
+    else:
+        postfork(warm_up)
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 's3server.settings')
 
 application = get_wsgi_application()
+
+from utils.db_replicas import check_sticky_cache
+check_sticky_cache()
+
+from s3server.warmup import schedule_warm_up
+schedule_warm_up()
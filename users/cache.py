@@ -0,0 +1,75 @@
+from django.conf import settings
+
+from utils.cache import TTLCache, model_row_values, model_from_row_values
+
+
+AUTH_KEY_CACHE_TIMEOUT = getattr(settings, 'AUTH_KEY_CACHE_TIMEOUT', 30)                  # 秒
+AUTH_KEY_CACHE_MAX_SIZE = getattr(settings, 'AUTH_KEY_CACHE_MAX_SIZE', 10000)
+
+
+class AuthKeyCache:
+    """
+    访问密钥缓存，access_key -> 密钥的数据库行值(secret_key, user_id, state, permission等)，
+    user_id -> 用户的数据库行值
+
+    用户单独缓存，用户的修改(比如更新最后活跃日期)只需要按用户id失效；
+    密钥的停用、删除通过AuthKey.save()/delete()失效本进程缓存，其他进程或其他服务(密钥通常由
+    iharbor管理)的修改依赖较短的过期时间失效。不缓存不存在的密钥。
+    """
+    def __init__(self, timeout=AUTH_KEY_CACHE_TIMEOUT, max_size=AUTH_KEY_CACHE_MAX_SIZE):
+        self._keys = TTLCache(timeout=timeout, max_size=max_size)
+        self._users = TTLCache(timeout=timeout, max_size=max_size)
+
+    def get(self, access_key: str, loader):
+        """
+        获取访问密钥实例(已关联所属用户)，缓存未命中时通过loader从数据库加载
+
+        :param access_key: 访问密钥id
+        :param loader: callable(access_key) -> AuthKey() or None, 需要select_related('user')
+        :return:
+            AuthKey()
+            None        # 不存在
+        """
+        key_item = self._keys.get(access_key)
+        if key_item is not None:
+            key_model, using, key_values = key_item
+            auth_key = model_from_row_values(key_model, key_values, using=using)
+            user_item = self._users.get(auth_key.user_id)
+            if user_item is not None:
+                user_model, user_values = user_item
+                user = model_from_row_values(user_model, user_values, using=using)
+                key_model.user.field.set_cached_value(auth_key, user)
+                return auth_key
+
+        auth_key = loader(access_key)
+        if auth_key is not None:
+            self.set(auth_key)
+
+        return auth_key
+
+    def set(self, auth_key):
+        self._keys.set(auth_key.id, (type(auth_key), auth_key._state.db, model_row_values(auth_key)))
+        user = auth_key.user
+        self._users.set(user.id, (type(user), model_row_values(user)))
+
+    def invalidate_key(self, access_key: str):
+        self._keys.invalidate(access_key)
+
+    def invalidate_user(self, user_id: int):
+        self._users.invalidate(user_id)
+
+    def clear(self):
+        self._keys.clear()
+        self._users.clear()
+
+    def get_stats(self):
+        """
+        :return: dict
+        """
+        return {
+            'keys': self._keys.get_stats(),
+            'users': self._users.get_stats()
+        }
+
+
+auth_key_cache = AuthKeyCache()
@@ -6,6 +6,8 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.utils import timezone
 
+from .cache import auth_key_cache
+
 
 class UserProfile(AbstractUser):
     """
@@ -42,6 +44,16 @@ class UserProfile(AbstractUser):
         verbose_name = '用户'
         verbose_name_plural = '用户'
 
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        auth_key_cache.invalidate_user(self.id)
+
+    def delete(self, *args, **kwargs):
+        user_id = self.id
+        ret = super().delete(*args, **kwargs)
+        auth_key_cache.invalidate_user(user_id)
+        return ret
+
 
 class AuthKey(models.Model):
     STATUS_CHOICES = (
@@ -84,7 +96,15 @@ class AuthKey(models.Model):
 
         if not self.secret_key:
             self.secret_key = self.generate_key()
-        return super(AuthKey, self).save(*args, **kwargs)
+        ret = super(AuthKey, self).save(*args, **kwargs)
+        auth_key_cache.invalidate_key(self.id)
+        return ret
+
+    def delete(self, *args, **kwargs):
+        access_key = self.id
+        ret = super().delete(*args, **kwargs)
+        auth_key_cache.invalidate_key(access_key)
+        return ret
 
     def generate_key(self):
         """
@@ -0,0 +1,106 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+def model_row_values(instance):
+    """
+    模型实例所有字段的数据库值，顺序和_meta.concrete_fields一致
+    """
+    return tuple(getattr(instance, f.attname) for f in instance._meta.concrete_fields)
+
+
+def model_from_row_values(model, values, using=None):
+    """
+    由数据库值重建一个新的模型实例，每次返回新实例，调用者可以安全的修改
+    """
+    field_names = [f.attname for f in model._meta.concrete_fields]
+    return model.from_db(using, field_names, values)
+
+
+class TTLCache:
+    """
+    进程内线程安全的缓存，每项有过期时间(秒)，超出最大数量时按LRU淘汰
+
+    不同的工作进程之间不共享，数据变更时需要显式调用invalidate()，其他进程的缓存依赖过期时间失效
+    """
+    def __init__(self, timeout: float = 60, max_size: int = 10000):
+        """
+        :param timeout: 缓存项默认有效时间，秒；<=0时不缓存
+        :param max_size: 最多缓存项数量
+        """
+        self.timeout = timeout
+        self.max_size = max_size
+        self._data = OrderedDict()      # key: (expire_ts, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.invalidations = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        :return:
+            value       # 存在且未过期
+            default     # 不存在或已过期
+        """
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key, None)
+            if item is not None:
+                expire_ts, value = item
+                if expire_ts > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                del self._data[key]
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value, timeout: float = None):
+        timeout = self.timeout if timeout is None else timeout
+        if timeout <= 0:
+            return
+
+        expire_ts = time.monotonic() + timeout
+        with self._lock:
+            self._data[key] = (expire_ts, value)
+            self._data.move_to_end(key)
+            self.sets += 1
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._data.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get_stats(self):
+        """
+        缓存统计信息
+
+        :return: dict
+        """
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'timeout': self.timeout,
+            'hits': self.hits,
+            'misses': self.misses,
+            'sets': self.sets,
+            'invalidations': self.invalidations,
+            'evictions': self.evictions,
+            'hit_ratio': (self.hits / lookups) if lookups else 0.0
+        }
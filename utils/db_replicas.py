@@ -0,0 +1,196 @@
+"""
+数据库只读副本路由
+
+副本配置settings.DATABASE_READ_REPLICAS:
+    {
+        'default': ['default_replica1'],
+        'metadata': ['metadata_replica1', 'metadata_replica2'],
+        'part_metadata': ['part_metadata_replica1'],
+    }
+副本数据库需要在DATABASES中配置；只有当前线程开启了副本读(只读请求)时，db路由才会把读查询发给副本，
+复制延迟超过DATABASE_REPLICA_MAX_LAG秒的副本不使用；
+刚写入过的存储桶和访问密钥在DATABASE_REPLICA_STICKY_SECONDS秒内的请求只读主库，
+写入记录保存在django缓存settings.DATABASE_REPLICA_STICKY_CACHE中，必须是所有进程共享的缓存(如memcached)
+"""
+import logging
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+
+from .cache import TTLCache
+
+
+logger = logging.getLogger('django.request')
+
+_local = threading.local()
+
+# 副本复制延迟(秒)缓存，None表示延迟未知或复制已停止
+_replica_lag_cache = TTLCache(timeout=getattr(settings, 'DATABASE_REPLICA_LAG_CHECK_INTERVAL', 5), max_size=1000)
+
+
+def get_replicas(alias: str):
+    """
+    数据库的只读副本别名列表
+    """
+    return getattr(settings, 'DATABASE_READ_REPLICAS', {}).get(alias, [])
+
+
+def has_replicas():
+    return bool(getattr(settings, 'DATABASE_READ_REPLICAS', {}))
+
+
+def enable_replica_reads():
+    """
+    当前线程(请求)的读查询可以使用副本
+    """
+    _local.replica_reads = True
+
+
+def disable_replica_reads():
+    _local.replica_reads = False
+
+
+def is_replica_reads_enabled():
+    return getattr(_local, 'replica_reads', False)
+
+
+def get_replica_lag(alias: str):
+    """
+    副本复制延迟，只支持mysql，其他数据库认为没有延迟
+
+    :return:
+        int     # 秒
+        None    # 复制已停止或查询错误
+    """
+    connection = connections[alias]
+    if connection.vendor != 'mysql':
+        return 0
+
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW SLAVE STATUS')
+            row = cursor.fetchone()
+            if row is None:     # 不是副本
+                return 0
+
+            columns = [c[0] for c in cursor.description]
+            lag = row[columns.index('Seconds_Behind_Master')]
+    except Exception as e:
+        logger.error(f'Failed to check replication lag of database {alias}, {str(e)}')
+        return None
+
+    return lag
+
+
+def is_replica_available(alias: str):
+    """
+    副本复制延迟是否在允许范围内，检查结果缓存DATABASE_REPLICA_LAG_CHECK_INTERVAL秒
+    """
+    max_lag = getattr(settings, 'DATABASE_REPLICA_MAX_LAG', 5)
+    if max_lag is None:
+        return True
+
+    lag = _replica_lag_cache.get(alias, default=-1)
+    if lag == -1:
+        lag = get_replica_lag(alias)
+        _replica_lag_cache.set(alias, lag)
+
+    return lag is not None and lag <= max_lag
+
+
+def get_read_db_alias(alias: str):
+    """
+    读查询使用的数据库别名，当前线程开启副本读时随机选择一个可用副本，否则使用主库
+
+    :param alias: 主库别名
+    """
+    if not is_replica_reads_enabled():
+        return alias
+
+    replicas = [r for r in get_replicas(alias) if is_replica_available(r)]
+    if not replicas:
+        return alias
+
+    return random.choice(replicas)
+
+
+# 只在本进程内有效的缓存后端，不能用于记录写入
+_LOCAL_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def _get_sticky_cache_alias():
+    return getattr(settings, 'DATABASE_REPLICA_STICKY_CACHE', 'default')
+
+
+def _sticky_cache():
+    return caches[_get_sticky_cache_alias()]
+
+
+def check_sticky_cache():
+    """
+    配置了副本时，检查记录写入的缓存是否是多进程共享的；
+    多个uwsgi进程各自的本地内存缓存不能保证写入后的请求读主库(read-your-writes)
+
+    :raises: ImproperlyConfigured
+    """
+    if not has_replicas():
+        return
+
+    alias = _get_sticky_cache_alias()
+    cache_settings = getattr(settings, 'CACHES', {}).get(alias)
+    if cache_settings is None:
+        raise ImproperlyConfigured(f'The cache "{alias}" of DATABASE_REPLICA_STICKY_CACHE is not in CACHES.')
+
+    if cache_settings.get('BACKEND') in _LOCAL_CACHE_BACKENDS:
+        raise ImproperlyConfigured(
+            f'The cache "{alias}" of DATABASE_REPLICA_STICKY_CACHE must be shared by all processes '
+            f'(e.g. memcached) when DATABASE_READ_REPLICAS is configured, '
+            f'but its backend is {cache_settings.get("BACKEND")}.')
+
+
+def _sticky_keys(bucket_name: str, access_key: str):
+    keys = []
+    if bucket_name:
+        keys.append(f'replica_sticky:bucket:{bucket_name}')
+    if access_key:
+        keys.append(f'replica_sticky:key:{access_key}')
+
+    return keys
+
+
+def mark_recent_write(bucket_name: str = '', access_key: str = ''):
+    """
+    记录存储桶和访问密钥刚写入过，一段时间内的请求只读主库
+    """
+    keys = _sticky_keys(bucket_name, access_key)
+    if not keys:
+        return
+
+    timeout = getattr(settings, 'DATABASE_REPLICA_STICKY_SECONDS', 10)
+    try:
+        _sticky_cache().set_many({k: 1 for k in keys}, timeout=timeout)
+    except Exception as e:
+        logger.error(f'Failed to mark recent write for replica stickiness, {str(e)}')
+
+
+def is_sticky_to_primary(bucket_name: str = '', access_key: str = ''):
+    """
+    存储桶或访问密钥是否刚写入过，需要读主库
+
+    :return: True(读主库)
+    """
+    keys = _sticky_keys(bucket_name, access_key)
+    if not keys:
+        return False
+
+    try:
+        return bool(_sticky_cache().get_many(keys))
+    except Exception as e:
+        return True
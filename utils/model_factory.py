@@ -0,0 +1,148 @@
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from django.apps.registry import Apps
+
+
+logger = logging.getLogger('django')
+
+
+def approx_model_size(model):
+    """
+    估算一个动态模型类占用的内存(字节)，包括类、_meta和字段实例的属性，不包括共享的基类、函数等
+    """
+    seen = set()
+
+    def sizeof(obj, depth=0):
+        if id(obj) in seen:
+            return 0
+
+        seen.add(id(obj))
+        size = sys.getsizeof(obj)
+        if depth >= 3:
+            return size
+
+        if isinstance(obj, dict):
+            size += sum(sizeof(k, depth + 1) + sizeof(v, depth + 1) for k, v in obj.items())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            size += sum(sizeof(i, depth + 1) for i in obj)
+
+        return size
+
+    opts = model._meta
+    size = sizeof(model) + sizeof(model.__dict__) + sizeof(opts) + sizeof(opts.__dict__)
+    for field in opts.local_fields:
+        size += sizeof(field) + sizeof(field.__dict__)
+
+    return size
+
+
+class DynamicModelFactory:
+    """
+    按数据库表名动态创建模型类，用于每个存储桶一个表的对象元数据表和part表
+
+    每个表创建一个独立的Meta类，不修改基类的Meta；
+    模型类注册在工厂私有的app注册表中，不注册到django全局注册表，按LRU最多缓存max_size个，
+    淘汰的模型类从私有注册表移除，不再被引用后即可回收；线程安全
+    """
+    def __init__(self, base_model, name_prefix: str, max_size: int = 1000, stats_log_interval: float = 600):
+        """
+        :param base_model: 抽象基类模型
+        :param name_prefix: 模型类名前缀，类名为前缀+表名
+        :param max_size: 最多缓存的模型类数量
+        :param stats_log_interval: 有淘汰时输出统计日志的最小间隔(秒)，<=0不输出
+        """
+        self.base_model = base_model
+        self.name_prefix = name_prefix
+        self.max_size = max_size
+        self.stats_log_interval = stats_log_interval
+        self.app_label = base_model._meta.app_label
+        self._apps = Apps(installed_apps=())
+        self._models = OrderedDict()    # table_name: (model, size)
+        self._lock = threading.Lock()
+        self._last_log_time = time.monotonic()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_model_class(self, table_name: str):
+        """
+        :param table_name: 数据库表名
+        :return: Model class
+        """
+        with self._lock:
+            item = self._models.get(table_name)
+            if item is not None:
+                self._models.move_to_end(table_name)
+                self.hits += 1
+                return item[0]
+
+            self.misses += 1
+            model = self._create_model_class(table_name)
+            self._models[table_name] = (model, approx_model_size(model))
+            evicted = 0
+            while len(self._models) > self.max_size:
+                _, (old_model, _) = self._models.popitem(last=False)
+                self._apps.all_models[self.app_label].pop(old_model._meta.model_name, None)
+                evicted += 1
+
+            self.evictions += evicted
+
+        if evicted:
+            self.maybe_log_stats()
+
+        return model
+
+    def _create_model_class(self, table_name: str):
+        model_name = self.name_prefix + table_name
+        meta = type('Meta', (self.base_model.Meta,), {
+            'abstract': False,
+            'db_table': table_name,     # 数据库表名
+            'app_label': self.app_label,
+            'apps': self._apps
+        })
+        return type(model_name, (self.base_model,), {'Meta': meta, '__module__': self.base_model.__module__})
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self._apps.all_models[self.app_label].clear()
+
+    def __len__(self):
+        return len(self._models)
+
+    def get_stats(self):
+        """
+        缓存的模型类数量和估算的内存占用
+
+        :return: dict
+        """
+        with self._lock:
+            count = len(self._models)
+            memory = sum(size for _, size in self._models.values())
+
+        lookups = self.hits + self.misses
+        return {
+            'models': count,
+            'max_size': self.max_size,
+            'memory_bytes': memory,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': (self.hits / lookups) if lookups else 0.0
+        }
+
+    def maybe_log_stats(self):
+        interval = self.stats_log_interval
+        if interval <= 0:
+            return
+
+        now = time.monotonic()
+        if now - self._last_log_time < interval:
+            return
+
+        self._last_log_time = now
+        logger.info(f'{self.name_prefix} model factory stats: {self.get_stats()}')
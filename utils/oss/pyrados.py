@@ -1,7 +1,9 @@
 import os
 import math
+import errno
 import json
 import datetime
+import threading
 import pytz
 
 import rados
@@ -183,9 +185,18 @@ class CephClusterCommand(dict):
                 self.update(json.loads(buf))
 
 
+# 进程内共享的已连接集群句柄，(pid, cluster_name, user_name, conf_file, keyring_file): rados.Rados()；
+# 包含pid，fork后的子进程不会使用父进程的句柄
+_shared_clusters = {}
+_shared_clusters_lock = threading.Lock()
+
+
 class RadosAPI:
     '''
     ceph cluster rados对象接口封装
+
+    settings.CEPH_RADOS_SHARED_CLUSTER为True时，同一进程内的所有实例共享一个已连接的集群句柄(librados句柄是线程安全的)，
+    不再每个请求都连接一次集群
     '''
 
     def __init__(self, cluster_name, user_name, pool_name, conf_file, keyring_file='', *args, **kwargs):
@@ -202,6 +213,7 @@ class RadosAPI:
         if keyring_file and not os.path.exists(keyring_file):
             raise RadosError("参数有误，keyring配置文件路径不存在")
         self._keyring_file = keyring_file
+        self._shared = getattr(settings, 'CEPH_RADOS_SHARED_CLUSTER', False)
 
     def __enter__(self):
         self.get_cluster()
@@ -226,30 +238,55 @@ class RadosAPI:
             if self._cluster.state.lower() == 'connected':
                 return self._cluster
             else:
-                self._cluster.shutdown()
-                self._cluster = None
-
-        if not self._cluster:
-            conf = {'client_mount_timeout': '15', 'rados_mon_op_timeout': '15', 'rados_osd_op_timeout': '15'}
-            if self._keyring_file:
-                conf['keyring'] = self._keyring_file
-            self._cluster = rados.Rados(name=self._user_name, clustername=self._cluster_name, conffile=self._conf_file,
-                                        conf=conf)
-            try:
-                self._cluster.connect()
-            except rados.Error as e:
-                self._cluster = None
-                msg = e.args[0] if e.args else 'error connecting to the cluster'
-                raise RadosError(msg, errno=e.errno)
+                self.clear_cluster()
+
+        if self._shared:
+            self._cluster = self._get_shared_cluster()
+        else:
+            self._cluster = self._connect_cluster()
 
         return self._cluster
 
+    def _get_shared_cluster(self):
+        key = (os.getpid(), self._cluster_name, self._user_name, self._conf_file, self._keyring_file)
+        with _shared_clusters_lock:
+            cluster = _shared_clusters.get(key)
+            if cluster is not None:
+                if cluster.state.lower() == 'connected':
+                    return cluster
+
+                _shared_clusters.pop(key, None)
+                cluster.shutdown()
+
+            cluster = self._connect_cluster()
+            _shared_clusters[key] = cluster
+            return cluster
+
+    def _connect_cluster(self):
+        '''
+        :return: Rados()
+        :raises: class:`RadosError`
+        '''
+        conf = {'client_mount_timeout': '15', 'rados_mon_op_timeout': '15', 'rados_osd_op_timeout': '15'}
+        if self._keyring_file:
+            conf['keyring'] = self._keyring_file
+        cluster = rados.Rados(name=self._user_name, clustername=self._cluster_name, conffile=self._conf_file,
+                              conf=conf)
+        try:
+            cluster.connect()
+        except rados.Error as e:
+            msg = e.args[0] if e.args else 'error connecting to the cluster'
+            raise RadosError(msg, errno=e.errno)
+
+        return cluster
+
     def clear_cluster(self, cluster=None):
         if cluster:
             cluster.shutdown()
 
         if self._cluster is not None:
-            self._cluster.shutdown()
+            if not self._shared:    # 共享的句柄不断开，断开的共享句柄在下次获取时重新连接
+                self._cluster.shutdown()
             self._cluster = None
 
     def _io_write(self, ioctx, obj_id, offset, data: bytes):
@@ -453,6 +490,41 @@ class RadosAPI:
         except Exception as e:
             raise RadosError(str(e))
 
+    def remove_objects(self, obj_ids: list, batch_size: int = 64):
+        '''
+        异步(aio)批量删除多个rados对象，不存在的对象认为删除成功
+
+        :param obj_ids: rados对象id列表
+        :param batch_size: 同时进行的aio删除数量
+        :return:
+            {obj_id: str}   # 删除失败的rados对象和错误描述
+        :raises: class:`RadosError`
+        '''
+        cluster = self.get_cluster()
+        failed = {}
+        try:
+            with cluster.open_ioctx(self._pool_name) as ioctx:
+                for i in range(0, len(obj_ids), batch_size):
+                    completions = []
+                    for obj_id in obj_ids[i:i + batch_size]:
+                        try:
+                            completions.append((obj_id, ioctx.aio_remove(obj_id)))
+                        except rados.Error as e:
+                            failed[obj_id] = e.args[0] if e.args else f'Failed to remove rados object {obj_id}'
+
+                    for obj_id, completion in completions:
+                        completion.wait_for_complete()
+                        ret = completion.get_return_value()
+                        if ret < 0 and ret != -errno.ENOENT:
+                            failed[obj_id] = f'Failed to remove rados object {obj_id}, errno={-ret}'
+        except rados.Error as e:
+            msg = e.args[0] if e.args else f'Failed to open_ioctx({self._pool_name})'
+            raise RadosError(msg, errno=e.errno)
+        except Exception as e:
+            raise RadosError(str(e))
+
+        return failed
+
     def rados_stat(self, obj_id):
         '''
         获取rados对象大小和修改时间